@@ -2,7 +2,11 @@ from django.contrib import admin
 from base.models import *
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from base import fragments
+from base.exports import EXPORTS
 from base.forms import CustomUserCreationForm
+from base.pagination import EstimatedCountPaginator
+from base.search import index_shops
 from django import forms  # 追記
 import json  # 追記
 
@@ -16,12 +20,35 @@ class IrregularHolidayInline(admin.TabularInline):
     extra = 1   # 新規作成時や編集時に空のフォームを1つ表示
     fields = ('date',)
 
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    件数の多いテーブルの一覧
+    ・件数は推定値（絞り込み時は上限まで）で表示し、全件の COUNT(*) を行わない
+    ・会員・店舗の選択はプルダウン（全件読み込み）ではなくID入力にする
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
 @admin.register(Shop)
-class ShopAdmin(admin.ModelAdmin):
+class ShopAdmin(LargeTableAdmin):
     inlines = [TagInline, IrregularHolidayInline]
     exclude = ['tags']
+    list_display = ('name', 'code', 'category', 'is_published', 'updated_at',)
+    list_select_related = ('category',)
+    list_filter = ('is_published', 'category',)
+    # 前方一致・完全一致にしてインデックスを使う
+    search_fields = ('^name', '=code',)
+
+    # タグのインライン（自動作成の中間テーブル）の保存・削除はシグナルを送らないため、インラインの保存後に検索インデックス・キャッシュを更新する
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        index_shops([form.instance.pk])
+        fragments.bump_shop(form.instance.pk)
 
-class CustomUserAdmin(admin.ModelAdmin):
+
+class CustomUserAdmin(LargeTableAdmin):
     # 管理画面のUser詳細画面で表示される項目
     fieldsets = (
         (None, {'fields': ('username', 'email', 'password',)}),
@@ -36,7 +63,10 @@ class CustomUserAdmin(admin.ModelAdmin):
     # 管理画面のUser一覧で表示される項目
     list_display = ('username', 'email', 'is_admin', 'is_active', 'updated_at',)
     list_filter = ('is_admin', 'is_paymentstatus', 'is_active',)
-    ordering = ('-updated_at',)
+    search_fields = ('=email', '^username',)
+    date_hierarchy = 'created_at'
+    # インデックスのある登録日時の新しい順
+    ordering = ('-created_at',)
     filter_horizontal = ()
 
     # --- adminでuser作成用に追加 ---
@@ -49,6 +79,110 @@ class CustomUserAdmin(admin.ModelAdmin):
     # add_form = UserCreationForm
     add_form = CustomUserCreationForm # 修正：フォーム名変更のため
 
+# 選択した注文・予約をCSVで出力するアクション（一覧の絞り込み結果をまとめて選択した場合も1行ずつ出力する）
+@admin.action(description='選択した行をCSVで出力')
+def export_csv(modeladmin, request, queryset):
+    export = next(export for export in EXPORTS.values() if export.model is modeladmin.model)
+    return export.response(queryset)
+
+
+@admin.register(Order)
+class OrderAdmin(LargeTableAdmin):
+    list_display = ('id', 'user', 'amount', 'tax_included', 'is_confirmed', 'created_at',)
+    list_select_related = ('user',)
+    list_filter = ('is_confirmed',)
+    search_fields = ('=id', '=user__email',)
+    date_hierarchy = 'created_at'
+    ordering = ('-id',)
+    raw_id_fields = ('user',)
+    actions = [export_csv]
+
+
+@admin.register(Reserve)
+class ReserveAdmin(LargeTableAdmin):
+    list_display = ('id', 'shop', 'user', 'reserved_date', 'reserved_time', 'number_of_people',)
+    list_select_related = ('shop', 'user',)
+    search_fields = ('=id', '^shop__name', '=user__email',)
+    date_hierarchy = 'reserved_date'
+    ordering = ('-id',)
+    raw_id_fields = ('shop', 'user',)
+    actions = [export_csv]
+
+
+@admin.register(Review)
+class ReviewAdmin(LargeTableAdmin):
+    list_display = ('id', 'shop', 'user', 'stars', 'created_at',)
+    list_select_related = ('shop', 'user',)
+    list_filter = ('stars',)
+    search_fields = ('^shop__name', '=user__email',)
+    date_hierarchy = 'created_at'
+    ordering = ('-id',)
+    raw_id_fields = ('shop', 'user',)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(LargeTableAdmin):
+    list_display = ('id', 'shop', 'user', 'created_at',)
+    list_select_related = ('shop', 'user',)
+    search_fields = ('^shop__name', '=user__email',)
+    date_hierarchy = 'created_at'
+    ordering = ('-id',)
+    raw_id_fields = ('shop', 'user',)
+
+
+@admin.register(IrregularHoliday)
+class IrregularHolidayAdmin(LargeTableAdmin):
+    list_display = ('id', 'shop', 'date',)
+    list_select_related = ('shop',)
+    search_fields = ('^shop__name',)
+    date_hierarchy = 'date'
+    raw_id_fields = ('shop',)
+
+
+@admin.register(ReserveSlot)
+class ReserveSlotAdmin(LargeTableAdmin):
+    list_display = ('id', 'shop', 'reserved_date', 'reserved_time', 'reserved_people',)
+    list_select_related = ('shop',)
+    search_fields = ('^shop__name',)
+    date_hierarchy = 'reserved_date'
+    raw_id_fields = ('shop',)
+
+
+# 集計値はシグナルで更新するため、管理画面では参照のみ
+class ReadOnlyAdmin(LargeTableAdmin):
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ShopRating)
+class ShopRatingAdmin(ReadOnlyAdmin):
+    list_display = ('shop', 'review_count', 'rating_count', 'rating_sum', 'updated_at',)
+    list_select_related = ('shop',)
+    search_fields = ('^shop__name',)
+
+
+@admin.register(SalesDaily, SalesMonthly)
+class SalesRollupAdmin(ReadOnlyAdmin):
+    list_display = ('date', 'revenue', 'tax', 'orders', 'signups', 'subscriptions', 'cancellations',)
+    date_hierarchy = 'date'
+    ordering = ('-date',)
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(LargeTableAdmin):
+    list_display = ('event_id', 'type', 'status', 'attempts', 'received_at', 'processed_at',)
+    list_filter = ('status',)
+    search_fields = ('=event_id',)
+    readonly_fields = ('event_id', 'type', 'payload', 'received_at', 'processed_at',)
+
+
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'slug', ) 
     prepopulated_fields = {'slug': ('name',)}
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        # シグナルの登録
+        from base import signals  # noqa: F401
+        # check --deploy の確認の登録
+        from base import checks  # noqa: F401
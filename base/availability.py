@@ -0,0 +1,118 @@
+"""
+予約枠の空き状況を算出する
+・営業時間内を30分ごとの枠に区切る（reserve_start_time 〜 reserve_end_time）
+・固定定休日(holidays_select)と特定休業日(IrregularHoliday)は予約不可
+・枠ごとの予約人数の合計(ReserveSlot)が reserve_capacity に達した枠は満席
+月単位でキャッシュし、予約・休業日・店舗情報の変更時にバージョンを更新して破棄する
+（バージョンはデータベースに保存し（base/versions.py）、すべてのプロセスで共有する。キャッシュから消えても1に戻らない）
+"""
+
+import calendar
+import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from base import versions
+
+SLOT_MINUTES = 30
+
+# date.weekday() の順（月曜日が0）
+WEEKDAY_CODES = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+def _scope(shop_id):
+    return f'availability:{shop_id}'
+
+
+def _calendar_key(shop_id, version, year, month):
+    return f'availability:{shop_id}:{version}:{year}-{month:02d}'
+
+
+# 店舗の空き状況のキャッシュを破棄する（バージョンを更新して古いキーを参照しないようにする）
+# 予約などの変更と同じトランザクションで更新し、コミット前のバージョンで古い空き状況がキャッシュされないようにする
+def invalidate(shop_id):
+    versions.bump(_scope(shop_id))
+
+
+# 予約枠の時刻の一覧
+def slot_times(shop):
+    if not shop.reserve_start_time or not shop.reserve_end_time:
+        return []
+    today = datetime.date.today()
+    current = datetime.datetime.combine(today, shop.reserve_start_time)
+    end = datetime.datetime.combine(today, shop.reserve_end_time)
+    times = []
+    while current <= end:
+        times.append(current.time())
+        current += datetime.timedelta(minutes=SLOT_MINUTES)
+    return times
+
+
+def month_calendar(shop, year, month):
+    version = versions.get(_scope(shop.pk))
+    key = _calendar_key(shop.pk, version, year, month)
+    data = cache.get(key)
+    if data is None:
+        data = _build_month_calendar(shop, year, month)
+        cache.set(key, data, getattr(settings, 'AVAILABILITY_CACHE_TIMEOUT', 60 * 60 * 24))
+    return data
+
+
+# 1か月分の空き状況 {'2026-10-01': {'closed': False, 'slots': {'11:00': 残り人数, ...}}, ...}
+def _build_month_calendar(shop, year, month):
+    from base.models import IrregularHoliday, ReserveSlot
+
+    first = datetime.date(year, month, 1)
+    last = datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+    closed_weekdays = set(shop.holidays_select or [])
+    irregular_holidays = set(
+        IrregularHoliday.objects.filter(shop=shop, date__range=(first, last)).values_list('date', flat=True)
+    )
+    reserved = {
+        (reserved_date, reserved_time): reserved_people
+        for reserved_date, reserved_time, reserved_people in ReserveSlot.objects.filter(
+            shop=shop, reserved_date__range=(first, last),
+        ).values_list('reserved_date', 'reserved_time', 'reserved_people')
+    }
+
+    times = slot_times(shop)
+    days = {}
+    day = first
+    while day <= last:
+        closed = WEEKDAY_CODES[day.weekday()] in closed_weekdays or day in irregular_holidays
+        days[day.isoformat()] = {
+            'closed': closed,
+            'slots': {} if closed else {
+                slot.strftime('%H:%M'): max(shop.reserve_capacity - reserved.get((day, slot), 0), 0)
+                for slot in times
+            },
+        }
+        day += datetime.timedelta(days=1)
+    return days
+
+
+# 指定した月の空き状況（現在時刻より前の枠は予約不可として扱う）
+def month_availability(shop, year, month, now=None):
+    now = timezone.localtime(now or timezone.now())
+    days = {}
+    for date_str, day in month_calendar(shop, year, month).items():
+        date = datetime.date.fromisoformat(date_str)
+        slots = {
+            time_str: remaining
+            for time_str, remaining in day['slots'].items()
+            if datetime.datetime.combine(date, datetime.time.fromisoformat(time_str)) > now.replace(tzinfo=None)
+        }
+        days[date_str] = {
+            'closed': day['closed'],
+            'available': any(remaining > 0 for remaining in slots.values()),
+            'slots': slots,
+        }
+    return days
+
+
+# 指定した枠の残り人数（休業日・営業時間外の場合は None）
+def remaining_seats(shop, date, time):
+    day = month_calendar(shop, date.year, date.month)[date.isoformat()]
+    return day['slots'].get(time.strftime('%H:%M'))
@@ -0,0 +1,27 @@
+"""
+ログイン中の会員を読み込む認証バックエンド
+リクエストごとに読み込む会員の行から、Stripeの列（カード情報など）を除く（必要な画面で参照した時点で読み込まれる）
+"""
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import PermissionDenied
+
+
+def deferred_fields():
+    return [field.attname for field in get_user_model()._meta.concrete_fields if field.name.startswith('stripe_')]
+
+
+class UserBackend(ModelBackend):
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        user = super().authenticate(request, username=username, password=password, **kwargs)
+        if user is None:
+            # 既存のセッション用に残している ModelBackend で同じパスワードの確認を繰り返さない
+            raise PermissionDenied
+        return user
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        user = UserModel._default_manager.defer(*deferred_fields()).filter(pk=user_id).first()
+        return user if user is not None and self.user_can_authenticate(user) else None
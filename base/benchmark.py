@@ -0,0 +1,131 @@
+"""
+主要なページの負荷計測
+テスト用クライアント(django.test.Client)でプロセス内からリクエストを送り、
+ページごとに 1秒あたりのリクエスト数 / 応答時間のパーセンタイル / クエリ数 を集計する
+乱数の種を固定しているため、同じデータ件数で実行すれば結果をコミット間で比較できる
+"""
+
+import datetime
+import math
+import random
+import statistics
+import time
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+
+class Scenario:
+
+    def __init__(self, name, build, client='anonymous', method='get'):
+        self.name = name
+        self.build = build
+        self.client = client
+        self.method = method
+
+
+def _detail_path(name):
+    return lambda ctx, rng: (reverse(name, kwargs={'pk': rng.choice(ctx['shop_ids'])}), None)
+
+
+def _reserve_data(ctx, rng):
+    day = datetime.date.today() + datetime.timedelta(days=rng.randint(1, 30))
+    data = {
+        'reserved_date': day.isoformat(),
+        'reserved_time': f'{rng.randint(11, 20):02d}:{rng.choice([0, 30]):02d}',
+        'number_of_people': rng.randint(1, 4),
+    }
+    return reverse('reserve', kwargs={'pk': rng.choice(ctx['shop_ids'])}), data
+
+
+SCENARIOS = [
+    Scenario('index', lambda ctx, rng: (reverse('index'), None)),
+    Scenario('search_keyword', lambda ctx, rng: (reverse('restaurants_list'), {'keyword': rng.choice(['味噌カツ 栄', '手羽先', '名駅', 'きしめん'])})),
+    Scenario('search_category', lambda ctx, rng: (reverse('restaurants_list'), {'category_id': rng.choice(ctx['category_ids'])})),
+    Scenario('search_tag', lambda ctx, rng: (reverse('restaurants_list'), {'tag_id': rng.choice(ctx['tag_ids'])})),
+    Scenario('detail', _detail_path('restaurants_detail')),
+    Scenario('reviews', _detail_path('reviews'), client='member'),
+    Scenario('favorites', lambda ctx, rng: (reverse('favorites'), None), client='member'),
+    Scenario('reserve_form', _detail_path('reserve'), client='member'),
+    Scenario('reserve_create', _reserve_data, client='member', method='post'),
+    Scenario('reserve_list', lambda ctx, rng: (reverse('reserve_list'), None), client='member'),
+    Scenario('admin_summary', lambda ctx, rng: (reverse('admin_summary'), None), client='admin'),
+]
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(math.ceil(len(ordered) * percent / 100) - 1, 0)
+    return ordered[index]
+
+
+def run_scenario(scenario, client, ctx, requests, warmup=5, seed=0):
+    rng = random.Random(f'{seed}:{scenario.name}')
+    send = getattr(client, scenario.method)
+    for _ in range(warmup):
+        send(*scenario.build(ctx, rng))
+
+    rng = random.Random(f'{seed}:{scenario.name}')
+    timings = []
+    queries = []
+    statuses = {}
+    started = time.perf_counter()
+    for _ in range(requests):
+        path, data = scenario.build(ctx, rng)
+        with CaptureQueriesContext(connection) as captured:
+            request_started = time.perf_counter()
+            response = send(path, data)
+            timings.append((time.perf_counter() - request_started) * 1000)
+        queries.append(len(captured))
+        statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        'requests': requests,
+        'rps': round(requests / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'queries_median': statistics.median(queries),
+        'queries_max': max(queries),
+        'statuses': statuses,
+    }
+
+
+# clients: {'anonymous': Client, 'member': Client, 'admin': Client}
+def run(ctx, clients, requests=50, warmup=5, only=None, seed=0):
+    results = {}
+    for scenario in SCENARIOS:
+        if only and scenario.name not in only:
+            continue
+        results[scenario.name] = run_scenario(scenario, clients[scenario.client], ctx, requests, warmup, seed)
+    return results
+
+
+def make_clients(member, admin):
+    clients = {'anonymous': Client(), 'member': Client(), 'admin': Client()}
+    clients['member'].force_login(member)
+    clients['admin'].force_login(admin)
+    return clients
+
+
+# 前回の結果と比較する（p95 の増加率とクエリ数の増加を返す）
+def compare(results, baseline):
+    rows = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        p95_change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0.0
+        rows.append({
+            'name': name,
+            'p95_before': before['p95_ms'],
+            'p95_after': result['p95_ms'],
+            'p95_change': round(p95_change, 1),
+            'queries_before': before['queries_max'],
+            'queries_after': result['queries_max'],
+        })
+    return rows
+
@@ -0,0 +1,41 @@
+"""
+予約の確定処理
+予約枠ごとの予約人数(ReserveSlot)を1つのUPDATE文で条件付きに加算し、
+同時に予約が集中しても定員(Shop.reserve_capacity)を超えないようにする
+"""
+
+from django.db import transaction
+from base.models import Reserve, ReserveSlot
+
+
+class SlotFullError(Exception):
+
+    def __init__(self, remaining):
+        super().__init__(f'remaining={remaining}')
+        self.remaining = remaining
+
+
+def remaining_seats(shop, reserved_date, reserved_time):
+    reserved = ReserveSlot.objects.filter(
+        shop=shop, reserved_date=reserved_date, reserved_time=reserved_time,
+    ).values_list('reserved_people', flat=True).first() or 0
+    return max(shop.reserve_capacity - reserved, 0)
+
+
+# 定員に空きがあれば予約を作成する（満席の場合は SlotFullError）
+def book(user_id, shop, reserved_date, reserved_time, number_of_people):
+    with transaction.atomic():
+        reserved = ReserveSlot.objects.reserve(
+            shop.pk, reserved_date, reserved_time, number_of_people, capacity=shop.reserve_capacity,
+        )
+        if not reserved:
+            raise SlotFullError(remaining_seats(shop, reserved_date, reserved_time))
+
+        reserve = Reserve(
+            user_id=user_id, shop=shop, reserved_date=reserved_date,
+            reserved_time=reserved_time, number_of_people=number_of_people,
+        )
+        # 予約人数は加算済みのため、シグナルで二重に加算しない
+        reserve._slot_reserved = True
+        reserve.save(force_insert=True)
+    return reserve
@@ -0,0 +1,18 @@
+"""
+本番環境の設定の確認（python manage.py check --deploy。Procfile の release で実行する）
+"""
+
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register(deploy=True)
+def check_id_worker_id(app_configs, **kwargs):
+    # 未指定のままでは複数のサーバー(dyno)で同じワーカー番号になり、予約・注文のIDが重なるおそれがある（base/ids.py）
+    if getattr(settings, 'ID_WORKER_ID', None) in (None, ''):
+        return [Error(
+            'ID_WORKER_ID が設定されていません。',
+            hint="プロセスごとに重ならない 0〜1023 の番号か、プロセスごとにデータベースから番号を借りる 'lease' を指定してください。",
+            id='base.E001',
+        )]
+    return []
@@ -0,0 +1,12 @@
+"""
+テンプレート共通のコンテキスト
+"""
+
+from django.utils.functional import SimpleLazyObject
+from base import membership as membership_snapshot
+
+
+# ログイン中の会員のスナップショット（base/membership.py）
+# ヘッダーなどの表示に使い、user と違って会員の行を読み込まない（未ログインの場合は None）
+def membership(request):
+    return {'membership': SimpleLazyObject(lambda: membership_snapshot.get(request))}
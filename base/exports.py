@@ -0,0 +1,117 @@
+"""
+注文・予約のCSV出力（管理者用のURLと管理画面のアクションから使う）
+・会員のメールアドレス・店舗名は values_list の結合で取得し、1行ごとのクエリは発行しない
+・主キー順に一定件数ずつ読み込み、1行ずつ StreamingHttpResponse で返すため、件数が増えてもメモリ使用量は一定
+  （MySQL(PyMySQL)では .iterator() だけでは結果全体を読み込んでしまうため、主キーの範囲で区切って読み込む）
+・Excelで開けるよう、先頭にBOMを付けた UTF-8 で出力する
+"""
+
+import csv
+import datetime
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from base.models import Order, Reserve
+
+CHUNK_SIZE = 2000
+
+
+class Export:
+
+    def __init__(self, name, model, columns, date_field, shop_field=None):
+        self.name = name
+        self.model = model
+        # (見出し, values_list に渡すフィールド)
+        self.columns = columns
+        self.date_field = date_field
+        self.shop_field = shop_field
+
+    @property
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    # 期間（日付、両端を含む）と店舗で絞り込む
+    def filter(self, queryset, start=None, end=None, shop=None):
+        field = self.model._meta.get_field(self.date_field)
+        if start:
+            queryset = queryset.filter(**{self.date_field + '__gte': _bound(field, start)})
+        if end:
+            queryset = queryset.filter(**{self.date_field + '__lt': _bound(field, end + datetime.timedelta(days=1))})
+        if shop and self.shop_field:
+            queryset = queryset.filter(**{self.shop_field: shop})
+        return queryset
+
+    def rows(self, queryset, chunk_size=CHUNK_SIZE):
+        fields = ['pk', *(name for _, name in self.columns)]
+        queryset = queryset.order_by('pk').values_list(*fields)
+        last_pk = None
+        while True:
+            page = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            count = 0
+            for row in page[:chunk_size].iterator(chunk_size=chunk_size):
+                last_pk = row[0]
+                count += 1
+                yield [_format(value) for value in row[1:]]
+            if count < chunk_size:
+                return
+
+    def response(self, queryset, filename=None, chunk_size=CHUNK_SIZE):
+        filename = filename or f'{self.name}_{timezone.localdate():%Y%m%d}.csv'
+        response = StreamingHttpResponse(
+            stream_csv(self.headers, self.rows(queryset, chunk_size)),
+            content_type='text/csv; charset=utf-8',
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+# 日付を DateTimeField の場合はその日の0時（現在のタイムゾーン）にする
+def _bound(field, date):
+    if field.get_internal_type() == 'DateTimeField':
+        return timezone.make_aware(datetime.datetime.combine(date, datetime.time.min))
+    return date
+
+
+def _format(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M')
+    return value
+
+
+class Echo:
+    """csv.writer の書き込み先（書き込んだ行をそのまま返す）"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(headers, rows):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+EXPORTS = {
+    'orders': Export('orders', Order, [
+        ('注文ID', 'id'),
+        ('注文日時', 'created_at'),
+        ('会員名', 'user__username'),
+        ('メールアドレス', 'user__email'),
+        ('金額（税込）', 'amount'),
+        ('消費税額', 'tax_included'),
+        ('決済済み', 'is_confirmed'),
+    ], date_field='created_at'),
+    'reservations': Export('reservations', Reserve, [
+        ('予約番号', 'id'),
+        ('予約日', 'reserved_date'),
+        ('予約時間', 'reserved_time'),
+        ('人数', 'number_of_people'),
+        ('店舗名', 'shop__name'),
+        ('会員名', 'user__username'),
+        ('メールアドレス', 'user__email'),
+        ('予約日時', 'created_at'),
+    ], date_field='reserved_date', shop_field='shop'),
+}
@@ -3,8 +3,9 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm as BaseUserCreationForm 
 from django.contrib.auth.forms import AuthenticationForm # 追加：認証するため
 # from django.contrib.auth.forms import PasswordChangeForm # パスワード変更専用
-from base.models import Review, Reserve
-from datetime import datetime, timedelta, time
+from base.models import Review, Reserve, Shop
+from base import availability
+from datetime import datetime, time
 from django.core.exceptions import ValidationError
 from django.utils import timezone
  
@@ -135,25 +136,19 @@ class ReserveForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         shop = kwargs.pop('shop', None)
         super().__init__(*args, **kwargs)
+        self.shop = shop
 
         # 人数の選択肢: 1名から10名まで
         people_choices = [(i, f'{i}名') for i in range(1, 11)]
         self.fields['number_of_people'].widget.choices = [('', '選択してください')] + people_choices
 
-        # 予約時間の選択肢
-        if shop and shop.reserve_start_time and shop.reserve_end_time:
+        # 予約時間の選択肢（30分間隔の予約枠）
+        if shop:
             time_choices = [('', '選択してください')]
-            start_time = datetime.combine(datetime.today().date(), shop.reserve_start_time)
-            end_time = datetime.combine(datetime.today().date(), shop.reserve_end_time)
-            
-            current_time = start_time
-            # 30分間隔で選択肢を生成
-            while current_time <= end_time:
+            for slot in availability.slot_times(shop):
                 # 'HH:MM' 形式で値と表示名を設定
-                time_str = current_time.strftime('%H:%M')
+                time_str = slot.strftime('%H:%M')
                 time_choices.append((time_str, time_str))
-                # 30分追加
-                current_time += timedelta(minutes=30) 
             
             self.fields['reserved_time'].widget.choices = time_choices
 
@@ -191,5 +186,32 @@ class ReserveForm(forms.ModelForm):
                 raise forms.ValidationError(
                     "過去の日時を選択することはできません。現在時刻よりも後の日時を選択してください。"
                 )
+
+            # 休業日・満席のチェック
+            if self.shop:
+                self.clean_availability(reserve_date, reserve_time, cleaned_data.get('number_of_people'))
             
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+    def clean_availability(self, reserve_date, reserve_time, number_of_people):
+        remaining = availability.remaining_seats(self.shop, reserve_date, reserve_time)
+        if remaining is None:
+            raise forms.ValidationError("選択された日時は休業日または予約受付時間外のため予約できません。")
+        if number_of_people and remaining < number_of_people:
+            raise forms.ValidationError(
+                f"選択された時間は満席のため予約できません。（残り{remaining}名）"
+            )
+
+
+# 注文・予約のCSV出力の絞り込み（期間は両端を含む）
+class ExportFilterForm(forms.Form):
+    start = forms.DateField(required=False, label='開始日')
+    end = forms.DateField(required=False, label='終了日')
+    shop = forms.ModelChoiceField(queryset=Shop.objects.all(), required=False, label='店舗')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError('開始日は終了日以前の日付を指定してください。')
+        return cleaned_data
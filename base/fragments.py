@@ -0,0 +1,118 @@
+"""
+公開ページ（トップ / 店舗一覧 / 店舗詳細）のテンプレート断片キャッシュ
+・キャッシュのキーに店舗ごとのバージョンと、カテゴリ・タグ全体のバージョンを含める
+・店舗・レビュー・休業日の変更は該当店舗のバージョン、カテゴリ・タグの変更は全体のバージョンを更新する
+・バージョンはデータベースに保存し（base/versions.py）、変更と同じトランザクションで更新する
+  （断片キャッシュがプロセスごとでも、すべてのプロセスが同じバージョンのキーを参照する）
+・古いバージョンのキーは参照されなくなり、キャッシュの上限や有効期限で自然に削除される
+・一覧の店舗のカードはキャッシュをまとめて参照し、キャッシュがないカードだけを読み込み済みのテンプレートで描画する
+・レプリカから読み込んでいる間は、レプリカのバージョンがプライマリと異なる（変更がまだ届いていない）店舗を
+  キャッシュに保存しない（店舗詳細はビューでプライマリから読み込む）
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template import Context
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+from base import replicas, versions
+
+# settings.CACHES のキャッシュ名（テンプレートの {% cache ... using="fragments" %} と合わせる）
+CACHE_ALIAS = 'fragments'
+TAXONOMY = 'taxonomy'
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def timeout():
+    return getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def _scope(scope):
+    return f'fragments:{scope}'
+
+
+# コミット前の新しいバージョンは他のリクエストから見えないため、古いデータが新しいバージョンでキャッシュされることはない
+def bump_shop(shop_id):
+    versions.bump(_scope(f'shop:{shop_id}'))
+
+
+def bump_taxonomy():
+    versions.bump(_scope(TAXONOMY))
+
+
+# テンプレートの {% cache %} タグに渡すバージョン文字列（例: "3.1"）
+def shop_version(shop_id):
+    return shop_versions([shop_id])[shop_id]
+
+
+# 複数の店舗のバージョン文字列（バージョンは1回だけ参照する）
+def shop_versions(shop_ids):
+    return _shop_versions(shop_ids)[0]
+
+
+# 店舗のバージョン文字列と、読み込み中のレプリカに変更がまだ届いていない店舗
+# レプリカはリクエストの間同じ時点を読み込むため（base/replicas.py）、バージョンが同じならデータもその時点まで届いている
+def _shop_versions(shop_ids):
+    scopes = {shop_id: _scope(f'shop:{shop_id}') for shop_id in shop_ids}
+    keys = [*scopes.values(), _scope(TAXONOMY)]
+    current = versions.get_many(keys)
+    taxonomy = current[_scope(TAXONOMY)]
+    lagging = set()
+    replica = replicas.current()
+    if replica is not None and shop_ids:
+        seen = versions.get_many(keys, using=replica)
+        lagging = {
+            shop_id for shop_id, scope in scopes.items()
+            if seen[scope] != current[scope] or seen[_scope(TAXONOMY)] != taxonomy
+        }
+    return {shop_id: f'{current[scope]}.{taxonomy}' for shop_id, scope in scopes.items()}, lagging
+
+
+# 読み込み中のレプリカに変更がまだ届いていない店舗（レプリカから読み込んでいない場合は空）
+def lagging_shops(shop_ids):
+    return _shop_versions(shop_ids)[1]
+
+
+class CardRenderer:
+    """
+    店舗のカードのテンプレートを一度だけ読み込み、同じ Context を使い回して描画する
+    （{% include %} や render_to_string のように、カードごとにテンプレートの検索・Context の作成をしない）
+    """
+
+    def __init__(self, template_name):
+        self.template = get_template(template_name).template
+        self.context = Context(autoescape=self.template.engine.autoescape)
+
+    def render(self, shop):
+        with self.context.push(object=shop, shop=shop):
+            return self.template.render(self.context)
+
+
+def card_key(template_name, shop_id, version):
+    return f'fragments:{template_name}:{shop_id}:{version}'
+
+
+# 店舗のカードをまとめて描画する（店舗ごとにキャッシュし、キャッシュの参照・保存はまとめて行う）
+def render_shop_cards(shops, template_name):
+    if not shops:
+        return []
+    cache = _cache()
+    current, lagging = _shop_versions([shop.pk for shop in shops])
+    keys = [card_key(template_name, shop.pk, current[shop.pk]) for shop in shops]
+    cards = cache.get_many(keys)
+    missing = {key: shop for key, shop in zip(keys, shops) if key not in cards}
+    if missing:
+        renderer = CardRenderer(template_name)
+        rendered = {key: renderer.render(shop) for key, shop in missing.items()}
+        # 変更が届いていないレプリカの内容は、新しいバージョンのキーに保存しない
+        cache.set_many({key: card for key, card in rendered.items() if missing[key].pk not in lagging}, timeout())
+        cards.update(rendered)
+    return [mark_safe(cards[key]) for key in keys]
+
+
+# 店舗のカードを1件描画する
+def render_shop_card(shop, template_name):
+    return render_shop_cards([shop], template_name)[0]
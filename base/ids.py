@@ -0,0 +1,217 @@
+"""
+時刻順に並ぶ64bit整数のIDを発行する
+・上位から 経過ミリ秒(41bit) / ワーカー番号(10bit) / 連番(12bit)
+・値が作成順に増えるため、InnoDBの主キーに使ってもページ分割が起きにくい
+・複数のプロセスで重複しないよう、ワーカー番号は ID_WORKER_ID で指定する
+  'lease' の場合はプロセスごとに空いている番号をデータベース(WorkerLease)から借りる（gunicorn の複数のワーカー・複数の dyno 向け）
+  未指定の場合は 0（開発環境の1つのプロセス向け。本番環境では未指定を check --deploy でエラーにする）
+"""
+
+import datetime
+import logging
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connections
+from django.db.models import Q
+
+# 2020-01-01 00:00:00 UTC（ここから約69年分のIDを発行できる）
+EPOCH_MS = 1577836800000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# 文字列のIDに使うCrockfordのBase32（大文字・小文字を区別せず、紛らわしい文字を含まない）
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+LEASE_WORKER = 'lease'
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+# 借りているワーカー番号 (番号, 借りているプロセスの値, 期限のミリ秒)
+_lease = None
+
+
+def _reset_lease():
+    global _lease
+    _lease = None
+
+
+# fork したプロセス（gunicorn のワーカーなど）では親プロセスと別の番号を借りる
+os.register_at_fork(after_in_child=_reset_lease)
+
+
+def _now_ms():
+    return time.time_ns() // 1_000_000
+
+
+def worker_id():
+    value = getattr(settings, 'ID_WORKER_ID', None)
+    if value in (None, ''):
+        return 0
+    if value == LEASE_WORKER:
+        return _leased_worker()
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = -1
+    if not 0 <= value <= MAX_WORKER:
+        raise ImproperlyConfigured(f"ID_WORKER_ID は 0〜{MAX_WORKER} の整数か '{LEASE_WORKER}' を指定してください。")
+    return value
+
+
+# 貸し出しの読み書きには、呼び出し元のトランザクションと別の接続を使う（呼び出し元のロールバックで貸し出しが取り消されないように）
+@contextmanager
+def _lease_connection():
+    connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def _leased_worker():
+    global _lease
+
+    now = _now_ms()
+    duration = getattr(settings, 'ID_WORKER_LEASE_SECONDS', 600) * 1000
+    # 期限の半分を過ぎるまではそのまま使う（サーバー間の時計のずれの余裕を残す）
+    if _lease is not None and now < _lease[2] - duration // 2:
+        return _lease[0]
+    try:
+        with _lease_connection() as connection:
+            if _lease is None or not _renew_lease(connection, _lease[0], _lease[1], now + duration):
+                # 延長できない（期限切れの後に他のプロセスが借りた）場合は別の番号を借りる
+                _lease = _acquire_lease(connection, now, now + duration)
+            else:
+                _lease = (_lease[0], _lease[1], now + duration)
+    except DatabaseError:
+        if _lease is not None and now < _lease[2]:
+            return _lease[0]
+        # migrate の前（WorkerLease の表がない）など。保存されないモデルのインスタンス（check の User() など）の作成を止めないよう、
+        # 借りられるまではその都度ランダムな番号を返す
+        logger.warning('ID のワーカー番号を借りられませんでした。', exc_info=True)
+        return secrets.randbelow(MAX_WORKER + 1)
+    return _lease[0]
+
+
+def _lease_table(connection):
+    from base.models import WorkerLease
+
+    opts = WorkerLease._meta
+    quote = connection.ops.quote_name
+    return quote(opts.db_table), *(quote(opts.get_field(name).column) for name in ('worker', 'owner', 'expires_ms'))
+
+
+def _renew_lease(connection, worker, owner, expires_ms):
+    table, worker_column, owner_column, expires_column = _lease_table(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET {expires_column} = %s WHERE {worker_column} = %s AND {owner_column} = %s',
+            [expires_ms, worker, owner],
+        )
+        return cursor.rowcount == 1
+
+
+def _acquire_lease(connection, now, expires_ms):
+    table, worker_column, owner_column, expires_column = _lease_table(connection)
+    owner = secrets.token_hex(16)
+    random = secrets.SystemRandom()
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {worker_column}, {expires_column} FROM {table}')
+        leases = dict(cursor.fetchall())
+        # 同時に起動したプロセスと同じ番号を選びにくいよう、ランダムな順に試す
+        unused = [worker for worker in range(MAX_WORKER + 1) if worker not in leases]
+        expired = [worker for worker, expires in leases.items() if expires <= now]
+        random.shuffle(unused)
+        random.shuffle(expired)
+        for worker in unused:
+            try:
+                cursor.execute(
+                    f'INSERT INTO {table} ({worker_column}, {owner_column}, {expires_column}) VALUES (%s, %s, %s)',
+                    [worker, owner, expires_ms],
+                )
+            except IntegrityError:
+                # 他のプロセスが先に借りた
+                continue
+            return worker, owner, expires_ms
+        for worker in expired:
+            cursor.execute(
+                f'UPDATE {table} SET {owner_column} = %s, {expires_column} = %s WHERE {worker_column} = %s AND {expires_column} <= %s',
+                [owner, expires_ms, worker, now],
+            )
+            if cursor.rowcount == 1:
+                return worker, owner, expires_ms
+    raise ImproperlyConfigured(f'借りられるワーカー番号がありません（{MAX_WORKER + 1}個すべて使用中です）。')
+
+
+def compose(timestamp_ms, worker, sequence):
+    return ((timestamp_ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker << SEQUENCE_BITS) | sequence
+
+
+def next_id():
+    global _last_ms, _sequence
+
+    with _lock:
+        now = _now_ms()
+        if now <= _last_ms:
+            # 同じミリ秒内（または時計が戻った場合）は連番を進める
+            now = _last_ms
+            _sequence = (_sequence + 1) & MAX_SEQUENCE
+            if _sequence == 0:
+                # 1ミリ秒に4096件を超えた場合は次のミリ秒まで待つ
+                while now <= _last_ms:
+                    now = _now_ms()
+        else:
+            _sequence = 0
+        _last_ms = now
+        return compose(now, worker_id(), _sequence)
+
+
+# 既存データの作成日時からIDを作る（データ移行用）
+def id_from_datetime(value, sequence=0):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return compose(max(int(value.timestamp() * 1000), EPOCH_MS), 0, sequence & MAX_SEQUENCE)
+
+
+def timestamp(value):
+    ms = (value >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.datetime.fromtimestamp(ms / 1000, tz=datetime.timezone.utc)
+
+
+# 13文字の文字列ID（文字列の主キー向け。辞書順がそのまま作成順になる）
+def compact_id():
+    value = next_id()
+    chars = []
+    for _ in range(13):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def parse_id(value):
+    value = str(value)
+    if not value.isdigit():
+        return None
+    number = int(value)
+    # 旧形式のID（日時の数字の並び）は64bitに収まらない
+    return number if number < (1 << 63) else None
+
+
+# 新しい整数のIDと、移行前の文字列のID(legacy_id)のどちらでも検索できる条件
+def lookup(value):
+    number = parse_id(value)
+    if number is not None:
+        return Q(pk=number)
+    return Q(legacy_id=str(value))
@@ -0,0 +1,234 @@
+"""
+店舗画像の縮小版（一覧のカード用・詳細ページ用）の作成
+・アップロードされた画像と同じ場所に、用途ごとの幅（等倍と2倍）の WebP / JPEG を保存する
+・縮小版には位置情報などのEXIFを含めない（向きだけは画素に反映してから削除する）
+・作成した縮小版のファイル名は Shop.image_derivatives に保存し、表示時にストレージへ問い合わせない
+  （ContentAddressedStorage では名前が内容のハッシュになるため、保存済みの縮小版は保存した名前で確認し、作り直した後は使われなくなったファイルを削除する）
+・アップロード時はコミット後にバックグラウンドのスレッドで作成し、管理画面の保存を待たせない
+  （プロセスの再起動などで作成されなかった店舗は generate_image_derivatives コマンドで作成する）
+"""
+
+import io
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+from base.storage import ContentAddressedStorage
+
+logger = logging.getLogger(__name__)
+
+# アップロード時に縮小版を作成するスレッド（1件ずつ順に作成する）
+_executor = None
+
+# 用途ごとの幅（px）。2倍の縮小版は高解像度の画面用
+SIZES = {
+    'card': 480,
+    'detail': 960,
+}
+SCALES = (1, 2)
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def variant(size, scale):
+    return size if scale == 1 else f'{size}_{scale}x'
+
+
+def derivative_name(name, size, scale, fmt):
+    root, _ = os.path.splitext(name)
+    return f'{root}__{variant(size, scale)}.{"jpg" if fmt == "jpeg" else fmt}'
+
+
+def _open(storage, name):
+    with storage.open(name, 'rb') as f:
+        image = Image.open(f)
+        image.load()
+    # EXIFの向きを画素に反映する（保存時にEXIFは引き継がない）
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'L'):
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.convert('RGBA').getchannel('A'))
+        image = background
+    return image.convert('RGB')
+
+
+def _save(storage, name, data, overwrite):
+    # 内容のハッシュを名前にするストレージでは、同じ内容のファイルは保存済みの名前が返る（元の名前では確認できない）
+    if isinstance(storage, ContentAddressedStorage):
+        return storage.save(name, ContentFile(data))
+    if storage.exists(name):
+        if not overwrite:
+            return name
+        storage.delete(name)
+    return storage.save(name, ContentFile(data))
+
+
+def _names(derivatives):
+    return {name for key, files in (derivatives or {}).items() if key != 'source' for name in files.values()}
+
+
+# 縮小版を作成し、{'source': 元画像, 'card': {'webp': ..., 'jpeg': ...}, 'card_2x': {...}, ...} を返す
+# previous（保存済みの image_derivatives）が同じ元画像のもので、overwrite でなければ、ファイルが揃っている限りそのまま返す
+# 元画像を読み込めない場合は空の dict を返す
+def generate_derivatives(name, storage=None, overwrite=True, previous=None):
+    storage = storage or default_storage
+    if not overwrite and previous and previous.get('source') == name:
+        files = [(previous.get(variant(size, scale)) or {}).get(fmt) for size in SIZES for scale in SCALES for fmt in FORMATS]
+        if all(files) and all(storage.exists(file) for file in set(files)):
+            return previous
+    try:
+        original = _open(storage, name)
+    except (OSError, UnidentifiedImageError):
+        logger.warning('could not read image %s', name, exc_info=True)
+        return {}
+
+    derivatives = {'source': name}
+    for size, width in SIZES.items():
+        for scale in SCALES:
+            # 元画像より大きくはしない
+            target = min(width * scale, original.width)
+            image = original.resize((target, max(1, round(original.height * target / original.width))), Image.LANCZOS)
+            files = {}
+            for fmt, (pil_format, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                image.save(buffer, pil_format, **options)
+                files[fmt] = _save(storage, derivative_name(name, size, scale, fmt), buffer.getvalue(), overwrite)
+            derivatives[variant(size, scale)] = files
+    return derivatives
+
+
+def needs_derivatives(shop):
+    name = shop.image.name
+    return bool(name) and name != shop._meta.get_field('image').default and shop.image_derivatives.get('source') != name
+
+
+# 以前の縮小版のうち、新しい縮小版にないファイルを削除する
+# 同じ元画像を使う他の店舗がある場合は残す（ContentAddressedStorage では同じ内容の画像の縮小版は同じ名前になる）
+def delete_unused_derivatives(shop_id, previous, current, storage=None):
+    from base.models import Shop
+
+    storage = storage or default_storage
+    names = _names(previous) - _names(current)
+    if not names or Shop.objects.filter(image=previous.get('source')).exclude(pk=shop_id).exists():
+        return 0
+    for name in names:
+        storage.delete(name)
+    return len(names)
+
+
+# 店舗の画像が変わっていれば縮小版を作成して保存する
+def update_shop_derivatives(shop):
+    if not needs_derivatives(shop):
+        return False
+    previous = shop.image_derivatives
+    shop.image_derivatives = generate_derivatives(shop.image.name, shop.image.storage)
+    type(shop).objects.filter(pk=shop.pk).update(image_derivatives=shop.image_derivatives)
+    delete_unused_derivatives(shop.pk, previous, shop.image_derivatives, shop.image.storage)
+    return True
+
+
+# 保存済みの店舗の縮小版を作成し、断片キャッシュを更新する（縮小版の保存はシグナルを通らないため）
+def _update_saved_shop(shop_id):
+    from base import fragments
+    from base.models import Shop
+
+    shop = Shop.objects.filter(pk=shop_id).only('pk', 'image', 'image_derivatives').first()
+    if shop is not None and update_shop_derivatives(shop):
+        fragments.bump_shop(shop_id)
+
+
+def _update_in_background(shop_id):
+    try:
+        _update_saved_shop(shop_id)
+    except Exception:
+        logger.exception('could not create image derivatives for shop %s', shop_id)
+    finally:
+        # このスレッドで開いた接続を閉じる
+        connections.close_all()
+
+
+def _background():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-derivatives')
+    return _executor
+
+
+# 店舗の画像が変わっていれば、コミット後に縮小版を作成する（シグナルから呼び出す）
+# IMAGE_DERIVATIVES_ASYNC が False の場合は、コミット後にこのスレッドで作成する
+def schedule_shop_derivatives(shop):
+    if not needs_derivatives(shop):
+        return False
+    shop_id = shop.pk
+    if getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        transaction.on_commit(lambda: _background().submit(_update_in_background, shop_id))
+    else:
+        transaction.on_commit(lambda: _update_saved_shop(shop_id))
+    return True
+
+
+# 表示用の srcset（縮小版がない場合は None）
+def srcset(shop, size, fmt):
+    derivatives = shop.image_derivatives or {}
+    if derivatives.get('source') != shop.image.name:
+        return None
+    storage = shop.image.storage
+    entries = []
+    for scale in SCALES:
+        name = (derivatives.get(variant(size, scale)) or {}).get(fmt)
+        if not name:
+            return None
+        entries.append(f'{storage.url(name)} {scale}x')
+    return ', '.join(entries)
+
+
+def _init_worker():
+    # spawn で起動した場合は Django の初期化から行う（fork の場合は何もしない）
+    django.setup()
+
+
+def _backfill_one(args):
+    shop_id, name, previous, overwrite = args
+    return shop_id, generate_derivatives(name, overwrite=overwrite, previous=previous)
+
+
+# 既存店舗の縮小版を複数プロセスで作成する（workers が1以下の場合はこのプロセスで行う）
+# shops は (店舗ID, 元画像の名前, 保存済みの image_derivatives)
+# 子プロセスは画像の変換だけを行い、データベースへの保存・使われなくなったファイルの削除はこのプロセスで行う
+def backfill(shops, workers=None, overwrite=False, on_result=None):
+    from base.models import Shop
+
+    jobs = [(shop_id, name, previous, overwrite) for shop_id, name, previous in shops]
+    previous_derivatives = {shop_id: previous for shop_id, _, previous in shops}
+    done = 0
+
+    def save(shop_id, derivatives):
+        nonlocal done
+        Shop.objects.filter(pk=shop_id).update(image_derivatives=derivatives)
+        if derivatives:
+            delete_unused_derivatives(shop_id, previous_derivatives[shop_id], derivatives)
+        done += bool(derivatives)
+        if on_result:
+            on_result(shop_id, derivatives)
+
+    if workers is not None and workers <= 1:
+        for job in jobs:
+            save(*_backfill_one(job))
+        return done
+
+    # 子プロセスへデータベースの接続を引き継がない（トランザクション中の接続は閉じられないため残す）
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        for shop_id, derivatives in executor.map(_backfill_one, jobs, chunksize=4):
+            save(shop_id, derivatives)
+    return done
@@ -0,0 +1,149 @@
+"""
+データベースの接続方式ごとのリクエストの応答時間の比較（base.mysql）
+gunicorn の sync ワーカーと同じく、fork した複数のワーカープロセスから WSGI アプリケーションを直接呼び出す
+（django.test.Client はリクエストの開始・終了時に接続を閉じる処理を外すため使わない）
+・connect: リクエストごとに接続する（CONN_MAX_AGE=0）
+・persistent: 接続を使い回し、リクエストで最初に使う前に確認する（CONN_MAX_AGE + CONN_HEALTH_CHECKS）
+・pool: リクエストの終了時に接続をプロセス内のプールに戻す（POOL）
+MySQL へのハンドシェイクの回数と、connect と比べて1リクエストあたりに短縮できた時間を表示する
+
+例) python manage.py benchmark_connections --workers 4 --requests 500 --path /
+"""
+
+import io
+import logging
+import multiprocessing
+import time
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from base.benchmark import percentile
+from base.mysql import base as mysql_backend
+
+MODES = {
+    'connect': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'POOL': {}},
+    'persistent': {'CONN_MAX_AGE': 600, 'CONN_HEALTH_CHECKS': True, 'POOL': {}},
+    'pool': {'CONN_MAX_AGE': 0, 'CONN_HEALTH_CHECKS': False, 'POOL': {'MAX_SIZE': 1, 'IDLE_TIMEOUT': 300, 'TIMEOUT': 10}},
+}
+
+
+def _environ(path, host):
+    return {
+        'PATH_INFO': path,
+        'QUERY_STRING': '',
+        'REMOTE_ADDR': '127.0.0.1',
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'SERVER_NAME': host,
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': host,
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': io.StringIO(),
+        'wsgi.multiprocess': True,
+        'wsgi.multithread': False,
+        'wsgi.run_once': False,
+    }
+
+
+# ワーカープロセス（fork 後に呼ばれる）
+def _worker(application, path, host, requests, queue):
+    statuses = {}
+
+    def start_response(status, headers, exc_info=None):
+        code = int(status.split()[0])
+        statuses[code] = statuses.get(code, 0) + 1
+
+    mysql_backend.stats.clear()
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = application(_environ(path, host), start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            # request_finished（接続を閉じる・プールに戻す処理）は close() で送られる
+            response.close()
+        timings.append((time.perf_counter() - started) * 1000)
+    connections.close_all()
+    queue.put({'timings': timings, 'handshakes': mysql_backend.stats['handshakes'], 'statuses': statuses})
+
+
+class Command(BaseCommand):
+    help = 'データベースの接続方式（毎回接続・持続的な接続・接続プール）ごとの応答時間とハンドシェイクの回数を比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='ワーカープロセス数（gunicorn の --workers に相当）')
+        parser.add_argument('--requests', type=int, default=200, help='ワーカーごとのリクエスト数')
+        parser.add_argument('--path', default='/', help='リクエストするパス')
+        parser.add_argument('--host', default='localhost', help='Host ヘッダー（ALLOWED_HOSTS に含まれるもの）')
+        parser.add_argument('--mode', action='append', dest='modes', choices=list(MODES), help='計測する接続方式（複数指定可）')
+
+    def handle(self, *args, **options):
+        connection = connections['default']
+        if not isinstance(connection, mysql_backend.DatabaseWrapper):
+            raise CommandError("DATABASES['default'] の ENGINE が base.mysql の場合のみ計測できます。")
+
+        # 計測中はリクエストごとのログを出力しない
+        logger = logging.getLogger('base.performance')
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        original = {key: connection.settings_dict.get(key) for key in MODES['connect']}
+        try:
+            results = {mode: self.measure(connection, MODES[mode], options) for mode in options['modes'] or MODES}
+        finally:
+            connection.settings_dict.update(original)
+            logger.setLevel(level)
+
+        self.stdout.write(f'{"接続方式":<12}{"req/s":>9}{"p50":>9}{"p95":>9}{"接続回数":>10}{"接続/req":>10}  ステータス')
+        for mode, result in results.items():
+            self.stdout.write(
+                f'{mode:<12}{result["rps"]:>9.1f}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                f'{result["handshakes"]:>10}{result["handshakes_per_request"]:>10.3f}  {result["statuses"]}'
+            )
+        if 'connect' in results:
+            for mode, result in results.items():
+                if mode != 'connect':
+                    saved = results['connect']['mean_ms'] - result['mean_ms']
+                    self.stdout.write(f'{mode}: connect と比べて1リクエストあたり {saved:.2f}ms 短縮')
+        self.stdout.write(self.style.SUCCESS('計測が完了しました。'))
+
+    def measure(self, connection, mode, options):
+        connection.settings_dict.update(mode)
+        # fork する前に親プロセスの接続を閉じる（子プロセスと同じソケットを共有しない）
+        connections.close_all()
+        application = WSGIHandler()
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        workers = [
+            context.Process(target=_worker, args=(application, options['path'], options['host'], options['requests'], queue))
+            for _ in range(options['workers'])
+        ]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        reports = [queue.get() for _ in workers]
+        elapsed = time.perf_counter() - started
+        for worker in workers:
+            worker.join()
+
+        timings = [timing for report in reports for timing in report['timings']]
+        handshakes = sum(report['handshakes'] for report in reports)
+        statuses = {}
+        for report in reports:
+            for code, count in report['statuses'].items():
+                statuses[code] = statuses.get(code, 0) + count
+        return {
+            'rps': len(timings) / elapsed,
+            'mean_ms': sum(timings) / len(timings),
+            'p50_ms': percentile(timings, 50),
+            'p95_ms': percentile(timings, 95),
+            'handshakes': handshakes,
+            'handshakes_per_request': handshakes / len(timings),
+            'statuses': statuses,
+        }
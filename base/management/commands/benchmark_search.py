@@ -0,0 +1,83 @@
+"""
+店舗のキーワード検索のベンチマーク
+従来の icontains による検索と n-gram インデックスによる検索の応答時間を比較する
+ダミーデータはトランザクション内で作成し、終了時にロールバックする（--keep で残す）
+"""
+
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from base.models import Shop
+from base.search import index_shops, search_shops
+from base.seeding import seed_shops
+
+DEFAULT_QUERIES = ['味噌カツ 栄', '手羽先', '名駅', 'きしめん 大須', 'モーニング', '栄']
+
+
+# 変更前の ShopListView と同じ絞り込み（比較用）
+def legacy_keyword_filter(queryset, keyword):
+    for word in keyword.replace('　', ' ').split():
+        queryset = queryset.filter(
+            Q(name__icontains=word) |
+            Q(address__icontains=word) |
+            Q(description__icontains=word) |
+            Q(tags__name__icontains=word) |
+            Q(category__name__icontains=word)
+        )
+    return queryset
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'キーワード検索の従来方式とインデックス方式の応答時間を比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=100000, help='作成するダミー店舗数')
+        parser.add_argument('--repeat', type=int, default=5, help='各検索の実行回数')
+        parser.add_argument('--limit', type=int, default=20, help='取得件数（1ページ分）')
+        parser.add_argument('--query', action='append', dest='queries', help='検索キーワード（複数指定可）')
+        parser.add_argument('--keep', action='store_true', help='作成したダミーデータを残す')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.run(options)
+                if not options['keep']:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write('ダミーデータをロールバックしました。')
+
+    def run(self, options):
+        started = time.perf_counter()
+        shop_ids = seed_shops(options['shops'], rng=random.Random(0))
+        self.stdout.write(f'ダミー店舗 {len(shop_ids)} 件を作成しました（{time.perf_counter() - started:.1f}秒）')
+
+        started = time.perf_counter()
+        index_shops(shop_ids, batch_size=1000)
+        self.stdout.write(f'検索インデックスを作成しました（{time.perf_counter() - started:.1f}秒）')
+
+        base = Shop.objects.published()
+        limit = options['limit']
+        self.stdout.write(f'{"キーワード":<16}{"件数":>8}{"従来(ms)":>12}{"索引(ms)":>12}')
+        for keyword in options['queries'] or DEFAULT_QUERIES:
+            legacy = legacy_keyword_filter(base, keyword).order_by('created_at')
+            indexed = search_shops(base, keyword).order_by('-search_score', 'created_at')
+            legacy_ms = self.measure(lambda: list(legacy[:limit]) and legacy.count(), options['repeat'])
+            indexed_ms = self.measure(lambda: list(indexed[:limit]) and indexed.count(), options['repeat'])
+            self.stdout.write(f'{keyword:<16}{indexed.count():>8}{legacy_ms:>12.1f}{indexed_ms:>12.1f}')
+
+    @staticmethod
+    def measure(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
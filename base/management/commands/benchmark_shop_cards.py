@@ -0,0 +1,109 @@
+"""
+店舗のカードの描画方式ごとの所要時間の比較（base.fragments.CardRenderer）
+データベースを使わず、メモリ上の店舗のカードを描画する
+・include: {% for %} の中で {% include %} する（変更前のトップページと同じ）
+・render_to_string: カードごとに render_to_string する（変更前の shop_box タグのキャッシュがない場合と同じ）
+・compiled: テンプレートを一度だけ読み込み、同じ Context で描画する（CardRenderer）
+・shop_box (cached): カードごとに断片キャッシュを参照する（変更前の shop_box タグ）
+・shop_cards (cached): 断片キャッシュをまとめて参照する（shop_cards タグ）
+断片キャッシュは実際の店舗と重ならないよう負の店舗IDで保存し、終了時に削除する
+
+例) python manage.py benchmark_shop_cards --cards 1000 --repeat 5
+"""
+
+import statistics
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+from django.template.loader import render_to_string
+from base import fragments
+from base.fragments import CardRenderer
+from base.models import Category, Shop
+
+
+def make_shops(count):
+    categories = [Category(pk=i, name=f'カテゴリー{i}') for i in range(1, 7)]
+    shops = []
+    for i in range(1, count + 1):
+        shop = Shop(pk=-i, name=f'店舗{i}', category=categories[i % len(categories)], is_published=True)
+        # ShopQuerySet.with_rating() で付ける値
+        shop.average_rating = (i % 50) / 10
+        shop.review_count = i % 30
+        shops.append(shop)
+    return shops
+
+
+def render_include(shops, template_name):
+    template = engines['django'].from_string('{% for object in shops %}{% include template_name %}{% endfor %}')
+    return template.render({'shops': shops, 'template_name': template_name})
+
+
+def render_each(shops, template_name):
+    return ''.join(render_to_string(template_name, {'object': shop, 'shop': shop}) for shop in shops)
+
+
+def render_compiled(shops, template_name):
+    renderer = CardRenderer(template_name)
+    return ''.join(renderer.render(shop) for shop in shops)
+
+
+def render_cached_each(shops, template_name):
+    return ''.join(fragments.render_shop_card(shop, template_name) for shop in shops)
+
+
+def render_cached_batch(shops, template_name):
+    return ''.join(fragments.render_shop_cards(shops, template_name))
+
+
+METHODS = {
+    'include': render_include,
+    'render_to_string': render_each,
+    'compiled': render_compiled,
+    'shop_box (cached)': render_cached_each,
+    'shop_cards (cached)': render_cached_batch,
+}
+
+
+class Command(BaseCommand):
+    help = '店舗のカードの描画方式（include / render_to_string / 読み込み済みのテンプレート / 断片キャッシュの参照方法）ごとの所要時間を比較します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=1000, help='描画するカードの枚数')
+        parser.add_argument('--repeat', type=int, default=5, help='各方式の実行回数')
+        parser.add_argument('--template', default='snippets/shop_box.html', help='カードのテンプレート')
+
+    def handle(self, *args, **options):
+        shops = make_shops(options['cards'])
+        template_name = options['template']
+
+        outputs = {}
+        timings = {}
+        try:
+            for name, render in METHODS.items():
+                # 1回目はテンプレートの読み込み・キャッシュへの保存を含むため計測しない
+                outputs[name] = render(shops, template_name)
+                timings[name] = self.measure(lambda: render(shops, template_name), options['repeat'])
+        finally:
+            versions = fragments.shop_versions([shop.pk for shop in shops])
+            caches[fragments.CACHE_ALIAS].delete_many([
+                fragments.card_key(template_name, shop.pk, versions[shop.pk]) for shop in shops
+            ])
+        if len({output for output in outputs.values()}) != 1:
+            raise CommandError('描画方式によって出力が異なります。')
+
+        self.stdout.write(f'{"描画方式":<20}{"合計(ms)":>10}{"1枚(µs)":>10}{"倍率":>8}')
+        base = timings['include']
+        for name, ms in timings.items():
+            self.stdout.write(f'{name:<20}{ms:>10.1f}{ms * 1000 / len(shops):>10.1f}{base / ms:>8.2f}')
+        self.stdout.write(self.style.SUCCESS(f'{len(shops)}枚のカードを描画しました。'))
+
+    @staticmethod
+    def measure(func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,137 @@
+"""
+主要なページの負荷計測（base.benchmark）
+ダミーデータはトランザクション内で作成し、終了時にロールバックする（--keep で残す）
+結果をJSONで保存し、--baseline で前回の結果と比較する
+
+例) python manage.py benchmark_views --output bench/HEAD.json --baseline bench/main.json --fail-threshold 20
+"""
+
+import json
+import logging
+import platform
+import random
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from base import benchmark
+from base.models import Category, Tag, User
+from base.seeding import seed_dataset
+
+
+class Rollback(Exception):
+    pass
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+class Command(BaseCommand):
+    help = '主要なページの応答時間・クエリ数を計測します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=1000, help='作成するダミー店舗数')
+        parser.add_argument('--users', type=int, default=200, help='作成するダミー会員数')
+        parser.add_argument('--requests', type=int, default=50, help='ページごとのリクエスト数')
+        parser.add_argument('--warmup', type=int, default=5, help='計測前に送るリクエスト数')
+        parser.add_argument('--only', action='append', help='計測するページ（複数指定可）')
+        parser.add_argument('--output', help='結果を保存するJSONファイル')
+        parser.add_argument('--baseline', help='比較する前回の結果のJSONファイル')
+        parser.add_argument('--fail-threshold', type=float, help='p95 がこの割合(%%)を超えて悪化した場合、またはクエリ数が増えた場合にエラーにする')
+        parser.add_argument('--keep', action='store_true', help='作成したダミーデータを残す')
+
+    def handle(self, *args, **options):
+        unknown = set(options['only'] or []) - {scenario.name for scenario in benchmark.SCENARIOS}
+        if unknown:
+            raise CommandError(f'不明なページ: {", ".join(sorted(unknown))}')
+
+        # 計測中はリクエストごとのログを出力しない
+        logger = logging.getLogger('base.performance')
+        level = logger.level
+        logger.setLevel(logging.ERROR)
+        try:
+            with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                with transaction.atomic():
+                    report = self.run(options)
+                    if not options['keep']:
+                        transaction.set_rollback(True)
+        finally:
+            logger.setLevel(level)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            self.stdout.write(f'結果を {options["output"]} に保存しました。')
+
+        if options['baseline']:
+            self.compare(report, options)
+
+    def run(self, options):
+        started = time.perf_counter()
+        shop_ids, user_ids, counts = seed_dataset(shops=options['shops'], users=options['users'], rng=random.Random(0))
+        self.stdout.write(f'ダミーデータを作成しました（{time.perf_counter() - started:.1f}秒）: {counts}')
+
+        member = User.objects.filter(pk__in=user_ids, is_paymentstatus=True).order_by('pk').first()
+        admin = User.objects.create(username='benchmark-admin', email='benchmark-admin@example.com', is_admin=True)
+
+        ctx = {
+            'shop_ids': shop_ids,
+            'category_ids': list(Category.objects.values_list('pk', flat=True)),
+            'tag_ids': list(Tag.objects.values_list('pk', flat=True)),
+        }
+        results = benchmark.run(
+            ctx, benchmark.make_clients(member, admin),
+            requests=options['requests'], warmup=options['warmup'], only=options['only'],
+        )
+
+        self.stdout.write(f'{"ページ":<18}{"req/s":>9}{"p50":>9}{"p95":>9}{"p99":>9}{"クエリ":>8}  ステータス')
+        for name, result in results.items():
+            self.stdout.write(
+                f'{name:<18}{result["rps"]:>9.1f}{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}'
+                f'{result["p99_ms"]:>9.1f}{result["queries_max"]:>8}  {result["statuses"]}'
+            )
+
+        return {
+            'meta': {
+                'revision': git_revision(),
+                'created_at': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'requests': options['requests'],
+                'dataset': counts,
+            },
+            'results': results,
+        }
+
+    def compare(self, report, options):
+        with open(options['baseline'], encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline['meta'].get('dataset') != report['meta']['dataset']:
+            self.stdout.write(self.style.WARNING('データ件数が異なるため、結果を単純に比較できません。'))
+
+        self.stdout.write(f'{"ページ":<18}{"p95 前回":>10}{"p95 今回":>10}{"増減(%)":>9}{"クエリ":>10}')
+        regressions = []
+        for row in benchmark.compare(report['results'], baseline['results']):
+            queries = f'{row["queries_before"]}→{row["queries_after"]}'
+            self.stdout.write(
+                f'{row["name"]:<18}{row["p95_before"]:>10.1f}{row["p95_after"]:>10.1f}{row["p95_change"]:>9.1f}{queries:>10}'
+            )
+            threshold = options['fail_threshold']
+            if threshold is not None and (row['p95_change'] > threshold or row['queries_after'] > row['queries_before']):
+                regressions.append(row['name'])
+
+        if regressions:
+            raise CommandError(f'性能が悪化しました: {", ".join(regressions)}')
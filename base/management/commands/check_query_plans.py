@@ -0,0 +1,55 @@
+"""
+主要なページのクエリの実行計画を確認し、全件走査になっているクエリがあればエラーにする（base.query_plans）
+ダミーデータはトランザクション内で作成し、終了時にロールバックする（--no-seed で既存のデータに対して確認する）
+
+例) python manage.py check_query_plans --shops 5000 --users 1000 --verbose
+"""
+
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from base import query_plans
+from base.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    help = '主要なページのクエリを EXPLAIN し、全件走査になっているクエリがあればエラーにします。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=2000, help='作成するダミー店舗数')
+        parser.add_argument('--users', type=int, default=500, help='作成するダミー会員数')
+        parser.add_argument('--no-seed', action='store_true', help='ダミーデータを作成せず、既存のデータで確認する')
+        parser.add_argument('--only', action='append', help='確認するクエリ（複数指定可）')
+        parser.add_argument('--verbose', action='store_true', help='すべての実行計画を表示する')
+
+    def handle(self, *args, **options):
+        unknown = set(options['only'] or []) - {check.name for check in query_plans.CHECKS}
+        if unknown:
+            raise CommandError(f'不明なクエリ: {", ".join(sorted(unknown))}')
+
+        with transaction.atomic():
+            if not options['no_seed']:
+                counts = seed_dataset(shops=options['shops'], users=options['users'], rng=random.Random(0))[2]
+                self.stdout.write(f'ダミーデータを作成しました: {counts}')
+                # PostgreSQL は統計情報を更新しないと件数の少ないテーブルとして計画される
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+            results = query_plans.run(only=options['only'])
+            transaction.set_rollback(True)
+
+        failures = []
+        for result in results:
+            ok = not result['full_scans']
+            label = 'OK' if ok else '全件走査'
+            self.stdout.write(f'{result["name"]:<16}{result["view"]:<30}{label}')
+            if not ok or options['verbose']:
+                for line in result['plan']:
+                    self.stdout.write(f'    {line}')
+            if not ok:
+                failures.append(result['name'])
+
+        if failures:
+            raise CommandError(f'全件走査になっているクエリがあります: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS(f'{len(results)}件のクエリはすべてインデックスを使用しています。'))
@@ -0,0 +1,34 @@
+"""
+店舗データを JSONL / CSV に出力するコマンド（import_shops で読み込める形式）
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from base import shop_io
+
+
+class Command(BaseCommand):
+    help = '店舗データを JSONL / CSV に出力します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-',
+                            help='出力先のファイル（未指定または - の場合は標準出力）')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='ファイル形式（未指定の場合は拡張子から判定）')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='一度に読み込む店舗数')
+        parser.add_argument('--published', action='store_true',
+                            help='公開中の店舗だけを出力する')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        queryset = shop_io.Shop.objects.published() if options['published'] else None
+        try:
+            stream = self.stdout if path == '-' else open(path, 'w', encoding='utf-8', newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+        count = shop_io.export_shops(stream, format=format, chunk_size=options['chunk_size'], queryset=queryset)
+        if path != '-':
+            stream.close()
+            self.stdout.write(self.style.SUCCESS(f'{count}店舗を出力しました'))
@@ -0,0 +1,39 @@
+"""
+既存店舗の画像の縮小版（base/images.py）を複数プロセスで一括作成するコマンド
+"""
+
+import os
+
+from django.core.management.base import BaseCommand
+from base import fragments, images
+from base.models import Shop
+
+
+class Command(BaseCommand):
+    help = '店舗画像の縮小版（WebP / JPEG）を一括で作成します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', dest='shop_ids',
+                            help='対象の店舗ID（複数指定可。未指定の場合は縮小版のない全店舗）')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='画像を変換するプロセス数（1の場合はこのプロセスで変換する）')
+        parser.add_argument('--force', action='store_true',
+                            help='作成済みの店舗・ファイルも作り直す')
+
+    def handle(self, *args, **options):
+        shops = Shop.objects.exclude(image='').exclude(image=Shop._meta.get_field('image').default)
+        if options['shop_ids']:
+            shops = shops.filter(pk__in=options['shop_ids'])
+        if not options['force']:
+            shops = [shop for shop in shops.only('pk', 'image', 'image_derivatives') if images.needs_derivatives(shop)]
+
+        targets = [(shop.pk, shop.image.name, shop.image_derivatives) for shop in shops]
+
+        def report(shop_id, derivatives):
+            if derivatives:
+                fragments.bump_shop(shop_id)
+            else:
+                self.stderr.write(f'店舗{shop_id}: 画像を読み込めませんでした')
+
+        done = images.backfill(targets, workers=options['workers'], overwrite=options['force'], on_result=report)
+        self.stdout.write(self.style.SUCCESS(f'縮小版を作成しました（{done}/{len(targets)}店舗）'))
@@ -0,0 +1,49 @@
+"""
+店舗データを JSONL / CSV から一括登録するコマンド（店舗コードが一致する店舗は更新する）
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from base import shop_io
+
+
+class Command(BaseCommand):
+    help = '店舗データを JSONL / CSV から一括で登録・更新します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='読み込むファイル（- の場合は標準入力）')
+        parser.add_argument('--format', choices=('jsonl', 'csv'),
+                            help='ファイル形式（未指定の場合は拡張子から判定）')
+        parser.add_argument('--chunk-size', type=int, default=2000,
+                            help='一度に登録する店舗数')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='検証と件数の確認だけを行い、登録しない')
+        parser.add_argument('--no-index', action='store_true',
+                            help='検索インデックスを更新しない（登録後に rebuild_search_index を実行する場合）')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        try:
+            stream = sys.stdin if path == '-' else open(path, encoding='utf-8-sig', newline='')
+        except OSError as e:
+            raise CommandError(e)
+
+        with stream:
+            result = shop_io.import_shops(
+                stream, format=format, chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'], index=not options['no_index'],
+            )
+
+        for line_no, message in result.errors[:100]:
+            self.stderr.write(f'{line_no}行目: {message}')
+        if len(result.errors) > 100:
+            self.stderr.write(f'ほか{len(result.errors) - 100}件のエラー')
+
+        prefix = '（確認のみ）' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}新規{result.created}件・更新{result.updated}件・エラー{len(result.errors)}件'
+        ))
+        if result.created and not options['dry_run']:
+            self.stdout.write('画像の縮小版は generate_image_derivatives で作成してください。')
@@ -0,0 +1,31 @@
+"""
+webhookで受信したStripeのイベントを会員・注文に反映するワーカー
+Procfile の worker プロセスとして常駐させる（--once で未処理分だけ処理して終了する）
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from base.stripe_events import process_pending
+
+
+class Command(BaseCommand):
+    help = 'webhookで受信したStripeのイベントを会員・注文に反映します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='未処理のイベントを処理したら終了する')
+        parser.add_argument('--interval', type=float, default=2.0, help='未処理のイベントがない場合の待ち時間（秒）')
+        parser.add_argument('--batch-size', type=int, default=100, help='一度に処理する件数')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = process_pending(limit=options['batch_size'])
+            if processed:
+                self.stdout.write(f'{processed}件のイベントを反映しました。')
+            if options['once']:
+                return
+            if processed < options['batch_size']:
+                # 長時間待機しても接続が切れたままにならないようにする
+                close_old_connections()
+                time.sleep(options['interval'])
@@ -0,0 +1,14 @@
+"""
+売上・会員数の日次／月次集計(SalesDaily / SalesMonthly)を注文・会員テーブルと有料会員の登録・解約の履歴(MembershipChange)から一括で作り直すコマンド
+"""
+
+from django.core.management.base import BaseCommand
+from base.models import rebuild_sales
+
+
+class Command(BaseCommand):
+    help = '売上・会員数の日次／月次集計を注文・会員テーブルと有料会員の登録・解約の履歴から再構築します。'
+
+    def handle(self, *args, **options):
+        days, months = rebuild_sales()
+        self.stdout.write(self.style.SUCCESS(f'売上集計を再構築しました（{days}日 / {months}か月）'))
@@ -0,0 +1,20 @@
+"""
+店舗検索用のn-gramインデックスを一括で作り直すコマンド
+"""
+
+from django.core.management.base import BaseCommand
+from base.models import ShopSearchDocument
+from base.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = '店舗検索用のインデックスを全店舗分作り直します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='一度に処理する店舗数')
+
+    def handle(self, *args, **options):
+        rebuild_index(batch_size=options['batch_size'])
+        count = ShopSearchDocument.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'検索インデックスを再構築しました（{count}店舗）'))
@@ -0,0 +1,21 @@
+"""
+店舗ごとの評価集計(ShopRating)をReviewテーブルから一括で作り直すコマンド
+"""
+
+from django.core.management.base import BaseCommand
+from base.models import ShopRating
+
+
+class Command(BaseCommand):
+    help = '店舗ごとの評価集計をレビューから一括で再構築します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shop', type=int, action='append', dest='shop_ids',
+                            help='対象の店舗ID（複数指定可。未指定の場合は全店舗）')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='一度に書き込む件数')
+
+    def handle(self, *args, **options):
+        ShopRating.objects.rebuild(shop_ids=options['shop_ids'], batch_size=options['batch_size'])
+        count = ShopRating.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'評価集計を再構築しました（{count}店舗）'))
@@ -0,0 +1,62 @@
+"""
+疑似的なStripeのイベントをwebhookに送信するコマンド（オフラインでの動作確認用）
+--url を指定しない場合はプロセス内でwebhookのビューを呼び出す
+
+例) python manage.py send_fake_stripe_events member@example.com --process
+"""
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+from base.models import User
+from base.stripe_events import process_pending
+from base.stripe_fake import FakeStripeEvents
+
+
+class Command(BaseCommand):
+    help = '疑似的なStripeのイベント（有料会員登録・解約）をwebhookに送信します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='対象の会員のメールアドレス')
+        parser.add_argument('--scenario', choices=['subscribe', 'cancel'], default='subscribe')
+        parser.add_argument('--url', help='送信先のwebhookのURL（例: http://localhost:8000/subscription/webhook/）')
+        parser.add_argument('--reverse', action='store_true', help='イベントを逆順に送信する（到着順の入れ替わりの確認用）')
+        parser.add_argument('--process', action='store_true', help='送信後にワーカーの処理を1回実行する')
+
+    def handle(self, *args, **options):
+        if not settings.STRIPE_WEBHOOK_SECRET:
+            raise CommandError('STRIPE_WEBHOOK_SECRET を設定してください。')
+        user = User.objects.filter(email=options['email']).first()
+        if user is None:
+            raise CommandError(f'会員が見つかりません: {options["email"]}')
+
+        fake = FakeStripeEvents()
+        if options['scenario'] == 'subscribe':
+            events = fake.subscribe(user)
+        else:
+            if not user.stripe_subscription_id:
+                raise CommandError('有料会員ではありません。')
+            events = [fake.subscription_deleted(user.stripe_subscription_id)]
+        if options['reverse']:
+            events.reverse()
+
+        for event in events:
+            status = self.send(fake, event, options['url'])
+            self.stdout.write(f'{event["type"]} ({event["id"]}): {status}')
+
+        if options['process']:
+            self.stdout.write(f'{process_pending()}件のイベントを反映しました。')
+
+    def send(self, fake, event, url):
+        payload, signature = fake.signed(event)
+        headers = {'Content-Type': 'application/json', 'Stripe-Signature': signature}
+        if url:
+            return requests.post(url, data=payload.encode('utf-8'), headers=headers, timeout=10).status_code
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            response = Client().post(
+                reverse('stripe_webhook'), payload, content_type='application/json', HTTP_STRIPE_SIGNATURE=signature,
+            )
+        return response.status_code
@@ -0,0 +1,110 @@
+"""
+ログイン中の会員の種別（有料会員・管理者）のスナップショット
+・会員ID・ユーザー名・有料会員か・管理者かを署名付きでセッションに保存する
+・有料会員向けページの権限確認とヘッダーなどの表示はスナップショットだけで行い、会員の行（Stripeの列を含む）を読み込まない
+・有効期限（MEMBERSHIP_SNAPSHOT_TTL 秒）を過ぎた場合と、会員の情報が変更された場合（base/versions.py の会員ごとのバージョンで判定。すべてのプロセスで共有する）はデータベースから読み直す
+・読み直す際に、パスワード変更前のセッションでないか（セッションのハッシュ）と無効な会員でないかを確認する
+"""
+
+from dataclasses import asdict, dataclass
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.core import signing
+from django.utils.crypto import constant_time_compare
+from base import versions
+
+SESSION_KEY_NAME = '_membership'
+SALT = 'base.membership'
+# 変更された場合にスナップショットを読み直す User の項目
+FIELDS = {'username', 'is_paymentstatus', 'is_admin', 'is_active', 'password'}
+
+
+@dataclass(frozen=True)
+class Membership:
+    user_id: str
+    username: str
+    is_paymentstatus: bool
+    is_admin: bool
+
+    # テンプレートで user と同じように使えるようにする
+    is_authenticated = True
+
+
+def ttl():
+    return getattr(settings, 'MEMBERSHIP_SNAPSHOT_TTL', 300)
+
+
+def _scope(user_id):
+    return f'membership:{user_id}'
+
+
+def version(user_id):
+    return versions.get(_scope(user_id))
+
+
+# 会員の情報が変わった場合に、その会員のすべてのセッションのスナップショットを読み直させる（シグナルから呼び出す）
+# バージョンは会員の変更と同じトランザクションで更新する
+def invalidate(user_id):
+    versions.bump(_scope(user_id))
+
+
+def _load(request, user_id):
+    from base.models import User
+
+    user = (
+        User.objects.filter(pk=user_id)
+        .only('pk', 'password', 'username', 'is_paymentstatus', 'is_admin', 'is_active')
+        .first()
+    )
+    if user is None or not user.is_active:
+        return None
+    # パスワードを変更した場合は、変更前のセッションをログイン中として扱わない（AuthenticationMiddleware と同じ確認）
+    session_hash = request.session.get(HASH_SESSION_KEY)
+    if not session_hash or not constant_time_compare(session_hash, user.get_session_auth_hash()):
+        return None
+    return user
+
+
+# 会員のスナップショットをセッションに保存する（ログイン時はシグナルから、読み込み済みの会員で呼び出す）
+# version は会員を読み込む前に取得した値を渡す（読み込み中に変更された場合は次のリクエストで読み直される）
+def store(request, user, current=None):
+    membership = None
+    if user is not None:
+        membership = Membership(user.pk, user.username, user.is_paymentstatus, user.is_admin)
+        request.session[SESSION_KEY_NAME] = signing.dumps(
+            {'version': version(user.pk) if current is None else current, **asdict(membership)},
+            salt=SALT, compress=True,
+        )
+    else:
+        request.session.pop(SESSION_KEY_NAME, None)
+    request._membership = membership
+    return membership
+
+
+# データベースから読み直してセッションに保存する（有料会員の登録・解約の直後に呼び出す）
+def refresh(request):
+    user_id = request.session.get(SESSION_KEY)
+    current = version(user_id)
+    return store(request, _load(request, user_id) if user_id is not None else None, current)
+
+
+def get(request):
+    """ログイン中の会員のスナップショット（未ログイン・無効なセッションの場合は None）"""
+    if hasattr(request, '_membership'):
+        return request._membership
+    user_id = request.session.get(SESSION_KEY)
+    if user_id is None:
+        request._membership = None
+        return None
+
+    data = request.session.get(SESSION_KEY_NAME)
+    if data:
+        try:
+            payload = signing.loads(data, salt=SALT, max_age=ttl())
+        except signing.BadSignature:
+            payload = None
+        if payload and payload.pop('user_id') == user_id and payload.pop('version') == version(user_id):
+            request._membership = Membership(user_id, **payload)
+            return request._membership
+    return refresh(request)
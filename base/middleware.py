@@ -0,0 +1,88 @@
+"""
+リクエストごとのSQL実行状況を計測するミドルウェア
+・クエリ数 / DB処理時間の合計 / 最も遅いSQL / ビュー名 を記録する
+・Server-Timing ヘッダーとログ(JSON形式)に出力する
+・設定したしきい値を超えたビューは警告としてログに出力する
+"""
+
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('base.performance')
+
+
+class QueryStats:
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest_sql = ''
+        self.slowest_duration = 0.0
+
+    # connection.execute_wrapper から呼び出される
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest_duration:
+                self.slowest_duration = duration
+                self.slowest_sql = sql
+
+
+class QueryInstrumentationMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'QUERY_INSTRUMENTATION_ENABLED', True)
+        self.warning_queries = getattr(settings, 'QUERY_COUNT_WARNING_THRESHOLD', 50)
+        self.warning_ms = getattr(settings, 'QUERY_TIME_WARNING_THRESHOLD_MS', 500)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            # 全てのDB接続（レプリカを含む）を対象にする
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - started) * 1000
+
+        match = request.resolver_match
+        view_name = (match.view_name or match._func_path) if match else ''
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={stats.duration:.1f};desc="{stats.count} queries"',
+            f'total;dur={total_ms:.1f}',
+        ])
+        self.log(request, response, view_name, stats, total_ms)
+        return response
+
+    def log(self, request, response, view_name, stats, total_ms):
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'queries': stats.count,
+            'db_ms': round(stats.duration, 1),
+            'total_ms': round(total_ms, 1),
+            'slowest_ms': round(stats.slowest_duration, 1),
+            'slowest_sql': stats.slowest_sql[:500],
+        }
+        message = json.dumps(record, ensure_ascii=False)
+        if stats.count > self.warning_queries or stats.duration > self.warning_ms:
+            logger.warning(message)
+        else:
+            logger.info(message)
@@ -0,0 +1,57 @@
+# Generated by Django 4.0 on 2026-10-18 17:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Q, Sum
+
+
+# 既存のレビューから評価集計を作成する
+def populate_shop_ratings(apps, schema_editor):
+    Shop = apps.get_model('base', 'Shop')
+    Review = apps.get_model('base', 'Review')
+    ShopRating = apps.get_model('base', 'ShopRating')
+
+    stats = Review.objects.values('shop_id').annotate(
+        review_count=Count('id'),
+        rating_count=Count('stars'),
+        rating_sum=Sum('stars'),
+        **{f'star_{i}': Count('id', filter=Q(stars=i)) for i in range(1, 6)},
+    ).order_by()
+    stats = {row.pop('shop_id'): row for row in stats}
+
+    ratings = []
+    for shop_id in Shop.objects.values_list('pk', flat=True):
+        row = stats.get(shop_id, {})
+        row['rating_sum'] = row.get('rating_sum') or 0
+        ratings.append(ShopRating(shop_id=shop_id, **row))
+    ShopRating.objects.bulk_create(ratings, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0008_remove_order_canceled_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopRating',
+            fields=[
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='base.shop', verbose_name='店舗')),
+                ('review_count', models.PositiveIntegerField(default=0, verbose_name='レビュー件数')),
+                ('rating_count', models.PositiveIntegerField(default=0, verbose_name='評価件数')),
+                ('rating_sum', models.PositiveIntegerField(default=0, verbose_name='評価合計')),
+                ('star_1', models.PositiveIntegerField(default=0, verbose_name='★1')),
+                ('star_2', models.PositiveIntegerField(default=0, verbose_name='★2')),
+                ('star_3', models.PositiveIntegerField(default=0, verbose_name='★3')),
+                ('star_4', models.PositiveIntegerField(default=0, verbose_name='★4')),
+                ('star_5', models.PositiveIntegerField(default=0, verbose_name='★5')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '店舗評価集計',
+                'verbose_name_plural': '店舗評価集計',
+            },
+        ),
+        migrations.RunPython(populate_shop_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 4.0 on 2026-10-18 17:27
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# base/search.py の作成時点の分割方法（後で base/search.py を変更しても、このマイグレーションの結果は変わらない）
+FIELD_WEIGHTS = {
+    'name': 4,
+    'category': 2,
+    'tags': 2,
+    'address': 2,
+    'description': 1,
+}
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def index_grams(segment):
+    if len(segment) == 1:
+        return [segment]
+    return [segment[i:i + 2] for i in range(len(segment) - 1)] + list(segment)
+
+
+def document_grams(fields):
+    grams = Counter()
+    for field, text in fields.items():
+        for segment in WORD_RE.findall(normalize(text)):
+            for gram in index_grams(segment):
+                grams[gram] += FIELD_WEIGHTS[field]
+    return grams
+
+
+# 既存の店舗の検索インデックスを作成する
+def populate_search_index(apps, schema_editor):
+    Shop = apps.get_model('base', 'Shop')
+    ShopSearchDocument = apps.get_model('base', 'ShopSearchDocument')
+    ShopSearchGram = apps.get_model('base', 'ShopSearchGram')
+
+    for shop in Shop.objects.select_related('category').prefetch_related('tags').iterator(chunk_size=500):
+        fields = {
+            'name': shop.name,
+            'category': shop.category.name if shop.category else '',
+            'tags': ' '.join(tag.name for tag in shop.tags.all()),
+            'address': shop.address,
+            'description': shop.description,
+        }
+        ShopSearchDocument.objects.create(shop=shop, text=normalize(' '.join(fields.values())))
+        ShopSearchGram.objects.bulk_create(
+            ShopSearchGram(shop=shop, gram=gram, weight=weight)
+            for gram, weight in document_grams(fields).items()
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0009_shoprating'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopSearchDocument',
+            fields=[
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='base.shop', verbose_name='店舗')),
+                ('text', models.TextField(blank=True, default='', verbose_name='検索用テキスト')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': '検索用ドキュメント',
+                'verbose_name_plural': '検索用ドキュメント',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShopSearchGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=2, verbose_name='n-gram')),
+                ('weight', models.PositiveIntegerField(default=0, verbose_name='重み')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_grams', to='base.shop', verbose_name='店舗')),
+            ],
+            options={
+                'verbose_name': '検索インデックス',
+                'verbose_name_plural': '検索インデックス',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shopsearchgram',
+            index=models.Index(fields=['gram', 'shop'], name='base_search_gram_shop_idx'),
+        ),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
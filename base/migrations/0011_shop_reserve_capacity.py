@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0010_shop_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='reserve_capacity',
+            field=models.PositiveSmallIntegerField(default=20, verbose_name='1枠あたりの予約可能人数'),
+        ),
+    ]
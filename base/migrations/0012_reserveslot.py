@@ -0,0 +1,53 @@
+# Generated by Django 4.0 on 2026-10-18 17:42
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+# 既存の予約から予約枠ごとの予約人数を作成する
+def populate_reserve_slots(apps, schema_editor):
+    Reserve = apps.get_model('base', 'Reserve')
+    ReserveSlot = apps.get_model('base', 'ReserveSlot')
+
+    rows = (
+        Reserve.objects.values('shop_id', 'reserved_date', 'reserved_time')
+        .annotate(total=Sum('number_of_people'))
+        .order_by()
+    )
+    ReserveSlot.objects.bulk_create(
+        (
+            ReserveSlot(
+                shop_id=row['shop_id'], reserved_date=row['reserved_date'],
+                reserved_time=row['reserved_time'], reserved_people=row['total'],
+            )
+            for row in rows
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0011_shop_reserve_capacity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReserveSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reserved_date', models.DateField(verbose_name='予約日')),
+                ('reserved_time', models.TimeField(verbose_name='予約時間')),
+                ('reserved_people', models.PositiveIntegerField(default=0, verbose_name='予約人数の合計')),
+                ('shop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reserve_slots', to='base.shop', verbose_name='予約店舗')),
+            ],
+            options={
+                'verbose_name': '予約枠',
+                'verbose_name_plural': '予約枠',
+                'unique_together': {('shop', 'reserved_date', 'reserved_time')},
+            },
+        ),
+        migrations.RunPython(populate_reserve_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,148 @@
+# 予約・注文の主キーを文字列から時刻順の64bit整数に切り替える
+# 1. 整数の列(new_id)を追加し、既存の行は作成日時の順にIDを振る
+# 2. new_id を主キーにし、元の id 列は legacy_id として残す（旧URLの検索用）
+#    MySQL では主キーの削除と追加を1つの ALTER TABLE で行う（SwapPrimaryKey）
+
+from django.db import migrations, models
+import base.ids
+
+
+def populate_new_ids(apps, schema_editor):
+    for model_name in ('Reserve', 'Order'):
+        model = apps.get_model('base', model_name)
+        rows = []
+        last_id = None
+        sequence = 0
+        for row in model.objects.order_by('created_at', 'pk').only('pk', 'created_at').iterator():
+            # 同じミリ秒に作成された行は下位ビット（ワーカー番号・連番）で区別する
+            created_id = base.ids.id_from_datetime(row.created_at)
+            sequence = sequence + 1 if created_id == last_id else 0
+            last_id = created_id
+            row.new_id = created_id + sequence
+            rows.append(row)
+        model.objects.bulk_update(rows, ['new_id'], batch_size=1000)
+
+
+class SwapPrimaryKey(migrations.operations.base.Operation):
+    """
+    new_id を主キーにし、元の主キー(id)を NULL を許可する列にする
+    MySQL では主キーを持つテーブルに主キーを追加できない(1068)ため、1つの ALTER TABLE で主キーを削除してから追加する
+    MySQL 以外（テストの SQLite）は AlterField と同じくテーブルを作り直す
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.operations = [
+            migrations.AlterField(
+                model_name=model_name,
+                name='new_id',
+                field=models.BigIntegerField(default=base.ids.next_id, editable=False, primary_key=True, serialize=False),
+            ),
+            migrations.AlterField(
+                model_name=model_name,
+                name='id',
+                field=models.CharField(blank=True, editable=False, max_length=50, null=True),
+            ),
+        ]
+
+    def deconstruct(self):
+        return self.__class__.__name__, [self.model_name], {}
+
+    def describe(self):
+        return f'Swap primary key of {self.model_name} to new_id'
+
+    def state_forwards(self, app_label, state):
+        for operation in self.operations:
+            operation.state_forwards(app_label, state)
+
+    def _states(self, app_label, state):
+        states = [state]
+        for operation in self.operations:
+            state = state.clone()
+            operation.state_forwards(app_label, state)
+            states.append(state)
+        return states
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'mysql':
+            model = to_state.apps.get_model(app_label, self.model_name)
+            schema_editor.execute(self.swap_sql(schema_editor, model, old='id', new='new_id'))
+            return
+        states = self._states(app_label, from_state)
+        for index, operation in enumerate(self.operations):
+            operation.database_forwards(app_label, schema_editor, states[index], states[index + 1])
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'mysql':
+            model = to_state.apps.get_model(app_label, self.model_name)
+            schema_editor.execute(self.swap_sql(schema_editor, model, old='new_id', new='id'))
+            return
+        states = self._states(app_label, to_state)
+        for index, operation in reversed(list(enumerate(self.operations))):
+            operation.database_backwards(app_label, schema_editor, states[index + 1], states[index])
+
+    @staticmethod
+    def swap_sql(schema_editor, model, old, new):
+        quote = schema_editor.quote_name
+
+        def modify(name, null):
+            field = model._meta.get_field(name)
+            return f'MODIFY {quote(field.column)} {field.db_type(schema_editor.connection)} {"NULL" if null else "NOT NULL"}'
+
+        return (
+            f'ALTER TABLE {quote(model._meta.db_table)} DROP PRIMARY KEY, '
+            f'{modify(old, True)}, {modify(new, False)}, ADD PRIMARY KEY ({quote(model._meta.get_field(new).column)})'
+        )
+
+
+def swap_primary_key(model_name, verbose_name):
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name='new_id',
+            field=models.BigIntegerField(null=True),
+        ),
+    ], [
+        SwapPrimaryKey(model_name),
+        # 主キーでなくなった時点では一意制約を付けず、名前を変えてから付け直す
+        # （主キーから一意制約への変更はMySQLでは制約が作成されないため）
+        migrations.RenameField(
+            model_name=model_name,
+            old_name='id',
+            new_name='legacy_id',
+        ),
+        migrations.RenameField(
+            model_name=model_name,
+            old_name='new_id',
+            new_name='id',
+        ),
+        migrations.AlterField(
+            model_name=model_name,
+            name='legacy_id',
+            field=models.CharField(blank=True, editable=False, max_length=50, null=True, unique=True, verbose_name=verbose_name),
+        ),
+    ]
+
+
+reserve_add, reserve_swap = swap_primary_key('reserve', '旧予約番号')
+order_add, order_swap = swap_primary_key('order', '旧注文ID')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0012_reserveslot'),
+    ]
+
+    operations = [
+        *reserve_add,
+        *order_add,
+        migrations.RunPython(populate_new_ids, migrations.RunPython.noop),
+        *reserve_swap,
+        *order_swap,
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.CharField(default=base.ids.compact_id, max_length=50, primary_key=True, serialize=False),
+        ),
+    ]
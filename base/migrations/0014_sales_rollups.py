@@ -0,0 +1,56 @@
+# Generated by Django 4.0 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+# 既存の注文・会員からの売上集計は、登録・解約の履歴を作成してから作成する（0021_membership_changes）
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0013_compact_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='売上')),
+                ('tax', models.BigIntegerField(default=0, verbose_name='消費税額')),
+                ('orders', models.IntegerField(default=0, verbose_name='注文数')),
+                ('signups', models.IntegerField(default=0, verbose_name='新規会員数')),
+                ('subscriptions', models.IntegerField(default=0, verbose_name='有料会員登録数')),
+                ('cancellations', models.IntegerField(default=0, verbose_name='解約数')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField(unique=True, verbose_name='日付')),
+            ],
+            options={
+                'verbose_name': '売上集計（日次）',
+                'verbose_name_plural': '売上集計（日次）',
+                'ordering': ('date',),
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesMonthly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='売上')),
+                ('tax', models.BigIntegerField(default=0, verbose_name='消費税額')),
+                ('orders', models.IntegerField(default=0, verbose_name='注文数')),
+                ('signups', models.IntegerField(default=0, verbose_name='新規会員数')),
+                ('subscriptions', models.IntegerField(default=0, verbose_name='有料会員登録数')),
+                ('cancellations', models.IntegerField(default=0, verbose_name='解約数')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('date', models.DateField(unique=True, verbose_name='月')),
+            ],
+            options={
+                'verbose_name': '売上集計（月次）',
+                'verbose_name_plural': '売上集計（月次）',
+                'ordering': ('date',),
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0014_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='イベントID')),
+                ('type', models.CharField(max_length=100, verbose_name='イベント種別')),
+                ('payload', models.JSONField(verbose_name='内容')),
+                ('status', models.CharField(choices=[('pending', '未処理'), ('processed', '処理済み'), ('failed', '失敗')], default='pending', max_length=20, verbose_name='状態')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='処理回数')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='エラー内容')),
+                ('available_at', models.DateTimeField(blank=True, null=True, verbose_name='次回処理日時')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='受信日時')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='処理日時')),
+            ],
+            options={
+                'verbose_name': 'Stripeイベント',
+                'verbose_name_plural': 'Stripeイベント',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(fields=['status', 'received_at'], name='base_stripe_status_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0015_stripe_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='画像の縮小版'),
+        ),
+    ]
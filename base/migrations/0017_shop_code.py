@@ -0,0 +1,39 @@
+# Generated by Django 4.0 on 2026-10-18 18:05
+
+import base.ids
+from django.db import migrations, models
+
+
+# 既存の店舗に店舗コードを割り当てる
+def populate_shop_codes(apps, schema_editor):
+    Shop = apps.get_model('base', 'Shop')
+
+    shops = []
+    for shop in Shop.objects.filter(code__isnull=True).only('pk').iterator(chunk_size=1000):
+        shop.code = base.ids.compact_id()
+        shops.append(shop)
+        if len(shops) >= 1000:
+            Shop.objects.bulk_update(shops, ['code'])
+            shops = []
+    Shop.objects.bulk_update(shops, ['code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0016_shop_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='code',
+            field=models.CharField(max_length=50, null=True, verbose_name='店舗コード'),
+        ),
+        migrations.RunPython(populate_shop_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='shop',
+            name='code',
+            field=models.CharField(default=base.ids.compact_id, max_length=50, unique=True, verbose_name='店舗コード'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0017_shop_code'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='作成日'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='reserve',
+            name='reserved_date',
+            field=models.DateField(db_index=True, verbose_name='予約日'),
+        ),
+        migrations.AlterField(
+            model_name='review',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='作成日'),
+        ),
+        migrations.AlterField(
+            model_name='shop',
+            name='name',
+            field=models.CharField(db_index=True, max_length=50, verbose_name='店名'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.0 on 2026-10-18 18:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0018_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', 'created_at'], name='base_favorite_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['is_confirmed', 'created_at'], name='base_order_confirmed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['user', 'reserved_date'], name='base_reserve_user_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['shop', 'reserved_date', 'reserved_time'], name='base_reserve_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['shop', 'created_at'], name='base_review_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['is_published', 'created_at'], name='base_shop_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_paymentstatus', 'is_admin'], name='base_user_membership_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0019_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CacheVersion',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='キー')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='バージョン')),
+            ],
+            options={
+                'verbose_name': 'キャッシュのバージョン',
+                'verbose_name_plural': 'キャッシュのバージョン',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.0 on 2026-10-18 18:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+# 現在の有料会員の登録を履歴に補い、登録・解約の数を履歴から集計し直す
+def populate_membership_changes(apps, schema_editor):
+    from base.models.sales_models import rebuild_sales
+    rebuild_sales(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0020_cache_versions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.CharField(db_index=True, max_length=50, verbose_name='会員ID')),
+                ('kind', models.CharField(choices=[('subscribed', '登録'), ('canceled', '解約')], max_length=20, verbose_name='種別')),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='日時')),
+            ],
+            options={
+                'verbose_name': '有料会員の登録・解約',
+                'verbose_name_plural': '有料会員の登録・解約',
+                'ordering': ('created_at', 'pk'),
+            },
+        ),
+        migrations.RunPython(populate_membership_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0021_membership_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerLease',
+            fields=[
+                ('worker', models.PositiveSmallIntegerField(primary_key=True, serialize=False, verbose_name='ワーカー番号')),
+                ('owner', models.CharField(max_length=32, verbose_name='借りているプロセス')),
+                ('expires_ms', models.BigIntegerField(verbose_name='期限')),
+            ],
+            options={
+                'verbose_name': 'ワーカー番号の貸し出し',
+                'verbose_name_plural': 'ワーカー番号の貸し出し',
+            },
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.0 on 2026-10-18 19:16
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# base/search.py の作成時点の分割方法（後で base/search.py を変更しても、このマイグレーションの結果は変わらない）
+FIELD_WEIGHTS = {
+    'name': 4,
+    'category': 2,
+    'tags': 2,
+    'address': 2,
+    'description': 1,
+}
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def index_grams(segment):
+    if len(segment) == 1:
+        return [(segment, 0)]
+    bigrams = [(segment[i:i + 2], i) for i in range(len(segment) - 1)]
+    return bigrams + [(char, i) for i, char in enumerate(segment)]
+
+
+def document_grams(fields):
+    grams = []
+    offset = 0
+    for field, text in fields.items():
+        text = normalize(text)
+        for match in WORD_RE.finditer(text):
+            grams.extend((gram, offset + match.start() + i, FIELD_WEIGHTS[field]) for gram, i in index_grams(match.group()))
+        offset += len(text) + 1
+    return grams
+
+
+# 既存の検索インデックスを出現位置ごとの行で作り直す
+def rebuild_search_grams(apps, schema_editor):
+    Shop = apps.get_model('base', 'Shop')
+    ShopSearchGram = apps.get_model('base', 'ShopSearchGram')
+
+    ShopSearchGram.objects.all().delete()
+    for shop in Shop.objects.select_related('category').prefetch_related('tags').iterator(chunk_size=500):
+        fields = {
+            'name': shop.name,
+            'category': shop.category.name if shop.category else '',
+            'tags': ' '.join(tag.name for tag in shop.tags.all()),
+            'address': shop.address,
+            'description': shop.description,
+        }
+        ShopSearchGram.objects.bulk_create(
+            (ShopSearchGram(shop=shop, gram=gram, position=position, weight=weight) for gram, position, weight in document_grams(fields)),
+            batch_size=2000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0022_worker_leases'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='shopsearchgram',
+            name='base_search_gram_shop_idx',
+        ),
+        migrations.AddField(
+            model_name='shopsearchgram',
+            name='position',
+            field=models.PositiveIntegerField(default=0, verbose_name='位置'),
+        ),
+        migrations.AddIndex(
+            model_name='shopsearchgram',
+            index=models.Index(fields=['gram', 'shop', 'position', 'weight'], name='base_search_gram_pos_idx'),
+        ),
+        migrations.RunPython(rebuild_search_grams, migrations.RunPython.noop),
+    ]
@@ -1,27 +1,42 @@
 """
 ユーザーが有料会員であるかどうかを確認する処理
 無料会員の場合、メッセージと共に有料会員登録ページへリダイレクトする
+確認はセッションのスナップショット（base/membership.py）で行い、会員の行は読み込まない
 """
 
 from django.contrib.auth.mixins import AccessMixin
 from django.shortcuts import redirect
 from django.contrib import messages
 from django.urls import reverse
+from base import membership
 
 class PaymentstatusRequiredMixin(AccessMixin):
 
     membership_url_name = 'subscription' 
 
     def dispatch(self, request, *args, **kwargs):
+        snapshot = membership.get(request)
+
         # 1. ログインチェック (AccessMixinの機能)
-        if not request.user.is_authenticated:
+        if snapshot is None:
             # ログインしていない場合は、通常のログイン処理に任せる
             return self.handle_no_permission()
         
         # 2. 有料会員チェック
-        if not request.user.is_paymentstatus:
+        if not snapshot.is_paymentstatus:
             messages.error(request, 'この機能を利用するには有料プランへの登録が必要です。')
             return redirect(reverse(self.membership_url_name))
             
-        # 有料会員であれば、本来のビュー処理へ進む
-        return super().dispatch(request, *args, **kwargs)
\ No newline at end of file
+        # 有料会員であれば、本来のビュー処理へ進む（ビューでは self.membership.user_id で会員IDを参照できる）
+        self.membership = snapshot
+        return super().dispatch(request, *args, **kwargs)
+
+
+# ログイン中であることの確認（LoginRequiredMixin と同じ動作で、会員の行は読み込まない）
+class MembershipLoginRequiredMixin(AccessMixin):
+
+    def dispatch(self, request, *args, **kwargs):
+        self.membership = membership.get(request)
+        if self.membership is None:
+            return self.handle_no_permission()
+        return super().dispatch(request, *args, **kwargs)
@@ -3,4 +3,10 @@ from .shop_models import *
 from .favorite_models import *
 from .order_models import *
 from .reserve_models import *
-from .review_models import *
\ No newline at end of file
+from .review_models import *
+from .rating_models import *
+from .search_models import *
+from .sales_models import *
+from .stripe_models import *
+from .version_models import *
+from .id_models import *
@@ -6,7 +6,7 @@ from django.dispatch import receiver
 from django.db.models.signals import post_save
 from django.db import models
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
-from base.models.shop_models import create_id
+from base.ids import compact_id
 
 # ユーザーモデル
 class UserManager(BaseUserManager):
@@ -45,7 +45,8 @@ class UserManager(BaseUserManager):
 
 # ユーザーのプロフィール情報
 class User(AbstractBaseUser, PermissionsMixin):
-    id = models.CharField(default=create_id, primary_key=True, max_length=50)
+    # 時刻順に並ぶ13文字のID（既存ユーザーの22文字のIDはそのまま使える）
+    id = models.CharField(default=compact_id, primary_key=True, max_length=50)
     username = models.CharField(max_length=50, unique=True, verbose_name='ユーザー名')
     email = models.EmailField(max_length=255, unique=True, verbose_name='メールアドレス')
     zipcode = models.CharField(default='', blank=True, max_length=8, verbose_name='郵便番号')
@@ -58,7 +59,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_paymentstatus = models.BooleanField(default=False, verbose_name='有料会員')
     is_active = models.BooleanField(default=True, verbose_name='アクティブ状態')
     is_admin = models.BooleanField(default=False, verbose_name='管理者権限')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     stripe_customer_id = models.CharField(default='',max_length=255, blank=True)
@@ -73,6 +74,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     EMAIL_FIELD = 'email'
     REQUIRED_FIELDS = []
 
+    class Meta:
+        indexes = [
+            # 有料会員数の集計
+            models.Index(fields=['is_paymentstatus', 'is_admin'], name='base_user_membership_idx'),
+        ]
+
     def __str__(self):
         return self.username
     
@@ -11,8 +11,12 @@ class Favorite(models.Model):
 
     class Meta:
         unique_together = ('user', 'shop')
+        indexes = [
+            # 会員ごとのお気に入り一覧（登録日の新しい順）
+            models.Index(fields=['user', 'created_at'], name='base_favorite_user_created_idx'),
+        ]
 
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='作成日')
 
     def __str__(self):
         return f"{self.user.username} (登録店舗：{self.shop.name})"
@@ -0,0 +1,20 @@
+"""
+IDのワーカー番号の貸し出しを保存するモデルを定義（base/ids.py）
+ID_WORKER_ID='lease' の場合、プロセスごとに重ならないワーカー番号をこの表から借りる
+"""
+from django.db import models
+
+
+class WorkerLease(models.Model):
+    worker = models.PositiveSmallIntegerField(primary_key=True, verbose_name='ワーカー番号')
+    # 借りているプロセスごとのランダムな値（延長するときに、他のプロセスに貸し出されていないことを確認する）
+    owner = models.CharField(max_length=32, verbose_name='借りているプロセス')
+    # 期限（UNIX時間のミリ秒。期限を過ぎた番号は他のプロセスが借りられる）
+    expires_ms = models.BigIntegerField(verbose_name='期限')
+
+    class Meta:
+        verbose_name = 'ワーカー番号の貸し出し'
+        verbose_name_plural = 'ワーカー番号の貸し出し'
+
+    def __str__(self):
+        return f'{self.worker} ({self.owner})'
@@ -5,8 +5,9 @@
 from django.db import models
 import datetime
 from django.contrib.auth import get_user_model
+from base.ids import next_id
  
-# datetimeを使って日時をマイクロ秒単位まで取得
+# 旧形式のID（0013_compact_ids 以前のマイグレーションから参照される）
 def custom_timestamp_id():
     dt = datetime.datetime.now()
     return dt.strftime('%Y%m%d%H%M%S%f')
@@ -14,8 +15,9 @@ def custom_timestamp_id():
 # 決済履歴のモデル 
 class Order(models.Model):
     # 注文ID
-    id = models.CharField(default=custom_timestamp_id,
-                          editable=False, primary_key=True, max_length=50)
+    id = models.BigIntegerField(default=next_id, editable=False, primary_key=True)
+    # 移行前の文字列の注文ID
+    legacy_id = models.CharField(max_length=50, unique=True, null=True, blank=True, editable=False, verbose_name='旧注文ID')
     # ユーザー情報を渡している
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     # 決済処理済みかどうか（success.viwesに行ったときのみだけtrue）
@@ -27,10 +29,16 @@ class Order(models.Model):
     # 管理者だけのメモ書き
     memo = models.TextField(default='', blank=True)
     
-    created_at = models.DateTimeField(auto_now_add=True)  # 履歴の作成日
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)  # 履歴の作成日
     updated_at = models.DateTimeField(auto_now=True)      # 履歴の最終更新日
+
+    class Meta:
+        indexes = [
+            # 売上集計（決済済みの注文を日付ごとに集計）
+            models.Index(fields=['is_confirmed', 'created_at'], name='base_order_confirmed_idx'),
+        ]
  
     def __str__(self):
-        return self.id
+        return str(self.id)
 
 
@@ -0,0 +1,106 @@
+"""
+店舗ごとのレビュー評価集計モデルを定義
+"""
+from django.db import models, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+STAR_FIELDS = {
+    1: 'star_1',
+    2: 'star_2',
+    3: 'star_3',
+    4: 'star_4',
+    5: 'star_5',
+}
+
+
+class ShopRatingManager(models.Manager):
+
+    # レビュー1件分の増減を反映する（sign: 作成時 1 / 削除時 -1）
+    def apply_review(self, shop_id, stars, sign=1):
+        # 削除時は店舗ごと削除されている途中の場合があるため行を作り直さない
+        if sign > 0:
+            self.get_or_create(shop_id=shop_id)
+        # フォーム経由の保存では文字列のまま渡ってくるため数値に揃える
+        stars = int(stars) if stars not in (None, '') else None
+
+        updates = {'review_count': F('review_count') + sign, 'updated_at': timezone.now()}
+        if stars in STAR_FIELDS:
+            field = STAR_FIELDS[stars]
+            updates['rating_count'] = F('rating_count') + sign
+            updates['rating_sum'] = F('rating_sum') + sign * stars
+            updates[field] = F(field) + sign
+        self.filter(shop_id=shop_id).update(**updates)
+
+    # Reviewテーブルから集計し直す（shop_ids未指定の場合は全店舗）
+    def rebuild(self, shop_ids=None, batch_size=1000):
+        from base.models.review_models import Review
+        from base.models.shop_models import Shop
+
+        reviews = Review.objects.all()
+        shops = Shop.objects.all()
+        if shop_ids is not None:
+            reviews = reviews.filter(shop_id__in=shop_ids)
+            shops = shops.filter(pk__in=shop_ids)
+
+        stats = reviews.values('shop_id').annotate(
+            review_count=Count('id'),
+            rating_count=Count('stars'),
+            rating_sum=Sum('stars'),
+            **{field: Count('id', filter=Q(stars=stars)) for stars, field in STAR_FIELDS.items()},
+        ).order_by()
+        stats = {row.pop('shop_id'): row for row in stats}
+
+        with transaction.atomic():
+            current = self.all()
+            if shop_ids is not None:
+                current = current.filter(shop_id__in=shop_ids)
+            current.delete()
+
+            ratings = []
+            for shop_id in shops.values_list('pk', flat=True).iterator(chunk_size=batch_size):
+                row = stats.get(shop_id, {})
+                row['rating_sum'] = row.get('rating_sum') or 0
+                ratings.append(self.model(shop_id=shop_id, **row))
+                if len(ratings) >= batch_size:
+                    self.bulk_create(ratings)
+                    ratings = []
+            self.bulk_create(ratings)
+
+
+class ShopRating(models.Model):
+    shop = models.OneToOneField('Shop', on_delete=models.CASCADE, primary_key=True, related_name='rating', verbose_name='店舗')
+
+    # レビュー件数（評価なしのレビューも含む）
+    review_count = models.PositiveIntegerField(default=0, verbose_name='レビュー件数')
+    # 評価ありのレビュー件数と評価の合計（平均値の算出に使用）
+    rating_count = models.PositiveIntegerField(default=0, verbose_name='評価件数')
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name='評価合計')
+
+    # 評価ごとの件数
+    star_1 = models.PositiveIntegerField(default=0, verbose_name='★1')
+    star_2 = models.PositiveIntegerField(default=0, verbose_name='★2')
+    star_3 = models.PositiveIntegerField(default=0, verbose_name='★3')
+    star_4 = models.PositiveIntegerField(default=0, verbose_name='★4')
+    star_5 = models.PositiveIntegerField(default=0, verbose_name='★5')
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ShopRatingManager()
+
+    class Meta:
+        verbose_name = '店舗評価集計'
+        verbose_name_plural = '店舗評価集計'
+
+    def __str__(self):
+        return f'{self.shop_id} ({self.review_count}件)'
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def histogram(self):
+        return {stars: getattr(self, field) for stars, field in STAR_FIELDS.items()}
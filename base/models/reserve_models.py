@@ -3,21 +3,26 @@
 """
 
 from django.db import models
+from django.db.models import F, Sum
 from django.contrib.auth import get_user_model
 import datetime
+from base.ids import next_id
 
+# 旧形式のID（0013_compact_ids 以前のマイグレーションから参照される）
 def custom_timestamp_id():
     dt = datetime.datetime.now()
     return dt.strftime('%Y%m%d%H%M%S%f')
 
 class Reserve(models.Model):
-    id = models.CharField(default=custom_timestamp_id,
-                        editable=False, primary_key=True, max_length=50)
+    # 時刻順の64bit整数（base.ids）
+    id = models.BigIntegerField(default=next_id, editable=False, primary_key=True)
+    # 移行前の文字列のID（旧URLの予約番号で検索するために残す）
+    legacy_id = models.CharField(max_length=50, unique=True, null=True, blank=True, editable=False, verbose_name='旧予約番号')
     user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, verbose_name='予約ユーザー')
     shop = models.ForeignKey('Shop', on_delete=models.CASCADE, verbose_name='予約店舗')
 
     # 予約日
-    reserved_date = models.DateField(verbose_name='予約日')
+    reserved_date = models.DateField(db_index=True, verbose_name='予約日')
 
     # 予約時間
     reserved_time = models.TimeField(verbose_name='予約日時')
@@ -29,5 +34,61 @@ class Reserve(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # 会員ごとの予約一覧（予約日順）
+            models.Index(fields=['user', 'reserved_date'], name='base_reserve_user_date_idx'),
+            # 予約枠ごとの予約人数の集計
+            models.Index(fields=['shop', 'reserved_date', 'reserved_time'], name='base_reserve_slot_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.shop.name} - {self.reserved_date} {self.reserved_time} ({self.user.username})'
+
+
+class ReserveSlotManager(models.Manager):
+
+    # 予約人数を加算する（capacity を指定した場合は上限を超えない場合のみ加算し、加算できたかを返す）
+    def reserve(self, shop_id, reserved_date, reserved_time, number_of_people, capacity=None):
+        slot, _ = self.get_or_create(shop_id=shop_id, reserved_date=reserved_date, reserved_time=reserved_time)
+        slots = self.filter(pk=slot.pk)
+        if capacity is not None:
+            # 判定と加算を1つのUPDATE文で行うため、同時に予約されても上限を超えない
+            slots = slots.filter(reserved_people__lte=capacity - number_of_people)
+        return slots.update(reserved_people=F('reserved_people') + number_of_people) > 0
+
+    def release(self, shop_id, reserved_date, reserved_time, number_of_people):
+        self.filter(
+            shop_id=shop_id, reserved_date=reserved_date, reserved_time=reserved_time,
+            reserved_people__gte=number_of_people,
+        ).update(reserved_people=F('reserved_people') - number_of_people)
+
+    # 予約テーブルから数え直す（管理画面で予約を編集した場合など）
+    def recount(self, shop_id, reserved_date, reserved_time):
+        total = Reserve.objects.filter(
+            shop_id=shop_id, reserved_date=reserved_date, reserved_time=reserved_time,
+        ).aggregate(total=Sum('number_of_people'))['total'] or 0
+        self.update_or_create(
+            shop_id=shop_id, reserved_date=reserved_date, reserved_time=reserved_time,
+            defaults={'reserved_people': total},
+        )
+
+
+"""
+予約枠ごとの予約人数（同時予約時の定員チェックに使用）
+"""
+class ReserveSlot(models.Model):
+    shop = models.ForeignKey('Shop', on_delete=models.CASCADE, related_name='reserve_slots', verbose_name='予約店舗')
+    reserved_date = models.DateField(verbose_name='予約日')
+    reserved_time = models.TimeField(verbose_name='予約時間')
+    reserved_people = models.PositiveIntegerField(default=0, verbose_name='予約人数の合計')
+
+    objects = ReserveSlotManager()
+
+    class Meta:
+        verbose_name = '予約枠'
+        verbose_name_plural = '予約枠'
+        unique_together = ('shop', 'reserved_date', 'reserved_time')
+
     def __str__(self):
-        return f'{self.shop.name} - {self.reserved_date} {self.reserved_time} ({self.user.username})'
\ No newline at end of file
+        return f'{self.shop_id} - {self.reserved_date} {self.reserved_time} ({self.reserved_people}名)'
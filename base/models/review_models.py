@@ -22,7 +22,15 @@ class Review(models.Model):
     comment = models.TextField(default='', blank=True, verbose_name='コメント')
 
     # 作成日
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name='作成日')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='作成日')
+
+    class Meta:
+        indexes = [
+            # 店舗ごとのレビュー一覧（作成日の新しい順）
+            models.Index(fields=['shop', 'created_at'], name='base_review_shop_created_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.name} (店舗名：{self.shop.name} / {self.score}点)"
\ No newline at end of file
+        # 退会したユーザーのレビューは user が None になる
+        username = self.user.username if self.user_id else '退会済みユーザー'
+        return f"{username} (店舗名：{self.shop.name} / {self.stars or '-'}点)"
@@ -0,0 +1,234 @@
+"""
+売上・会員数の日次／月次集計モデルを定義
+注文・会員の保存時にシグナルで差分を加算し、管理画面の売上集計は集計テーブルだけを参照する
+有料会員の登録・解約は MembershipChange に記録し、集計し直す場合も同じ記録から数える
+"""
+import datetime
+
+from django.apps import apps as global_apps
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+ROLLUP_FIELDS = ('revenue', 'tax', 'orders', 'signups', 'subscriptions', 'cancellations')
+
+
+class SalesRollupManager(models.Manager):
+
+    # 指定した日（月次の場合は月初）の行に差分を加算する
+    def add(self, date, **deltas):
+        deltas = {field: value for field, value in deltas.items() if value}
+        if not deltas:
+            return
+        self.get_or_create(date=date)
+        self.filter(date=date).update(
+            updated_at=timezone.now(),
+            **{field: F(field) + value for field, value in deltas.items()},
+        )
+
+
+class SalesRollup(models.Model):
+    # 売上（税込）と消費税額
+    revenue = models.BigIntegerField(default=0, verbose_name='売上')
+    tax = models.BigIntegerField(default=0, verbose_name='消費税額')
+    # 決済済みの注文数
+    orders = models.IntegerField(default=0, verbose_name='注文数')
+    # 新規会員数（管理者を除く）
+    signups = models.IntegerField(default=0, verbose_name='新規会員数')
+    # 有料会員への登録数・解約数
+    subscriptions = models.IntegerField(default=0, verbose_name='有料会員登録数')
+    cancellations = models.IntegerField(default=0, verbose_name='解約数')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = SalesRollupManager()
+
+    class Meta:
+        abstract = True
+        ordering = ('date',)
+
+    def __str__(self):
+        return f'{self.date} ¥{self.revenue}'
+
+    @property
+    def net_subscriptions(self):
+        return self.subscriptions - self.cancellations
+
+
+"""
+日次集計
+"""
+class SalesDaily(SalesRollup):
+    date = models.DateField(unique=True, verbose_name='日付')
+
+    class Meta(SalesRollup.Meta):
+        verbose_name = '売上集計（日次）'
+        verbose_name_plural = '売上集計（日次）'
+
+
+"""
+月次集計（date は月初日）
+"""
+class SalesMonthly(SalesRollup):
+    date = models.DateField(unique=True, verbose_name='月')
+
+    class Meta(SalesRollup.Meta):
+        verbose_name = '売上集計（月次）'
+        verbose_name_plural = '売上集計（月次）'
+
+
+"""
+有料会員の登録・解約の履歴
+（会員の is_paymentstatus の変更をシグナルで記録する。定期的な更新の決済(invoice.paid)は含まない）
+"""
+class MembershipChange(models.Model):
+    SUBSCRIBED = 'subscribed'
+    CANCELED = 'canceled'
+    KIND_CHOICES = (
+        (SUBSCRIBED, '登録'),
+        (CANCELED, '解約'),
+    )
+
+    # 会員の削除後も集計に残すため外部キーにしない
+    user_id = models.CharField(max_length=50, db_index=True, verbose_name='会員ID')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name='種別')
+    created_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name='日時')
+
+    class Meta:
+        ordering = ('created_at', 'pk')
+        verbose_name = '有料会員の登録・解約'
+        verbose_name_plural = '有料会員の登録・解約'
+
+    def __str__(self):
+        return f'{self.user_id} {self.get_kind_display()} {self.created_at}'
+
+
+# 日時（またはその日）の日次・月次の集計に差分を加算する
+def record_sales(when, **deltas):
+    day = timezone.localdate(when) if isinstance(when, datetime.datetime) else when
+    with transaction.atomic():
+        SalesDaily.objects.add(day, **deltas)
+        SalesMonthly.objects.add(day.replace(day=1), **deltas)
+
+
+# 有料会員の登録・解約を記録し、その日の集計に加算する
+def record_membership_change(user_id, kind, when=None):
+    when = when or timezone.now()
+    with transaction.atomic():
+        MembershipChange.objects.create(user_id=user_id, kind=kind, created_at=when)
+        record_sales(when, **{'subscriptions' if kind == MembershipChange.SUBSCRIBED else 'cancellations': 1})
+
+
+# 登録・解約の履歴と現在の会員の状態が合わない会員（シグナルを通さずに変更された会員・履歴の記録前の会員）の履歴を補う
+# 有料会員で履歴がない会員は最初の決済日（決済がない場合は登録日）、それ以外は現在日時の登録・解約として記録する
+def reconcile_membership_changes(now=None, apps=None):
+    apps = apps or global_apps
+    User = apps.get_model('base', 'User')
+    Order = apps.get_model('base', 'Order')
+    Change = apps.get_model('base', 'MembershipChange')
+
+    now = now or timezone.now()
+    users = User.objects.annotate(
+        last_change=Subquery(
+            Change.objects.filter(user_id=OuterRef('pk')).order_by('-created_at', '-pk').values('kind')[:1]
+        ),
+    )
+    # 管理者はシグナルと同じく有料会員として数えない
+    subscribed = (
+        users.filter(is_paymentstatus__in=[True], is_admin__in=[False])
+        .filter(Q(last_change__isnull=True) | Q(last_change=MembershipChange.CANCELED))
+        .annotate(first_paid_at=Subquery(
+            Order.objects.filter(user_id=OuterRef('pk'), is_confirmed__in=[True]).order_by('created_at').values('created_at')[:1]
+        ))
+    )
+    canceled = users.filter(last_change=MembershipChange.SUBSCRIBED).exclude(is_paymentstatus__in=[True], is_admin__in=[False])
+
+    changes = [
+        Change(
+            user_id=user_id, kind=MembershipChange.SUBSCRIBED,
+            created_at=now if last_change is not None else first_paid_at or created_at,
+        )
+        for user_id, created_at, last_change, first_paid_at in subscribed.values_list(
+            'pk', 'created_at', 'last_change', 'first_paid_at',
+        ).iterator()
+    ]
+    changes += [
+        Change(user_id=user_id, kind=MembershipChange.CANCELED, created_at=now)
+        for user_id in canceled.values_list('pk', flat=True).iterator()
+    ]
+    Change.objects.bulk_create(changes, batch_size=1000)
+    return len(changes)
+
+
+# 注文・会員・登録と解約の履歴から集計し直す（apps はマイグレーションから呼び出す場合に指定する）
+# 有料会員の登録・解約はシグナルと同じく MembershipChange から数える（定期的な更新の決済は登録に含めない）
+def rebuild_sales(now=None, apps=None):
+    apps = apps or global_apps
+    User = apps.get_model('base', 'User')
+    Order = apps.get_model('base', 'Order')
+    Change = apps.get_model('base', 'MembershipChange')
+    SalesDaily = apps.get_model('base', 'SalesDaily')
+    SalesMonthly = apps.get_model('base', 'SalesMonthly')
+
+    tzinfo = timezone.get_current_timezone()
+    reconcile_membership_changes(now=now, apps=apps)
+    days = {}
+
+    def row(day):
+        return days.setdefault(day, dict.fromkeys(ROLLUP_FIELDS, 0))
+
+    orders = (
+        # 真偽値は値と比較する条件にして、インデックスを使えるようにする（ShopQuerySet.published を参照）
+        Order.objects.filter(is_confirmed__in=[True])
+        .annotate(day=TruncDate('created_at', tzinfo=tzinfo))
+        .values('day')
+        .annotate(revenue=Sum('amount'), tax=Sum('tax_included'), orders=Count('pk'))
+        .order_by()
+    )
+    for item in orders:
+        values = row(item['day'])
+        values['revenue'] = item['revenue'] or 0
+        values['tax'] = item['tax'] or 0
+        values['orders'] = item['orders']
+
+    signups = (
+        User.objects.filter(is_admin__in=[False])
+        .annotate(day=TruncDate('created_at', tzinfo=tzinfo))
+        .values('day')
+        .annotate(signups=Count('pk'))
+        .order_by()
+    )
+    for item in signups:
+        row(item['day'])['signups'] = item['signups']
+
+    changes = (
+        Change.objects
+        .annotate(day=TruncDate('created_at', tzinfo=tzinfo))
+        .values('day', 'kind')
+        .annotate(count=Count('pk'))
+        .order_by()
+    )
+    for item in changes:
+        field = 'subscriptions' if item['kind'] == MembershipChange.SUBSCRIBED else 'cancellations'
+        row(item['day'])[field] = item['count']
+
+    months = {}
+    for day, values in days.items():
+        month = months.setdefault(day.replace(day=1), dict.fromkeys(ROLLUP_FIELDS, 0))
+        for field in ROLLUP_FIELDS:
+            month[field] += values[field]
+
+    with transaction.atomic():
+        SalesDaily.objects.all().delete()
+        SalesMonthly.objects.all().delete()
+        SalesDaily.objects.bulk_create(SalesDaily(date=day, **values) for day, values in days.items())
+        SalesMonthly.objects.bulk_create(SalesMonthly(date=month, **values) for month, values in months.items())
+    return len(days), len(months)
+
+
+# 集計テーブルから累計を求める（月数分の行だけを読むため、注文数が増えても一定）
+def sales_totals():
+    totals = SalesMonthly.objects.aggregate(**{field: Sum(field) for field in ROLLUP_FIELDS})
+    totals = {field: value or 0 for field, value in totals.items()}
+    totals['paid_members'] = totals['subscriptions'] - totals['cancellations']
+    return totals
@@ -0,0 +1,43 @@
+"""
+店舗検索用のインデックスモデルを定義
+"""
+from django.db import models
+
+
+"""
+検索用ドキュメント（店舗ごとに正規化した検索対象テキストを保持）
+"""
+class ShopSearchDocument(models.Model):
+    shop = models.OneToOneField('Shop', on_delete=models.CASCADE, primary_key=True, related_name='search_document', verbose_name='店舗')
+    text = models.TextField(default='', blank=True, verbose_name='検索用テキスト')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = '検索用ドキュメント'
+        verbose_name_plural = '検索用ドキュメント'
+
+    def __str__(self):
+        return str(self.shop_id)
+
+
+"""
+転置インデックス（文字bi-gramの出現位置ごとに該当店舗と重みを保持）
+"""
+class ShopSearchGram(models.Model):
+    shop = models.ForeignKey('Shop', on_delete=models.CASCADE, related_name='search_grams', verbose_name='店舗')
+    gram = models.CharField(max_length=2, verbose_name='n-gram')
+    # 店名・カテゴリなど項目ごとの重み
+    weight = models.PositiveIntegerField(default=0, verbose_name='重み')
+    # 項目をつなげたテキストでの文字の位置（base/search.py の document_grams）
+    position = models.PositiveIntegerField(default=0, verbose_name='位置')
+
+    class Meta:
+        verbose_name = '検索インデックス'
+        verbose_name_plural = '検索インデックス'
+        indexes = [
+            # 重みまで含め、検索・連続の確認・スコアの集計をインデックスだけで行う
+            models.Index(fields=['gram', 'shop', 'position', 'weight'], name='base_search_gram_pos_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.gram} ({self.shop_id})'
@@ -2,18 +2,22 @@
 店舗モデルを定義
 """
 from django.db import models
+from django.db.models import ExpressionWrapper, FloatField
+from django.db.models.functions import Cast, Coalesce, NullIf
 from django.utils.crypto import get_random_string
 import os
+from base.ids import compact_id
 from multiselectfield import MultiSelectField
 
 def create_id():
     return get_random_string(22)
 
 """
-修正予定：vegeketで画像処理失敗したため調整必要？
+店舗画像の保存先
+新規作成時は instance.id が未確定のため使わない（同名のファイルはストレージ側で別名にする）
 """
 def upload_image_to(instance, filename):
-    return f'{instance.id}/{filename}'
+    return f'shops/{filename}'
 
 
 """
@@ -62,6 +66,28 @@ class IrregularHoliday(models.Model):
         return f'{self.shop.name} - {self.date}'
 
 
+"""
+店舗の検索条件
+"""
+class ShopQuerySet(models.QuerySet):
+
+    # 公開中の店舗
+    # is_published=True は「WHERE is_published」になり (is_published, created_at) のインデックスを使えないため、
+    # 値と比較する条件にする
+    def published(self):
+        return self.filter(is_published__in=[True])
+
+    # 評価集計テーブル(ShopRating)から平均評価とレビュー件数を付与する
+    def with_rating(self):
+        return self.annotate(
+            average_rating=ExpressionWrapper(
+                Cast('rating__rating_sum', FloatField()) / NullIf('rating__rating_count', 0),
+                output_field=FloatField(),
+            ),
+            review_count=Coalesce('rating__review_count', 0),
+        )
+
+
 """
 店舗情報
 """
@@ -75,7 +101,9 @@ class Shop(models.Model):
         ('sat', '土'),
         ('sun', '日'),
     )
-    name = models.CharField(max_length=50, verbose_name='店名')
+    # 一括登録（import_shops / export_shops）で店舗を特定するコード
+    code = models.CharField(default=compact_id, max_length=50, unique=True, verbose_name='店舗コード')
+    name = models.CharField(max_length=50, db_index=True, verbose_name='店名')
     mail = models.CharField(default='', blank=True, max_length=255, verbose_name='メールアドレス')
     zipcode = models.CharField(default='', blank=True, max_length=8, verbose_name='郵便番号')
     address = models.CharField(default='', blank=True, max_length=255, verbose_name='住所')
@@ -88,9 +116,12 @@ class Shop(models.Model):
     holiday = models.TextField(default='', blank=True, verbose_name='定休日の案内詳細')
     reserve_start_time = models.TimeField(default=None, blank=True, verbose_name='予約開始時間')
     reserve_end_time = models.TimeField(default=None, blank=True, verbose_name='予約終了時間')
+    reserve_capacity = models.PositiveSmallIntegerField(default=20, verbose_name='1枠あたりの予約可能人数')
 
     # 画像
     image = models.ImageField(default='noImage.png', blank=True, upload_to=upload_image_to,  verbose_name='画像')
+    # 縮小版のファイル名（base/images.py で作成する）
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False, verbose_name='画像の縮小版')
 
 
     # カテゴリー # ForeignKeyとon_delete=はセットで必須
@@ -105,6 +136,14 @@ class Shop(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShopQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 店舗一覧（公開中の店舗を新規掲載順）
+            models.Index(fields=['is_published', 'created_at'], name='base_shop_published_idx'),
+        ]
+
     # インスタンスの生成（returnでnameを返すことで、一覧画面で名前が表示される）
     def __str__(self):
         return self.name
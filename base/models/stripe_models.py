@@ -0,0 +1,38 @@
+"""
+Stripeのwebhookで受信したイベントを保存するモデルを定義
+受信時は保存だけを行い、会員・注文への反映はワーカー(process_stripe_events)が行う
+"""
+from django.db import models
+
+
+class StripeEvent(models.Model):
+    PENDING = 'pending'
+    PROCESSED = 'processed'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, '未処理'),
+        (PROCESSED, '処理済み'),
+        (FAILED, '失敗'),
+    )
+
+    # StripeのイベントID（同じイベントが再送されても1件だけ保存する）
+    event_id = models.CharField(max_length=255, unique=True, verbose_name='イベントID')
+    type = models.CharField(max_length=100, verbose_name='イベント種別')
+    payload = models.JSONField(verbose_name='内容')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING, verbose_name='状態')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='処理回数')
+    last_error = models.TextField(default='', blank=True, verbose_name='エラー内容')
+    # 再処理を待つ場合の次回処理日時
+    available_at = models.DateTimeField(null=True, blank=True, verbose_name='次回処理日時')
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='受信日時')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='処理日時')
+
+    class Meta:
+        verbose_name = 'Stripeイベント'
+        verbose_name_plural = 'Stripeイベント'
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='base_stripe_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.type} ({self.event_id})'
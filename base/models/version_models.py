@@ -0,0 +1,18 @@
+"""
+キャッシュのバージョンを保存するモデルを定義（base/versions.py）
+会員のスナップショット・断片キャッシュ・空き状況のキャッシュを、すべてのプロセスでまとめて破棄するために使う
+"""
+from django.db import models
+
+
+class CacheVersion(models.Model):
+    # 例) membership:<会員ID> / fragments:shop:<店舗ID> / availability:<店舗ID>
+    key = models.CharField(max_length=100, primary_key=True, verbose_name='キー')
+    version = models.PositiveBigIntegerField(default=0, verbose_name='バージョン')
+
+    class Meta:
+        verbose_name = 'キャッシュのバージョン'
+        verbose_name_plural = 'キャッシュのバージョン'
+
+    def __str__(self):
+        return f'{self.key} ({self.version})'
@@ -0,0 +1,4 @@
+"""
+PyMySQL 用のデータベースバックエンド（settings.DATABASES の ENGINE に 'base.mysql' を指定する）
+・Django 4.0 の MySQL バックエンドに、接続の確認（CONN_HEALTH_CHECKS）とプロセス内の接続プール（POOL）を追加する
+"""
@@ -0,0 +1,106 @@
+"""
+Django 4.0 の MySQL バックエンドに、接続の確認とプロセス内の接続プールを追加したもの
+・CONN_HEALTH_CHECKS: 持続的な接続（CONN_MAX_AGE）をリクエストで最初に使う前に ping で確認し、切れていれば接続し直す
+  （Django 4.1 の CONN_HEALTH_CHECKS と同じ動作。4.1 以降に上げた場合は Django 本体の機能に置き換えられる）
+・POOL: {'MAX_SIZE': 同時に開く接続数, 'IDLE_TIMEOUT': 使われていない接続を閉じるまでの秒数, 'TIMEOUT': 空きを待つ秒数}
+  MAX_SIZE が 0 の場合は使わない。使う場合は閉じた接続をプールに戻し、次の接続で使い回す（base.mysql.pool）
+"""
+
+import collections
+
+from django.db.backends.mysql import base as mysql
+from pymysql.constants import SERVER_STATUS
+from base.mysql.pool import PoolTimeout, get_pool
+
+Database = mysql.Database
+
+# 実際に MySQL に接続（ハンドシェイク）した回数（benchmark_connections で使う）
+stats = collections.Counter()
+
+
+def _ping(conn):
+    try:
+        # PyMySQL の ping は既定で黙って接続し直すため、接続し直さずに確認する
+        conn.ping(reconnect=False)
+    except Exception:
+        return False
+    return True
+
+
+# プールに戻す前に、終わっていないトランザクションを取り消す（取り消せない接続は戻さない）
+def _reset(conn):
+    try:
+        if conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            conn.rollback()
+    except Exception:
+        return False
+    return True
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.health_check_done = False
+
+    @property
+    def health_check_enabled(self):
+        return self.settings_dict.get('CONN_HEALTH_CHECKS', False)
+
+    @property
+    def pool(self):
+        options = self.settings_dict.get('POOL') or {}
+        if not options.get('MAX_SIZE'):
+            return None
+        return get_pool(self.alias, options['MAX_SIZE'], options.get('IDLE_TIMEOUT', 300), options.get('TIMEOUT', 10))
+
+    def _connect(self, conn_params):
+        stats['handshakes'] += 1
+        return super().get_new_connection(conn_params)
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        if pool is None:
+            return self._connect(conn_params)
+        try:
+            return pool.acquire(lambda: self._connect(conn_params), _ping)
+        except PoolTimeout as e:
+            raise Database.OperationalError(str(e)) from e
+
+    def _close(self):
+        pool = self.pool
+        if pool is None or self.connection is None:
+            return super()._close()
+        # エラーが起きた接続は状態がわからないため使い回さない
+        # トランザクションの途中で閉じた場合は self.connection が残るため、他のスレッドに渡さない
+        discard = self.in_atomic_block or self.errors_occurred or not _reset(self.connection)
+        pool.release(self.connection, discard=discard)
+
+    def is_usable(self):
+        return _ping(self.connection)
+
+    # --- 接続の確認（Django 4.1 の BaseDatabaseWrapper と同じ） ---
+
+    def connect(self):
+        super().connect()
+        self.health_check_done = True
+
+    def close_if_unusable_or_obsolete(self):
+        # リクエストの開始・終了時に呼ばれる（次に使う前に確認し直す）
+        self.health_check_done = False
+        super().close_if_unusable_or_obsolete()
+
+    def close_if_health_check_failed(self):
+        if self.connection is None or not self.health_check_enabled or self.health_check_done:
+            return
+        if not self.is_usable():
+            self.close()
+        self.health_check_done = True
+
+    def _cursor(self, name=None):
+        self.close_if_health_check_failed()
+        return super()._cursor(name)
+
+    def set_autocommit(self, autocommit, force_begin_transaction_with_broken_autocommit=False):
+        self.close_if_health_check_failed()
+        return super().set_autocommit(autocommit, force_begin_transaction_with_broken_autocommit)
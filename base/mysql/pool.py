@@ -0,0 +1,131 @@
+"""
+プロセス内で MySQL の接続を使い回すプール（base.mysql.base から使う）
+・リクエストの終了時に閉じた接続をプールに戻し、次のリクエスト（別のスレッドを含む）で使い回すため、TCP接続・認証のハンドシェイクを省ける
+・同時に開く接続は MAX_SIZE 件まで（空きがなければ TIMEOUT 秒待つ）
+・IDLE_TIMEOUT 秒を超えて使われていない接続は閉じる（MySQL の wait_timeout より短くする）
+・取り出す際に ping で確認し、切れていた接続は捨てて新しく接続し直す。エラーが起きた接続はプールに戻さない
+・gunicorn などで fork した場合は、親プロセスの接続を使わず子プロセスで新しく作る
+"""
+
+import collections
+import os
+import threading
+import time
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+
+    def __init__(self, max_size=10, idle_timeout=300, timeout=10):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.condition = threading.Condition()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        # (接続, 戻した時刻) の一覧（最後に戻した接続から使う）
+        self.idle = collections.deque()
+        self.size = 0
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            # 親プロセスの接続（ソケット）は閉じずに手放す
+            self.reset()
+
+    def acquire(self, connect, check):
+        """プールの接続を返す（connect() で新しく接続し、check(conn) が False の接続は捨てる）"""
+        deadline = time.monotonic() + self.timeout
+        with self.condition:
+            self._check_fork()
+            while True:
+                self._close_idle()
+                if self.idle:
+                    conn, _ = self.idle.pop()
+                    break
+                if self.size < self.max_size:
+                    self.size += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.condition.wait(remaining):
+                    raise PoolTimeout(f'{self.timeout}秒待ってもデータベースの接続に空きがありません（MAX_SIZE={self.max_size}）')
+
+        if conn is not None:
+            if check(conn):
+                self.stats['reused'] += 1
+                return conn
+            self.stats['discarded'] += 1
+            _close(conn)
+        try:
+            conn = connect()
+        except BaseException:
+            self._release_slot()
+            raise
+        self.stats['created'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        with self.condition:
+            self._check_fork()
+            if discard:
+                self.stats['discarded'] += 1
+                self.size = max(self.size - 1, 0)
+                self.condition.notify()
+            else:
+                self.idle.append((conn, time.monotonic()))
+                self.condition.notify()
+                return
+        _close(conn)
+
+    def _release_slot(self):
+        with self.condition:
+            self.size = max(self.size - 1, 0)
+            self.condition.notify()
+
+    # condition を取得した状態で呼び出す（古い接続から順に並んでいる）
+    def _close_idle(self):
+        now = time.monotonic()
+        while self.idle and now - self.idle[0][1] > self.idle_timeout:
+            conn, _ = self.idle.popleft()
+            self.size -= 1
+            self.stats['discarded'] += 1
+            _close(conn)
+
+    def close_all(self):
+        with self.condition:
+            self._check_fork()
+            while self.idle:
+                conn, _ = self.idle.popleft()
+                self.size -= 1
+                _close(conn)
+            self.condition.notify_all()
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_lock = threading.Lock()
+_pools = {}
+
+
+# データベースの別名ごとのプール（設定が変わった場合は作り直す）
+def get_pool(alias, max_size, idle_timeout, timeout):
+    key = (max_size, idle_timeout, timeout)
+    with _lock:
+        pool, pool_key = _pools.get(alias, (None, None))
+        if pool is None or pool_key != key:
+            if pool is not None:
+                pool.close_all()
+            pool = ConnectionPool(max_size, idle_timeout, timeout)
+            _pools[alias] = (pool, key)
+        return pool
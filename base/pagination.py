@@ -0,0 +1,204 @@
+"""
+キーセット（カーソル）方式のページネーション
+OFFSETを使わず、直前のページの最後の行の値を起点に次のページを取得するため、
+深いページでも1ページ分の行数しか読み込まない
+
+管理画面の一覧用に、件数を推定値で返す EstimatedCountPaginator も定義する
+"""
+
+import base64
+import datetime
+import decimal
+import json
+import uuid
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q, QuerySet
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorPage:
+
+    def __init__(self, paginator, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.paginator = paginator
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class CursorPaginator:
+    """
+    ordering には一意になる並び順を指定する（例: ('-created_at', '-id')）
+    最後の項目は主キーなどの一意な項目にすること
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created_at', '-id')):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in self.ordering]
+
+    @cached_property
+    def count(self):
+        # 件数の表示が必要な場合のみ実行される
+        return self.queryset.order_by().count()
+
+    def page(self, cursor=None):
+        direction, values = self.decode_cursor(cursor) if cursor else ('next', None)
+        reverse = direction == 'prev'
+
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        ordering = [self._flip(name) for name in self.ordering] if reverse else list(self.ordering)
+
+        # 1件多く取得して次のページの有無を判定する
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = self.encode_cursor(rows[-1], 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0], 'prev') if rows and has_previous else None
+        return CursorPage(self, rows, has_next, has_previous, next_cursor, previous_cursor)
+
+    def encode_cursor(self, obj, direction):
+        values = [self._to_json(getattr(obj, name)) for name, _ in self.fields]
+        payload = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in ('next', 'prev') or len(values) != len(self.fields):
+                raise ValueError(cursor)
+            return direction, [self._to_python(name, value) for (name, _), value in zip(self.fields, values)]
+        except (ValueError, TypeError, ValidationError):
+            raise InvalidCursor(cursor)
+
+    # DjangoJSONEncoder はマイクロ秒を切り捨てるため、比較に使う値は精度を落とさずに変換する
+    @staticmethod
+    def _to_json(value):
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, (decimal.Decimal, uuid.UUID)):
+            return str(value)
+        return value
+
+    def _to_python(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # annotate した値（検索スコアなど）はそのまま使う
+            return value
+        return field.to_python(value)
+
+    # (a, b, c) > (x, y, z) のような行比較を AND/OR の組み合わせで組み立てる
+    def _keyset_filter(self, values, reverse):
+        condition = Q()
+        equal = Q()
+        for (name, descending), value in zip(self.fields, values):
+            lookup = 'gt' if descending == reverse else 'lt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def _flip(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+
+class CursorPaginationMixin:
+    """
+    ListView 用。paginate_by と cursor_ordering を指定するとカーソル方式でページングする
+    """
+    cursor_ordering = ('-created_at', '-id')
+    cursor_kwarg = 'cursor'
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, ordering=self.get_cursor_ordering())
+        page = paginate_by_cursor(paginator, self.request.GET.get(self.cursor_kwarg))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+
+def paginate_by_cursor(paginator, cursor):
+    try:
+        return paginator.page(cursor)
+    except InvalidCursor:
+        # 不正なカーソルは先頭ページとして扱う
+        return paginator.page()
+
+
+# テーブルの行数の推定値（DBの統計情報から取得する。取得できない場合は None）
+def estimate_rows(model, using='default'):
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [table],
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [table])
+        else:
+            return None
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    件数の多いテーブルの管理画面用
+    ・絞り込みのない一覧は COUNT(*) の代わりにDBの統計情報の推定件数を使う（推定件数が少ない場合は正確に数える）
+    ・絞り込みがある場合は count_limit 件までしか数えない（それ以降のページは表示しない）
+    """
+    estimate_threshold = 10000
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet):
+            return super().count
+        if not queryset.query.where:
+            estimate = estimate_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+            return queryset.count()
+        return queryset.order_by()[:self.count_limit].count()
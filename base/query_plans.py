@@ -0,0 +1,113 @@
+"""
+主要なページの中心となるクエリの実行計画の確認（check_query_plans コマンド）
+・ページごとのクエリを EXPLAIN し、対象のテーブルを全件走査していないかを調べる
+・全件走査の判定はデータベースごとに行う
+  SQLite: SCAN（インデックスの全件走査を含む） / MySQL: type が ALL・index / PostgreSQL: Seq Scan
+"""
+
+import datetime
+import re
+
+from django.db import connections
+from django.db.models import Sum
+from django.utils import timezone
+from base.models import Favorite, Order, Reserve, Review, Shop, User
+
+PAGE_SIZE = 10
+
+
+class Check:
+
+    def __init__(self, name, view, build):
+        self.name = name
+        # クエリを発行するページ・処理（表示用）
+        self.view = view
+        # build(ctx) -> QuerySet（ctx は会員・店舗など、クエリの条件に使う値）
+        self.build = build
+
+
+CHECKS = [
+    Check('shop_list', 'ShopListView', lambda ctx: (
+        Shop.objects.published().with_rating().select_related('category')
+        .order_by('created_at', 'id')[:PAGE_SIZE + 1]
+    )),
+    Check('reviews', 'ShopReviewView', lambda ctx: (
+        Review.objects.filter(shop_id=ctx['shop_id']).exclude(user_id=ctx['user_id'])
+        .select_related('user').order_by('-created_at', '-id')[:PAGE_SIZE + 1]
+    )),
+    Check('reserve_list', 'ReserveListView', lambda ctx: (
+        Reserve.objects.filter(user_id=ctx['user_id']).order_by('-reserved_date')
+    )),
+    Check('reserve_slot', 'ReserveSlot.objects.recount', lambda ctx: (
+        Reserve.objects.filter(
+            shop_id=ctx['shop_id'], reserved_date=ctx['reserved_date'], reserved_time=ctx['reserved_time'],
+        ).values('shop_id').annotate(total=Sum('number_of_people')).order_by()
+    )),
+    Check('favorites', 'FavoritesView', lambda ctx: (
+        Favorite.objects.filter(user_id=ctx['user_id'])
+        .select_related('shop', 'shop__category', 'shop__rating').order_by('-created_at', '-id')[:PAGE_SIZE + 1]
+    )),
+    Check('sales_orders', 'rebuild_sales', lambda ctx: (
+        Order.objects.filter(is_confirmed__in=[True]).values_list('created_at', 'amount', 'tax_included')
+    )),
+    Check('paid_members', 'rebuild_sales', lambda ctx: (
+        User.objects.filter(is_paymentstatus__in=[True], is_admin__in=[False]).values_list('pk')
+    )),
+]
+
+
+# 条件に使う値（データベース内の実際の会員・店舗・予約から選ぶ）
+def make_context():
+    reserve = Reserve.objects.order_by('pk').values('user_id', 'shop_id', 'reserved_date', 'reserved_time').first() or {}
+    return {
+        'user_id': reserve.get('user_id') or User.objects.values_list('pk', flat=True).first() or '',
+        'shop_id': reserve.get('shop_id') or Shop.objects.values_list('pk', flat=True).first() or 0,
+        'reserved_date': reserve.get('reserved_date') or timezone.localdate(),
+        'reserved_time': reserve.get('reserved_time') or datetime.time(12, 0),
+    }
+
+
+def explain(queryset):
+    """(計画の各行, 全件走査したテーブル名のリスト) を返す"""
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    vendor = connection.vendor
+    with connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            lines = [row[-1] for row in cursor.fetchall()]
+            scans = [match[1] for match in map(re.compile(r'^SCAN (\S+)').match, lines) if match]
+        elif vendor == 'mysql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            lines = [f'{row["table"]}: type={row["type"]} key={row["key"]} rows={row["rows"]} {row.get("Extra") or ""}'.rstrip() for row in rows]
+            scans = [row['table'] for row in rows if row['type'] in ('ALL', 'index')]
+        elif vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql, params)
+            lines = [row[0] for row in cursor.fetchall()]
+            scans = re.findall(r'Seq Scan on (\S+)', '\n'.join(lines))
+        else:
+            raise NotImplementedError(f'{vendor} の実行計画には対応していません')
+    return lines, scans
+
+
+def run(checks=None, ctx=None, only=None):
+    """チェックごとに {'name', 'view', 'table', 'plan', 'full_scans'} を返す"""
+    ctx = ctx if ctx is not None else make_context()
+    results = []
+    for check in checks if checks is not None else CHECKS:
+        if only and check.name not in only:
+            continue
+        queryset = check.build(ctx)
+        table = queryset.model._meta.db_table
+        plan, scans = explain(queryset)
+        results.append({
+            'name': check.name,
+            'view': check.view,
+            'table': table,
+            'plan': plan,
+            # 結合先の小さなテーブル（カテゴリーなど）の全件走査は問題にしない
+            'full_scans': [scan for scan in scans if scan == table],
+        })
+    return results
@@ -0,0 +1,131 @@
+"""
+読み取り専用のレプリカへの振り分け（settings.DATABASE_ROUTERS / MIDDLEWARE）
+・公開ページ（REPLICA_VIEWS）の GET・HEAD の間だけ、読み取りを DATABASE_REPLICAS のレプリカに振り分ける
+・書き込み、リクエスト中に開始したトランザクション内の読み取り、セッション・会員の読み取りは常にプライマリ(default)
+・ログイン中の会員が登録・変更（POST など）をした後は、REPLICA_STICKY_SECONDS 秒の間そのセッションの読み取りをプライマリにする
+  （レプリカの遅延で、投稿した口コミ・予約・お気に入りが直後のページに表示されない状態を防ぐ）
+・1つのリクエストでは同じレプリカを1つのトランザクション（同じスナップショット）で読み込む
+  （断片キャッシュのバージョンとデータを同じ時点で読み込み、遅延しているレプリカの内容をキャッシュしないために使う。base/fragments.py）
+"""
+
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+STICKY_SESSION_KEY = '_db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD')
+# レプリカから読み込まないモデル
+PRIMARY_MODELS = {'sessions.session', 'base.user', 'base.cacheversion'}
+
+# レプリカを使う間は (開始時のプライマリのトランザクションの深さ, 読み込むレプリカ)（使わない間は None）
+_replica = contextvars.ContextVar('replica', default=None)
+
+
+def replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+# プライマリで開いている transaction.atomic の深さ
+def _atomic_depth():
+    connection = connections[DEFAULT_DB_ALIAS]
+    return len(connection.savepoint_ids) + 1 if connection.in_atomic_block else 0
+
+
+def activate():
+    """読み取りをレプリカに振り分け始める（戻り値のトークンで元に戻す。開始後に開いたトランザクション内は除く）"""
+    aliases = replicas()
+    return _replica.set((_atomic_depth(), random.choice(aliases) if aliases else None))
+
+
+def deactivate():
+    """以降の読み取りをプライマリに戻す（activate のトークンで元に戻すまで）"""
+    _replica.set(None)
+
+
+def current():
+    """読み取りに使うレプリカ（プライマリから読み込む場合は None）"""
+    state = _replica.get()
+    if state is None:
+        return None
+    depth, alias = state
+    if alias not in replicas() or _atomic_depth() > depth:
+        return None
+    return alias
+
+
+@contextmanager
+def use_replica():
+    token = activate()
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if not replicas():
+            return None
+        alias = current()
+        if alias is None or model._meta.label_lower in PRIMARY_MODELS:
+            # レプリカから読み込んだインスタンスの関連先もプライマリから読み込む
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        # レプリカから読み込んだインスタンスに関連する書き込みもプライマリに行う
+        return DEFAULT_DB_ALIAS if replicas() else None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+def is_sticky(request):
+    return request.session.get(STICKY_SESSION_KEY, 0) > time.time()
+
+
+class ReplicaMiddleware:
+    """SessionMiddleware・AuthenticationMiddleware より後に置く"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        try:
+            response = self.get_response(request)
+        finally:
+            snapshot = getattr(request, '_replica_snapshot', None)
+            if snapshot is not None:
+                snapshot.__exit__(None, None, None)
+            token = getattr(request, '_replica_token', None)
+            if token is not None:
+                _replica.reset(token)
+        # ログイン中の会員の書き込みの後は、しばらくプライマリから読み込む
+        if request.method not in SAFE_METHODS and SESSION_KEY in request.session:
+            request.session[STICKY_SESSION_KEY] = time.time() + settings.REPLICA_STICKY_SECONDS
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            replicas()
+            and request.method in SAFE_METHODS
+            and request.resolver_match.url_name in settings.REPLICA_VIEWS
+            and not is_sticky(request)
+        ):
+            request._replica_token = activate()
+            # 読み取りだけのトランザクションで、リクエストの間は同じ時点のデータを読み込む
+            request._replica_snapshot = transaction.atomic(using=current())
+            request._replica_snapshot.__enter__()
+        return None
@@ -0,0 +1,165 @@
+"""
+店舗のキーワード検索
+形態素解析を使わず、文字bi-gramの転置インデックス(ShopSearchGram)で検索する
+・検索対象: 店名 / 住所 / 説明 / カテゴリ名 / タグ名
+・1文字のキーワード（例:「栄」）に対応するため、1文字(uni-gram)もインデックスに含める
+・スコアは一致したn-gramの重みの合計（店名・カテゴリ・タグの一致を重く評価）
+・n-gramは出現位置ごとに1行で登録し、キーワードのn-gramが連続した位置にあるかを確認する
+  （n-gramが全て含まれていても連続していない場合がある。例:「東京都」に対する「東京」と「京都」）
+"""
+
+import re
+import unicodedata
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, IntegerField, OuterRef, Subquery, Sum, Value
+
+# 項目ごとの重み
+FIELD_WEIGHTS = {
+    'name': 4,
+    'category': 2,
+    'tags': 2,
+    'address': 2,
+    'description': 1,
+}
+
+WORD_RE = re.compile(r'\w+')
+
+
+# 全角・半角や大文字・小文字の違いを吸収する
+def normalize(text):
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def segments(text):
+    return WORD_RE.findall(normalize(text))
+
+
+# 文字bi-gramに分割する（1文字の場合はそのまま）
+def ngrams(segment):
+    if len(segment) == 1:
+        return [segment]
+    return [segment[i:i + 2] for i in range(len(segment) - 1)]
+
+
+# インデックスに登録するn-gram（bi-gramと1文字）と、セグメント内の位置
+def index_grams(segment):
+    if len(segment) == 1:
+        return [(segment, 0)]
+    return [(gram, i) for i, gram in enumerate(ngrams(segment))] + [(char, i) for i, char in enumerate(segment)]
+
+
+# 項目ごとのテキストから (n-gram, 位置, 重み) を返す
+# 位置は項目を1文字空けてつなげたテキストでの文字の位置（別のセグメントのn-gramが連続した位置になることはない）
+def document_grams(fields):
+    grams = []
+    offset = 0
+    for field, text in fields.items():
+        text = normalize(text)
+        weight = FIELD_WEIGHTS[field]
+        for match in WORD_RE.finditer(text):
+            grams.extend((gram, offset + match.start() + i, weight) for gram, i in index_grams(match.group()))
+        offset += len(text) + 1
+    return grams
+
+
+def shop_fields(shop):
+    return {
+        'name': shop.name,
+        'category': shop.category.name if shop.category else '',
+        'tags': ' '.join(tag.name for tag in shop.tags.all()),
+        'address': shop.address,
+        'description': shop.description,
+    }
+
+
+# 指定した店舗の検索インデックスを作り直す
+# 行数が多くなるため、n-gramの登録はモデルのインスタンスを作らずに一括でINSERTする
+def index_shops(shop_ids, batch_size=500):
+    from base.models import Shop, ShopSearchDocument, ShopSearchGram
+
+    shop_ids = list(shop_ids)
+    for start in range(0, len(shop_ids), batch_size):
+        chunk = shop_ids[start:start + batch_size]
+        shops = Shop.objects.filter(pk__in=chunk).select_related('category').prefetch_related('tags')
+
+        documents = []
+        grams = []
+        for shop in shops:
+            fields = shop_fields(shop)
+            documents.append(ShopSearchDocument(shop=shop, text=normalize(' '.join(fields.values()))))
+            grams.extend((shop.pk, gram, position, weight) for gram, position, weight in document_grams(fields))
+
+        with transaction.atomic():
+            ShopSearchDocument.objects.filter(shop_id__in=chunk).delete()
+            ShopSearchGram.objects.filter(shop_id__in=chunk).delete()
+            ShopSearchDocument.objects.bulk_create(documents)
+            _insert_grams(grams)
+
+
+def _insert_grams(rows, batch_size=2000):
+    from base.models import ShopSearchGram
+
+    connection = connections[router.db_for_write(ShopSearchGram)]
+    opts = ShopSearchGram._meta
+    columns = ', '.join(connection.ops.quote_name(opts.get_field(name).column) for name in ('shop', 'gram', 'position', 'weight'))
+    sql = f'INSERT INTO {connection.ops.quote_name(opts.db_table)} ({columns}) VALUES (%s, %s, %s, %s)'
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(sql, rows[start:start + batch_size])
+
+
+def rebuild_index(batch_size=500):
+    from base.models import Shop
+
+    shop_ids = Shop.objects.order_by('pk').values_list('pk', flat=True)
+    index_shops(shop_ids.iterator(chunk_size=batch_size), batch_size=batch_size)
+
+
+# キーワードをインデックスのn-gramに変換する
+def query_grams(keyword):
+    grams = []
+    for segment in segments(keyword):
+        for gram in ngrams(segment):
+            if gram not in grams:
+                grams.append(gram)
+    return grams
+
+
+# 全てのキーワードに一致する店舗に絞り込み、関連度(search_score)を付与する
+def search_shops(queryset, keyword):
+    from base.models import ShopSearchGram
+
+    grams = query_grams(keyword)
+    if not grams:
+        return queryset.annotate(search_score=Value(0, output_field=IntegerField()))
+
+    for segment in dict.fromkeys(segments(keyword)):
+        segment_grams = ngrams(segment)
+        # キーワードの最後のn-gramを含む店舗に絞り込み（インデックスから一度に取得する）、
+        # その店舗だけ、先頭のn-gramの位置から続くn-gramが連続しているかを確認する
+        queryset = queryset.filter(pk__in=ShopSearchGram.objects.filter(gram=segment_grams[-1]).values('shop_id'))
+        if len(segment_grams) > 1:
+            queryset = queryset.filter(Exists(_contiguous(segment_grams)))
+    score = (
+        ShopSearchGram.objects.filter(gram__in=grams, shop=OuterRef('pk'))
+        .values('shop_id')
+        .annotate(total=Sum('weight'))
+        .values('total')
+    )
+    return queryset.annotate(
+        search_score=Subquery(score, output_field=IntegerField()),
+    )
+
+
+# キーワードの先頭のn-gramのうち、続くn-gramが1文字ずつずれた位置にあるもの（店舗ごとに相関させる）
+def _contiguous(grams):
+    from base.models import ShopSearchGram
+
+    following = None
+    for gram in reversed(grams[1:]):
+        subquery = ShopSearchGram.objects.filter(shop=OuterRef('shop'), gram=gram, position=OuterRef('position') + 1)
+        if following is not None:
+            subquery = subquery.filter(following)
+        following = Exists(subquery)
+    return ShopSearchGram.objects.filter(following, shop=OuterRef('pk'), gram=grams[0])
@@ -0,0 +1,165 @@
+"""
+負荷検証用のダミーデータ作成
+bulk_create で作成するため、シグナルによる集計・検索インデックスは呼び出し側で作成する
+（seed_dataset はまとめて作成し直す）
+"""
+
+import datetime
+import random
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from base.models import Category, Favorite, Reserve, ReserveSlot, Review, Shop, ShopRating, Tag, User
+from base.search import index_shops
+
+CATEGORY_NAMES = ['ひつまぶし', 'きしめん', '台湾ラーメン', '味噌カツ', '手羽先', 'モーニング', '味噌煮込みうどん', 'あんかけスパ']
+TAG_NAMES = ['名古屋駅周辺', '栄', '大須・矢場町', '伏見・丸の内', '豊田', 'セントレア空港', '金山', '今池', '覚王山', '一宮']
+AREAS = ['名古屋市中村区名駅', '名古屋市中区栄', '名古屋市中区大須', '名古屋市中区丸の内', '豊田市若宮町', '常滑市セントレア', '名古屋市熱田区金山町', '名古屋市千種区今池']
+NAME_PARTS = ['矢場', '山本屋', '世界の', 'コメダ', '風来坊', '味仙', '宮きしめん', 'あつた', '蓬莱', '総本家', '本店', '亭', '屋', '食堂']
+COMMENTS = ['また行きたいです。', '味噌の香りが最高でした。', '少し待ちましたが満足です。', '量が多くてお得です。', '']
+DESCRIPTIONS = [
+    '創業以来受け継がれてきた秘伝の味噌ダレが自慢の{category}のお店です。',
+    '地元で愛される{category}を気軽に楽しめます。ランチタイムは大変混み合います。',
+    '{area}の駅から徒歩5分。名物の{category}をぜひご賞味ください。',
+]
+
+
+def seed_taxonomy():
+    categories = [
+        Category.objects.get_or_create(slug=f'seed-category-{i}', defaults={'name': name})[0]
+        for i, name in enumerate(CATEGORY_NAMES)
+    ]
+    tags = [
+        Tag.objects.get_or_create(slug=f'seed-tag-{i}', defaults={'name': name})[0]
+        for i, name in enumerate(TAG_NAMES)
+    ]
+    return categories, tags
+
+
+# 店舗をまとめて作成し、作成した店舗のIDを返す
+def seed_shops(count, rng=None, batch_size=1000):
+    rng = rng or random.Random(0)
+    categories, tags = seed_taxonomy()
+
+    shop_ids = []
+    for start in range(0, count, batch_size):
+        shops = []
+        for i in range(start, min(start + batch_size, count)):
+            category = rng.choice(categories)
+            area = rng.choice(AREAS)
+            shops.append(Shop(
+                name=f'{rng.choice(NAME_PARTS)}{rng.choice(NAME_PARTS)} {i}',
+                address=f'{area}{rng.randint(1, 5)}丁目{rng.randint(1, 30)}-{rng.randint(1, 20)}',
+                description=rng.choice(DESCRIPTIONS).format(category=category.name, area=area),
+                category=category,
+                is_published=rng.random() < 0.9,
+                reserve_start_time=datetime.time(11, 0),
+                reserve_end_time=datetime.time(21, 0),
+            ))
+        created = Shop.objects.bulk_create(shops)
+        ids = [shop.pk for shop in created]
+        if None in ids:
+            # 主キーを返さないDBの場合は作成順に取得し直す
+            ids = list(Shop.objects.order_by('-pk').values_list('pk', flat=True)[:len(shops)])[::-1]
+
+        links = [
+            Shop.tags.through(shop_id=shop_id, tag_id=tag.pk)
+            for shop_id in ids
+            for tag in rng.sample(tags, rng.randint(1, 2))
+        ]
+        Shop.tags.through.objects.bulk_create(links)
+        shop_ids.extend(ids)
+    return shop_ids
+
+
+# 会員を作成し、作成した会員のIDを返す（パスワードは全員 "password"）
+def seed_users(count, rng=None, batch_size=1000, prefix='seed-user', is_paymentstatus=True):
+    rng = rng or random.Random(0)
+    password = make_password('password')
+
+    user_ids = []
+    for start in range(0, count, batch_size):
+        users = [
+            User(
+                username=f'{prefix}-{i}', email=f'{prefix}-{i}@example.com', password=password,
+                is_paymentstatus=is_paymentstatus and rng.random() < 0.8,
+            )
+            for i in range(start, min(start + batch_size, count))
+        ]
+        User.objects.bulk_create(users)
+        user_ids.extend(user.pk for user in users)
+    return user_ids
+
+
+def seed_reviews(user_ids, shop_ids, per_shop=5, rng=None, batch_size=2000):
+    rng = rng or random.Random(0)
+    reviews = [
+        Review(
+            user_id=rng.choice(user_ids), shop_id=shop_id,
+            stars=rng.choices([1, 2, 3, 4, 5], weights=[1, 2, 4, 5, 3])[0],
+            comment=rng.choice(COMMENTS),
+        )
+        for shop_id in shop_ids
+        for _ in range(rng.randint(0, per_shop * 2))
+    ]
+    Review.objects.bulk_create(reviews, batch_size=batch_size)
+    return len(reviews)
+
+
+def seed_favorites(user_ids, shop_ids, per_user=5, rng=None, batch_size=2000):
+    rng = rng or random.Random(0)
+    favorites = [
+        Favorite(user_id=user_id, shop_id=shop_id)
+        for user_id in user_ids
+        for shop_id in rng.sample(shop_ids, min(per_user, len(shop_ids)))
+    ]
+    Favorite.objects.bulk_create(favorites, batch_size=batch_size)
+    return len(favorites)
+
+
+# 今日以降30日間の予約を作成する（予約枠ごとの人数もまとめて作成する）
+def seed_reservations(user_ids, shop_ids, per_user=2, rng=None, batch_size=2000):
+    rng = rng or random.Random(0)
+    today = datetime.date.today()
+    times = [datetime.time(hour, minute) for hour in range(11, 21) for minute in (0, 30)]
+
+    reservations = [
+        Reserve(
+            user_id=user_id, shop_id=rng.choice(shop_ids),
+            reserved_date=today + datetime.timedelta(days=rng.randint(1, 30)),
+            reserved_time=rng.choice(times), number_of_people=rng.randint(1, 4),
+        )
+        for user_id in user_ids
+        for _ in range(per_user)
+    ]
+    Reserve.objects.bulk_create(reservations, batch_size=batch_size)
+
+    slots = Counter()
+    for reserve in reservations:
+        slots[reserve.shop_id, reserve.reserved_date, reserve.reserved_time] += reserve.number_of_people
+    ReserveSlot.objects.filter(shop_id__in=set(shop_ids)).delete()
+    ReserveSlot.objects.bulk_create(
+        (
+            ReserveSlot(shop_id=shop_id, reserved_date=reserved_date, reserved_time=reserved_time, reserved_people=people)
+            for (shop_id, reserved_date, reserved_time), people in slots.items()
+        ),
+        batch_size=batch_size,
+    )
+    return len(reservations)
+
+
+# 店舗・会員・レビュー・お気に入り・予約をまとめて作成し、評価集計と検索インデックスを作成する
+def seed_dataset(shops=1000, users=200, reviews_per_shop=5, favorites_per_user=5, reservations_per_user=2, rng=None):
+    rng = rng or random.Random(0)
+    shop_ids = seed_shops(shops, rng=rng)
+    user_ids = seed_users(users, rng=rng)
+    counts = {
+        'shops': len(shop_ids),
+        'users': len(user_ids),
+        'reviews': seed_reviews(user_ids, shop_ids, reviews_per_shop, rng=rng),
+        'favorites': seed_favorites(user_ids, shop_ids, favorites_per_user, rng=rng),
+        'reservations': seed_reservations(user_ids, shop_ids, reservations_per_user, rng=rng),
+    }
+    ShopRating.objects.rebuild(shop_ids=shop_ids)
+    index_shops(shop_ids, batch_size=1000)
+    return shop_ids, user_ids, counts
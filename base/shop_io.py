@@ -0,0 +1,329 @@
+"""
+店舗データの一括登録・出力（import_shops / export_shops コマンド）
+・JSONL（1行1店舗）または CSV を1行ずつ読み書きし、一定件数ごとにまとめて登録するため、件数が増えてもメモリ使用量は一定
+・店舗コード(code)が一致する店舗は更新、それ以外は新規作成する
+・カテゴリー・タグはスラッグ、固定定休日は曜日コード（mon〜sun）、特定休業日は日付（YYYY-MM-DD）で指定する
+・シグナルを通さずに登録するため、評価集計の行・検索インデックス・キャッシュはここで更新する
+"""
+
+import csv
+import datetime
+import json
+from dataclasses import dataclass, field
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+from base import availability, fragments
+from base.models import Category, IrregularHoliday, Shop, ShopRating, Tag
+from base.search import index_shops
+
+TEXT_FIELDS = (
+    'name', 'mail', 'zipcode', 'address', 'tel', 'description', 'price',
+    'seating_capacity', 'opening_hours', 'holiday',
+)
+LIST_FIELDS = ('holidays_select', 'tags', 'irregular_holidays')
+COLUMNS = (
+    'code', *TEXT_FIELDS, 'holidays_select', 'reserve_start_time', 'reserve_end_time', 'reserve_capacity',
+    'is_published', 'category', 'tags', 'irregular_holidays', 'image',
+)
+# 一括登録で書き込む Shop のフィールド
+SHOP_FIELDS = (
+    *TEXT_FIELDS, 'holidays_select', 'reserve_start_time', 'reserve_end_time', 'reserve_capacity',
+    'is_published', 'category', 'image', 'updated_at',
+)
+# CSV の複数値の区切り文字
+CSV_SEPARATOR = '|'
+WEEKDAYS = {value for value, _ in Shop.WEEKDAY_CHOICES}
+# reserve_capacity（PositiveSmallIntegerField）に保存できる範囲
+MAX_RESERVE_CAPACITY = 32767
+
+
+class ShopImportError(ValueError):
+    pass
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)
+
+    @property
+    def total(self):
+        return self.created + self.updated
+
+
+# --- 読み込み ---
+
+def read_records(stream, format):
+    """ファイルから (行番号, dict) を1件ずつ返す（JSONとして読み込めない行は dict の代わりに ShopImportError を返す）"""
+    if format == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, ShopImportError(f'JSONとして読み込めません（{e}）')
+    else:
+        # 1行目はヘッダー
+        for line_no, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_no, {
+                key: (value.split(CSV_SEPARATOR) if value else []) if key in LIST_FIELDS else value
+                for key, value in row.items()
+            }
+
+
+def _time(value):
+    if value in (None, ''):
+        return None
+    return value if isinstance(value, datetime.time) else datetime.time.fromisoformat(value)
+
+
+def _bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes')
+
+
+# 未指定・空の場合だけ既定値にする（0 はそのまま）
+def _capacity(value):
+    if value in (None, ''):
+        return Shop._meta.get_field('reserve_capacity').default
+    capacity = int(value)
+    if not 0 <= capacity <= MAX_RESERVE_CAPACITY:
+        raise ShopImportError(f'reserve_capacity は0〜{MAX_RESERVE_CAPACITY}にしてください')
+    return capacity
+
+
+def _list(value):
+    if value in (None, ''):
+        return []
+    return value.split(CSV_SEPARATOR) if isinstance(value, str) else list(value)
+
+
+# 1件分の値を検証・変換する（カテゴリー・タグはスラッグのまま）
+def clean_record(record):
+    code = str(record.get('code') or '').strip()
+    if not code:
+        raise ShopImportError('code がありません')
+    if not record.get('name'):
+        raise ShopImportError('name がありません')
+
+    holidays_select = _list(record.get('holidays_select'))
+    unknown = set(holidays_select) - WEEKDAYS
+    if unknown:
+        raise ShopImportError(f'holidays_select に不明な曜日があります: {", ".join(sorted(unknown))}')
+
+    try:
+        values = {
+            **{name: str(record.get(name) or '') for name in TEXT_FIELDS},
+            'holidays_select': holidays_select,
+            'reserve_start_time': _time(record.get('reserve_start_time')),
+            'reserve_end_time': _time(record.get('reserve_end_time')),
+            'reserve_capacity': _capacity(record.get('reserve_capacity')),
+            'is_published': _bool(record.get('is_published', False)),
+            'image': str(record.get('image') or Shop._meta.get_field('image').default),
+        }
+        irregular_holidays = sorted({datetime.date.fromisoformat(value) for value in _list(record.get('irregular_holidays'))})
+    except ValueError as e:
+        raise ShopImportError(str(e))
+
+    for name in ('reserve_start_time', 'reserve_end_time'):
+        if values[name] is None:
+            raise ShopImportError(f'{name} がありません')
+    for name in TEXT_FIELDS:
+        max_length = Shop._meta.get_field(name).max_length
+        if max_length and len(values[name]) > max_length:
+            raise ShopImportError(f'{name} は{max_length}文字以内にしてください')
+
+    return {
+        'code': code,
+        'values': values,
+        'category': record.get('category') or None,
+        'tags': _list(record.get('tags')),
+        'irregular_holidays': irregular_holidays,
+    }
+
+
+# --- 登録 ---
+
+class ShopImporter:
+
+    def __init__(self, chunk_size=2000, dry_run=False, index=True):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.index = index
+        self.result = ImportResult()
+        self.categories = dict(Category.objects.values_list('slug', 'pk'))
+        self.tags = dict(Tag.objects.values_list('slug', 'pk'))
+
+    def run(self, records):
+        chunk = {}
+        for line_no, record in records:
+            try:
+                if isinstance(record, ShopImportError):
+                    raise record
+                cleaned = self._resolve(clean_record(record))
+            except (ShopImportError, TypeError, AttributeError) as e:
+                self.result.errors.append((line_no, str(e)))
+                continue
+            # 同じ店舗コードが続いた場合は後の行を使う
+            chunk[cleaned['code']] = cleaned
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk)
+                chunk = {}
+        if chunk:
+            self._flush(chunk)
+        return self.result
+
+    def _resolve(self, cleaned):
+        category = cleaned['category']
+        if category is not None:
+            if category not in self.categories:
+                raise ShopImportError(f'カテゴリー "{category}" がありません')
+            cleaned['values']['category_id'] = self.categories[category]
+        else:
+            cleaned['values']['category_id'] = None
+        missing = [slug for slug in cleaned['tags'] if slug not in self.tags]
+        if missing:
+            raise ShopImportError(f'タグ "{", ".join(missing)}" がありません')
+        cleaned['tag_ids'] = sorted({self.tags[slug] for slug in cleaned['tags']})
+        return cleaned
+
+    def _flush(self, chunk):
+        existing = dict(Shop.objects.filter(code__in=chunk).values_list('code', 'pk'))
+        new_codes = [code for code in chunk if code not in existing]
+        self.result.created += len(new_codes)
+        self.result.updated += len(existing)
+        if self.dry_run:
+            return
+
+        now = timezone.now()
+        with transaction.atomic():
+            Shop.objects.bulk_create(
+                (Shop(code=code, **chunk[code]['values']) for code in new_codes),
+                batch_size=500,
+            )
+            _update_shops(Shop(pk=pk, updated_at=now, **chunk[code]['values']) for code, pk in existing.items())
+            # 主キーを返さないDB（MySQL）でも使えるよう、店舗コードから取得し直す
+            created = dict(Shop.objects.filter(code__in=new_codes).values_list('code', 'pk')) if new_codes else {}
+            shop_ids = {**existing, **created}
+
+            through = Shop.tags.through
+            _delete_for_shops(through, existing.values())
+            through.objects.bulk_create(
+                through(shop_id=shop_ids[code], tag_id=tag_id)
+                for code, cleaned in chunk.items()
+                for tag_id in cleaned['tag_ids']
+            )
+            _delete_for_shops(IrregularHoliday, existing.values())
+            IrregularHoliday.objects.bulk_create(
+                IrregularHoliday(shop_id=shop_ids[code], date=date)
+                for code, cleaned in chunk.items()
+                for date in cleaned['irregular_holidays']
+            )
+            ShopRating.objects.bulk_create((ShopRating(shop_id=pk) for pk in created.values()), ignore_conflicts=True)
+            # 更新した店舗の断片キャッシュだけを破棄する（登録と同じトランザクションでバージョンを更新する）
+            for pk in existing.values():
+                fragments.bump_shop(pk)
+
+        for pk in existing.values():
+            availability.invalidate(pk)
+        if self.index:
+            index_shops(shop_ids.values(), batch_size=self.chunk_size)
+
+
+# 主キーごとの UPDATE をまとめて実行する
+# （bulk_update は件数×フィールド数の CASE 式を組み立てるため、数千件単位では遅くなる）
+def _update_shops(shops):
+    connection = connections[router.db_for_write(Shop)]
+    qn = connection.ops.quote_name
+    fields = [Shop._meta.get_field(name) for name in SHOP_FIELDS]
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(Shop._meta.db_table),
+        ', '.join(f'{qn(field.column)} = %s' for field in fields),
+        qn(Shop._meta.pk.column),
+    )
+    rows = [[field.get_db_prep_save(getattr(shop, field.attname), connection) for field in fields] + [shop.pk] for shop in shops]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+# 店舗に属する行を DELETE 文で直接削除する
+# （QuerySet.delete() は1行ごとのシグナル（検索インデックス・キャッシュの更新）を送るため使わない。呼び出し側でまとめて更新する）
+def _delete_for_shops(model, shop_ids, batch_size=500):
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+    shop_ids = list(shop_ids)
+    with connection.cursor() as cursor:
+        for start in range(0, len(shop_ids), batch_size):
+            batch = shop_ids[start:start + batch_size]
+            cursor.execute(
+                'DELETE FROM {} WHERE {} IN ({})'.format(
+                    qn(model._meta.db_table), qn(model._meta.get_field('shop').column), ', '.join(['%s'] * len(batch)),
+                ),
+                batch,
+            )
+
+
+def import_shops(stream, format='jsonl', chunk_size=2000, dry_run=False, index=True):
+    return ShopImporter(chunk_size=chunk_size, dry_run=dry_run, index=index).run(read_records(stream, format))
+
+
+# --- 出力 ---
+
+def iter_records(chunk_size=2000, queryset=None):
+    """店舗を主キー順に chunk_size 件ずつ読み込み、1件ずつ dict で返す"""
+    queryset = (queryset if queryset is not None else Shop.objects.all()).select_related('category').order_by('pk')
+    last_pk = 0
+    while True:
+        shops = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not shops:
+            return
+        last_pk = shops[-1].pk
+        ids = [shop.pk for shop in shops]
+        tags = {}
+        for shop_id, slug in Shop.tags.through.objects.filter(shop_id__in=ids).order_by('tag__slug').values_list('shop_id', 'tag__slug'):
+            tags.setdefault(shop_id, []).append(slug)
+        holidays = {}
+        for shop_id, date in IrregularHoliday.objects.filter(shop_id__in=ids).order_by('date').values_list('shop_id', 'date'):
+            holidays.setdefault(shop_id, []).append(date.isoformat())
+
+        for shop in shops:
+            yield {
+                'code': shop.code,
+                **{name: getattr(shop, name) for name in TEXT_FIELDS},
+                'holidays_select': list(shop.holidays_select or []),
+                'reserve_start_time': shop.reserve_start_time.isoformat(timespec='minutes') if shop.reserve_start_time else None,
+                'reserve_end_time': shop.reserve_end_time.isoformat(timespec='minutes') if shop.reserve_end_time else None,
+                'reserve_capacity': shop.reserve_capacity,
+                'is_published': shop.is_published,
+                'category': shop.category.slug if shop.category else None,
+                'tags': tags.get(shop.pk, []),
+                'irregular_holidays': holidays.get(shop.pk, []),
+                'image': shop.image.name,
+            }
+
+
+def write_records(records, stream, format='jsonl'):
+    count = 0
+    if format == 'jsonl':
+        for record in records:
+            stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+            count += 1
+        return count
+
+    writer = csv.DictWriter(stream, fieldnames=COLUMNS)
+    writer.writeheader()
+    for record in records:
+        writer.writerow({
+            key: CSV_SEPARATOR.join(value) if key in LIST_FIELDS else ('' if value is None else value)
+            for key, value in record.items()
+        })
+        count += 1
+    return count
+
+
+def export_shops(stream, format='jsonl', chunk_size=2000, queryset=None):
+    return write_records(iter_records(chunk_size, queryset), stream, format)
@@ -0,0 +1,295 @@
+"""
+モデルの保存・削除に連動する処理
+"""
+
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from base import availability, fragments, images, membership
+from base.models import (
+    Category, IrregularHoliday, MembershipChange, Order, Reserve, ReserveSlot, Review, Shop, ShopRating, Tag, User,
+    record_membership_change, record_sales,
+)
+from base.search import index_shops
+
+
+# 店舗作成時に評価集計の行を用意しておく
+@receiver(post_save, sender=Shop)
+def create_shop_rating(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ShopRating.objects.get_or_create(shop=instance)
+
+
+# 更新前のレビューの店舗を控えておく（管理画面で店舗を付け替えた場合に両方を集計し直すため）
+@receiver(pre_save, sender=Review)
+def remember_review_shop(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous_shop_id = (
+        Review.objects.filter(pk=instance.pk).values_list('shop_id', flat=True).first()
+    )
+
+
+# レビュー投稿・更新時に評価集計を反映
+@receiver(post_save, sender=Review)
+def update_shop_rating_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ShopRating.objects.apply_review(instance.shop_id, instance.stars, sign=1)
+    else:
+        shop_ids = {instance.shop_id, getattr(instance, '_previous_shop_id', None)} - {None}
+        ShopRating.objects.rebuild(shop_ids=shop_ids)
+
+
+# レビュー削除時に評価集計を反映
+@receiver(post_delete, sender=Review)
+def update_shop_rating_on_delete(sender, instance, **kwargs):
+    ShopRating.objects.apply_review(instance.shop_id, instance.stars, sign=-1)
+
+
+# 店舗の画像が変わった場合は、コミット後にバックグラウンドで縮小版を作成（作成後に断片キャッシュも更新する）
+@receiver(post_save, sender=Shop)
+def create_image_derivatives(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule_shop_derivatives(instance)
+
+
+# 店舗の保存時に検索インデックスを更新
+@receiver(post_save, sender=Shop)
+def index_shop(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_shops([instance.pk])
+
+
+# 店舗のタグ変更時（自動作成の中間テーブルの行の保存・削除はシグナルを送らないため、管理画面のインラインは ShopAdmin.save_related で更新する）
+@receiver(m2m_changed, sender=Shop.tags.through)
+def index_shop_on_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # post_clear の時点では関連が削除済みのため、削除前に対象店舗を控えておく
+        instance._cleared_shop_ids = list(instance.shop_set.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        # Tag側から変更された場合
+        index_shops(pk_set if pk_set is not None else instance.__dict__.pop('_cleared_shop_ids', []))
+    else:
+        index_shops([instance.pk])
+
+
+# カテゴリ名・タグ名の変更時は関連する店舗を更新
+@receiver(post_save, sender=Category)
+def index_shops_in_category(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_shops(instance.shop_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+def index_shops_with_tag(sender, instance, raw=False, **kwargs):
+    if not raw:
+        index_shops(instance.shop_set.values_list('pk', flat=True))
+
+
+# カテゴリ・タグの削除時は削除前に対象店舗を控えておき、削除後に更新
+# （自動作成の中間テーブルの行は削除のシグナルを送らないため、タグの削除もここで更新する）
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Tag)
+def remember_indexed_shops(sender, instance, **kwargs):
+    instance._indexed_shop_ids = list(instance.shop_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Tag)
+def reindex_shops_after_delete(sender, instance, **kwargs):
+    index_shops(getattr(instance, '_indexed_shop_ids', []))
+
+
+# 予約枠ごとの予約人数を更新（予約画面からの予約は base.booking で定員を確認して加算済み）
+@receiver(pre_save, sender=Reserve)
+def remember_reserve_slot(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous_slot = (
+        Reserve.objects.filter(pk=instance.pk).values_list('shop_id', 'reserved_date', 'reserved_time').first()
+    )
+
+
+@receiver(post_save, sender=Reserve)
+def update_reserve_slot_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        if not getattr(instance, '_slot_reserved', False):
+            ReserveSlot.objects.reserve(
+                instance.shop_id, instance.reserved_date, instance.reserved_time, instance.number_of_people,
+            )
+        return
+    slots = {(instance.shop_id, instance.reserved_date, instance.reserved_time)}
+    if getattr(instance, '_previous_slot', None):
+        slots.add(instance._previous_slot)
+    for slot in slots:
+        ReserveSlot.objects.recount(*slot)
+
+
+@receiver(post_delete, sender=Reserve)
+def update_reserve_slot_on_delete(sender, instance, **kwargs):
+    ReserveSlot.objects.release(
+        instance.shop_id, instance.reserved_date, instance.reserved_time, instance.number_of_people,
+    )
+
+
+# 予約・休業日・店舗情報（定休日や予約時間）の変更時に空き状況のキャッシュを破棄
+@receiver(post_save, sender=Reserve)
+@receiver(post_delete, sender=Reserve)
+@receiver(post_save, sender=IrregularHoliday)
+@receiver(post_delete, sender=IrregularHoliday)
+def invalidate_availability(sender, instance, **kwargs):
+    availability.invalidate(instance.shop_id)
+
+
+@receiver(post_save, sender=Shop)
+def invalidate_shop_availability(sender, instance, **kwargs):
+    availability.invalidate(instance.pk)
+
+
+# 公開ページの断片キャッシュのバージョンを更新
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def bump_shop_fragments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump_shop(instance.pk)
+
+
+# レビュー（評価の平均・件数）と特定休業日は該当店舗のみ
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=IrregularHoliday)
+@receiver(post_delete, sender=IrregularHoliday)
+def bump_related_shop_fragments(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    fragments.bump_shop(instance.shop_id)
+    previous_shop_id = getattr(instance, '_previous_shop_id', None)
+    if previous_shop_id and previous_shop_id != instance.shop_id:
+        fragments.bump_shop(previous_shop_id)
+
+
+@receiver(m2m_changed, sender=Shop.tags.through)
+def bump_fragments_on_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        fragments.bump_taxonomy()
+    else:
+        fragments.bump_shop(instance.pk)
+
+
+# カテゴリ名・タグ名は多くの店舗に表示されるため全体のバージョンを更新
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_taxonomy_fragments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump_taxonomy()
+
+
+# 売上集計（注文の決済済みの金額を作成日の集計に反映する）
+def order_sales(order):
+    if not order.is_confirmed:
+        return {'revenue': 0, 'tax': 0, 'orders': 0}
+    return {'revenue': order.amount, 'tax': order.tax_included, 'orders': 1}
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_sales(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._previous_order = Order.objects.filter(pk=instance.pk).first()
+
+
+@receiver(post_save, sender=Order)
+def update_sales_on_order_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    current = order_sales(instance)
+    previous = getattr(instance, '_previous_order', None)
+    if previous is not None:
+        before = order_sales(previous)
+        current = {field: value - before[field] for field, value in current.items()}
+    record_sales(instance.created_at, **current)
+
+
+@receiver(post_delete, sender=Order)
+def update_sales_on_order_delete(sender, instance, **kwargs):
+    record_sales(instance.created_at, **{field: -value for field, value in order_sales(instance).items()})
+
+
+# 会員数の集計（新規登録は登録日、有料会員の登録・解約は変更した日に反映する）
+MEMBERSHIP_FIELDS = {'is_paymentstatus', 'is_admin'}
+
+
+@receiver(pre_save, sender=User)
+def remember_membership(sender, instance, raw=False, update_fields=None, **kwargs):
+    # ログイン時の last_login の更新などは対象外
+    if raw or instance._state.adding or (update_fields is not None and not MEMBERSHIP_FIELDS & set(update_fields)):
+        return
+    instance._previous_membership = (
+        User.objects.filter(pk=instance.pk).values_list('is_paymentstatus', 'is_admin').first()
+    )
+
+
+@receiver(post_save, sender=User)
+def update_sales_on_user_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        if not instance.is_admin:
+            record_sales(instance.created_at, signups=1)
+            if instance.is_paymentstatus:
+                record_membership_change(instance.pk, MembershipChange.SUBSCRIBED, instance.created_at)
+        return
+    previous = instance.__dict__.pop('_previous_membership', None)
+    if previous is None:
+        return
+    was_paid, was_admin = previous
+    was_paid = was_paid and not was_admin
+    is_paid = instance.is_paymentstatus and not instance.is_admin
+    if was_admin != instance.is_admin:
+        # 管理者への変更・管理者からの変更は会員数から除外・追加する
+        record_sales(instance.created_at, signups=1 if was_admin else -1)
+    if is_paid and not was_paid:
+        record_membership_change(instance.pk, MembershipChange.SUBSCRIBED)
+    elif was_paid and not is_paid:
+        record_membership_change(instance.pk, MembershipChange.CANCELED)
+
+
+@receiver(post_delete, sender=User)
+def update_sales_on_user_delete(sender, instance, **kwargs):
+    if instance.is_admin:
+        return
+    record_sales(instance.created_at, signups=-1)
+    if instance.is_paymentstatus:
+        record_membership_change(instance.pk, MembershipChange.CANCELED)
+
+
+# ログイン時に会員のスナップショットをセッションに保存する（以降のリクエストでは会員の行を読み込まずに権限を確認できる）
+@receiver(user_logged_in)
+def store_membership_on_login(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        membership.store(request, user)
+
+
+# 会員の種別・ユーザー名などが変わった場合は、その会員のセッションのスナップショットを読み直させる
+# （ログイン時の last_login の更新などは対象外）
+@receiver(post_save, sender=User)
+def invalidate_membership_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw or created or (update_fields is not None and not membership.FIELDS & set(update_fields)):
+        return
+    membership.invalidate(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_membership_on_delete(sender, instance, **kwargs):
+    membership.invalidate(instance.pk)
@@ -0,0 +1,99 @@
+"""
+アップロードされたファイル（店舗画像など）を MEDIA_ROOT に保存するストレージと、その配信
+・ファイル名を内容のハッシュ（SHA-256の先頭32文字）にするため、同じ内容のファイルは1つだけ保存される
+・内容が変わるとURLも変わるため、配信時は変更されない前提で長期間キャッシュさせる（immutable）
+・URLはファイル名から組み立てるだけで、ストレージへの問い合わせは行わない
+DEFAULT_FILE_STORAGE = 'base.storage.ContentAddressedStorage' で使用し、SERVE_MEDIA で MediaFilesMiddleware から配信する
+"""
+
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+HASHED_NAME = re.compile(r'(?:^|/)(?P<digest>[0-9a-f]{32})\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def content_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    # ファイル名を内容のハッシュに置き換える（ディレクトリと拡張子は upload_to で決めたものを使う）
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        _, ext = os.path.splitext(filename)
+        name = posixpath.join(directory, f'{content_digest(content)}{ext.lower()}')
+        # 同じ内容のファイルは保存済み
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+class MediaFilesMiddleware:
+    """
+    MEDIA_URL 以下のファイルを MEDIA_ROOT から配信する
+    ハッシュ名のファイルは1年間（immutable）、それ以外は MEDIA_CACHE_MAX_AGE 秒キャッシュさせ、ETagが一致する場合は304を返す
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SERVE_MEDIA', False) or not settings.MEDIA_URL.startswith('/'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.prefix = settings.MEDIA_URL
+        self.root = os.fspath(settings.MEDIA_ROOT)
+        self.max_age = getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD') and request.path_info.startswith(self.prefix):
+            response = self.serve(request, unquote(request.path_info[len(self.prefix):]))
+            if response is not None:
+                return response
+        return self.get_response(request)
+
+    def serve(self, request, name):
+        try:
+            path = safe_join(self.root, name)
+            stat = os.stat(path)
+        except (SuspiciousFileOperation, OSError, ValueError):
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        match = HASHED_NAME.search(name)
+        if match:
+            etag = f'"{match["digest"]}"'
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+            cache_control = f'public, max-age={self.max_age}'
+
+        not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+        if not_modified is None:
+            content_type, encoding = mimetypes.guess_type(path)
+            response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        else:
+            response = not_modified
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(stat.st_mtime)
+        response.headers['Cache-Control'] = cache_control
+        return response
@@ -0,0 +1,133 @@
+"""
+Stripeの商品・価格(Price / Product)のプロセス内キャッシュ
+・ほとんど変わらない値のため、有効期限(STRIPE_CATALOG_TTL)の間はStripeのAPIを呼び出さない
+・invalidate() で破棄する（世代番号を Django のキャッシュに保存し、共有のキャッシュを使う場合は全プロセスで破棄される）
+・キャッシュのヒット率とStripeのAPI呼び出しの所要時間・サーキットブレーカーの状態を metrics() で取得できる
+"""
+
+import logging
+import threading
+import time
+
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from base import stripe_client
+
+logger = logging.getLogger('base.stripe')
+
+GENERATION_KEY = 'stripe_catalog:generation'
+
+
+class LookupStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def snapshot(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+stats = LookupStats()
+
+
+class TTLCache:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def get_or_load(self, key, loader, ttl):
+        generation = cache.get(GENERATION_KEY, 0)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now and entry[1] == generation:
+                stats.record(hit=True)
+                return entry[2]
+        stats.record(hit=False)
+        value = loader()
+        with self.lock:
+            self.entries[key] = (now + ttl, generation, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_catalog = TTLCache()
+
+
+def invalidate():
+    _catalog.clear()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _ttl():
+    return getattr(settings, 'STRIPE_CATALOG_TTL', 600)
+
+
+def _load_price(price_id):
+    price = stripe_client.request('prices.retrieve', price_id, params={'expand': ['product']})
+    product = price.get('product') or {}
+    recurring = price.get('recurring') or {}
+    return {
+        'id': price['id'],
+        'unit_amount': price.get('unit_amount'),
+        'currency': price.get('currency'),
+        'interval': recurring.get('interval'),
+        'product': {'id': product.get('id'), 'name': product.get('name')} if isinstance(product, dict) else {'id': product},
+    }
+
+
+# 価格（商品名を含む）。STRIPE_PRICE_ID が未設定の場合は None
+def get_price(price_id=None):
+    price_id = price_id or settings.STRIPE_PRICE_ID
+    if not price_id:
+        return None
+    return _catalog.get_or_load(f'price:{price_id}', lambda: _load_price(price_id), _ttl())
+
+
+def get_product(product_id):
+    def load():
+        product = stripe_client.request('products.retrieve', product_id)
+        return {'id': product['id'], 'name': product.get('name')}
+    return _catalog.get_or_load(f'product:{product_id}', load, _ttl())
+
+
+# 月額料金（Stripeから取得できない場合は settings.MONTHLY_FEE）
+def monthly_fee():
+    try:
+        price = get_price()
+    except stripe.error.StripeError:
+        logger.warning('failed to load stripe price, falling back to MONTHLY_FEE', exc_info=True)
+        price = None
+    if price and price.get('unit_amount') is not None:
+        return price['unit_amount']
+    return settings.MONTHLY_FEE
+
+
+def metrics():
+    return {'cache': stats.snapshot(), **stripe_client.metrics()}
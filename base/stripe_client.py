@@ -0,0 +1,205 @@
+"""
+StripeのAPIクライアント（プロセスごとに1つを共有する）
+・接続(requests.Session)を使い回し、リクエストごとのTLSハンドシェイクを省く
+・接続・応答のタイムアウトを設定する（STRIPE_CONNECT_TIMEOUT / STRIPE_READ_TIMEOUT）
+・接続エラー・5xxは待ち時間にばらつきを持たせて再試行する（STRIPE_MAX_RETRIES、POSTはStripeの冪等キーで二重に実行されない）
+・失敗が続いた場合はしばらくStripeを呼び出さずにすぐエラーにする（サーキットブレーカー）
+・呼び出しは request('prices.retrieve', ...) のように StripeClient.v1 以下のメソッド名で行い、所要時間を記録する
+"""
+
+import logging
+import operator
+import random
+import threading
+import time
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger('base.stripe')
+
+
+# Stripeが不調のため呼び出しを止めている場合のエラー（接続エラーと同じく扱えるようにする）
+class CircuitOpenError(stripe.error.APIConnectionError):
+    pass
+
+
+class RetryingRequestsClient(stripe.RequestsClient):
+    """再試行の待ち時間を設定から決める RequestsClient（待ち時間は 0〜上限 の間でばらつかせる）"""
+
+    def __init__(self, retry_delay, retry_max_delay, **kwargs):
+        super().__init__(**kwargs)
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+
+    def _sleep_time_seconds(self, num_retries, response=None):
+        delay = random.uniform(0, min(self.retry_delay * 2 ** (num_retries - 1), self.retry_max_delay))
+        # Stripeから待ち時間を指定された場合はそれに従う
+        retry_after = self._retry_after_header(response) or 0
+        if retry_after <= self.MAX_RETRY_AFTER:
+            delay = max(retry_after, delay)
+        return delay
+
+
+class CircuitBreaker:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < settings.STRIPE_BREAKER_RESET:
+            return 'open'
+        return 'half-open'
+
+    # 呼び出してよいか（再開を試す間は1件だけ通す）
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial:
+                self.trial = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.reset()
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial or self.failures >= settings.STRIPE_BREAKER_THRESHOLD:
+                if self.opened_at is None or self.trial:
+                    logger.warning('stripe circuit opened after %d failures', self.failures)
+                self.opened_at = time.monotonic()
+                self.trial = False
+
+
+class CallStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.calls = {}
+
+    def record(self, name, duration_ms, error=False):
+        with self.lock:
+            stats = self.calls.setdefault(name, {'count': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            stats['count'] += 1
+            stats['errors'] += int(error)
+            stats['total_ms'] += duration_ms
+            stats['max_ms'] = max(stats['max_ms'], duration_ms)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    **stats,
+                    'total_ms': round(stats['total_ms'], 1),
+                    'max_ms': round(stats['max_ms'], 1),
+                    'avg_ms': round(stats['total_ms'] / stats['count'], 1),
+                }
+                for name, stats in self.calls.items()
+            }
+
+
+stats = CallStats()
+breaker = CircuitBreaker()
+
+_lock = threading.Lock()
+_client = None
+_client_key = None
+
+
+def _config():
+    return (
+        settings.STRIPE_SECRET_KEY or '',
+        settings.STRIPE_API_BASE,
+        settings.STRIPE_CONNECT_TIMEOUT,
+        settings.STRIPE_READ_TIMEOUT,
+        settings.STRIPE_POOL_SIZE,
+        settings.STRIPE_MAX_RETRIES,
+        settings.STRIPE_RETRY_DELAY,
+        settings.STRIPE_RETRY_MAX_DELAY,
+    )
+
+
+def _build(api_key, api_base, connect_timeout, read_timeout, pool_size, max_retries, retry_delay, retry_max_delay):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    http_client = RetryingRequestsClient(
+        retry_delay, retry_max_delay,
+        timeout=(connect_timeout, read_timeout),
+        session=session,
+    )
+    return stripe.StripeClient(
+        api_key,
+        http_client=http_client,
+        max_network_retries=max_retries,
+        base_addresses={'api': api_base} if api_base else None,
+    )
+
+
+# 共有のクライアント（設定が変わった場合は作り直す）
+def get_client():
+    global _client, _client_key
+    key = _config()
+    with _lock:
+        if _client is None or _client_key != key:
+            _client = _build(*key)
+            _client_key = key
+        return _client
+
+
+# Stripeが不調であることを示すエラー（カードエラーなどの入力の誤りは含めない）
+def _is_outage(error):
+    if isinstance(error, (stripe.error.APIConnectionError, stripe.error.RateLimitError)):
+        return True
+    return isinstance(error, stripe.error.APIError) and (error.http_status or 500) >= 500
+
+
+# StripeのAPIを呼び出す（name は StripeClient.v1 以下のメソッド名）
+def request(name, *args, **kwargs):
+    if not breaker.allow():
+        stats.record(name, 0.0, error=True)
+        raise CircuitOpenError('Stripeに接続できないため、しばらくしてから再度お試しください。')
+
+    method = operator.attrgetter(name)(get_client().v1)
+    started = time.perf_counter()
+    error = None
+    try:
+        return method(*args, **kwargs)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        duration = (time.perf_counter() - started) * 1000
+        stats.record(name, duration, error is not None)
+        if error is not None and _is_outage(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        logger.info('stripe %s %.1fms%s', name, duration, f' ({type(error).__name__})' if error else '')
+
+
+def metrics():
+    return {
+        'calls': stats.snapshot(),
+        'breaker': {'state': breaker.state, 'failures': breaker.failures},
+    }
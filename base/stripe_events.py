@@ -0,0 +1,172 @@
+"""
+Stripeのwebhookイベントの受信と反映
+・webhookは署名を確認してイベントを StripeEvent に保存するだけにし、すぐに応答する
+・ワーカー(process_stripe_events)が未処理のイベントを順に会員・注文へ反映する
+・同じイベントIDは1件しか保存しないため、Stripeから再送されても二重に反映されない
+・関連する会員がまだ見つからない場合（イベントの到着順が前後した場合）は時間をおいて再処理する
+"""
+
+import datetime
+import json
+import logging
+
+import stripe
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from base import stripe_catalog
+from base.models import Order, StripeEvent, User
+
+logger = logging.getLogger('base.stripe')
+
+HANDLERS = {}
+
+
+class RetryLater(Exception):
+    pass
+
+
+# STRIPE_WEBHOOK_SECRET が設定されていない（空の鍵では誰でも署名できるため、イベントを受け付けない）
+class WebhookNotConfigured(Exception):
+    pass
+
+
+def handles(event_type):
+    def register(func):
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+# 署名を確認してイベントの内容を返す（署名が不正な場合は stripe.error.SignatureVerificationError）
+def parse_event(payload, sig_header):
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        raise WebhookNotConfigured('STRIPE_WEBHOOK_SECRET が設定されていません')
+    stripe.Webhook.construct_event(payload, sig_header, settings.STRIPE_WEBHOOK_SECRET)
+    return json.loads(payload)
+
+
+# 受信したイベントを保存する（保存済みのイベントIDの場合は何もしない）
+def record_event(event):
+    return StripeEvent.objects.get_or_create(
+        event_id=event['id'],
+        defaults={'type': event['type'], 'payload': event},
+    )
+
+
+def process_pending(limit=100, now=None):
+    now = now or timezone.now()
+    pks = list(
+        StripeEvent.objects.filter(status=StripeEvent.PENDING)
+        .filter(Q(available_at__isnull=True) | Q(available_at__lte=now))
+        .order_by('received_at', 'pk')
+        .values_list('pk', flat=True)[:limit]
+    )
+    return sum(process_event(pk) for pk in pks)
+
+
+# イベントを1件反映する（反映できた場合は True）
+def process_event(pk):
+    with transaction.atomic():
+        events = StripeEvent.objects.filter(pk=pk, status=StripeEvent.PENDING)
+        if connection.features.has_select_for_update_skip_locked:
+            # 複数のワーカーが同じイベントを処理しないよう、処理中の行は読み飛ばす
+            events = events.select_for_update(skip_locked=True)
+        event = events.first()
+        if event is None:
+            return False
+
+        event.attempts += 1
+        try:
+            with transaction.atomic():
+                handler = HANDLERS.get(event.type)
+                if handler:
+                    handler(event.payload['data']['object'])
+        except Exception as e:
+            retry = isinstance(e, RetryLater) and event.attempts < settings.STRIPE_EVENT_MAX_ATTEMPTS
+            event.status = StripeEvent.PENDING if retry else StripeEvent.FAILED
+            event.last_error = f'{type(e).__name__}: {e}'
+            # 再処理までの待ち時間は回数ごとに倍にする（最大1時間）
+            event.available_at = timezone.now() + datetime.timedelta(seconds=min(2 ** event.attempts, 3600))
+            event.save()
+            log = logger.info if retry else logger.exception
+            log('stripe event %s (%s) not applied: %s', event.event_id, event.type, e)
+            return False
+
+        event.status = StripeEvent.PROCESSED
+        event.processed_at = timezone.now()
+        event.last_error = ''
+        event.save()
+    return True
+
+
+def _user_by_customer(customer_id):
+    user = User.objects.filter(stripe_customer_id=customer_id).first() if customer_id else None
+    if user is None:
+        # checkout.session.completed より先に届いた場合
+        raise RetryLater(f'customer {customer_id} is not linked to a user yet')
+    return user
+
+
+# 決済画面での登録完了（client_reference_id は create_checkout_session で渡した会員ID）
+@handles('checkout.session.completed')
+def checkout_session_completed(session):
+    user = User.objects.filter(pk=session.get('client_reference_id')).first()
+    if user is None:
+        logger.warning('checkout session %s has no matching user', session.get('id'))
+        return
+    user.is_paymentstatus = True
+    user.stripe_customer_id = session.get('customer') or ''
+    user.stripe_subscription_id = session.get('subscription') or ''
+    user.save(update_fields=['is_paymentstatus', 'stripe_customer_id', 'stripe_subscription_id', 'updated_at'])
+
+
+# 支払い完了（初回・毎月の更新ごとに注文を作成する）
+@handles('invoice.paid')
+def invoice_paid(invoice):
+    amount = invoice.get('amount_paid') or 0
+    if not amount:
+        return
+    user = _user_by_customer(invoice.get('customer'))
+    tax = invoice.get('tax')
+    if tax is None:
+        # (消費税額) = (税込み価格) - (税抜価格)
+        tax = amount - int(amount / (1 + settings.TAX_RATE / 100))
+    Order.objects.create(user=user, is_confirmed=True, amount=amount, tax_included=tax)
+
+
+# カードの登録・変更
+@handles('payment_method.attached')
+def payment_method_attached(payment_method):
+    user = _user_by_customer(payment_method.get('customer'))
+    card = payment_method.get('card') or {}
+    user.stripe_card_brand = card.get('brand') or ''
+    user.stripe_card_no = card.get('last4') or ''
+    name = (payment_method.get('billing_details') or {}).get('name')
+    if name:
+        user.stripe_card_name = name
+    user.save(update_fields=['stripe_card_brand', 'stripe_card_no', 'stripe_card_name', 'updated_at'])
+
+
+# 解約（退会処理で解除済みの場合は該当する会員がいないため何もしない）
+@handles('customer.subscription.deleted')
+def subscription_deleted(subscription):
+    for user in User.objects.filter(stripe_subscription_id=subscription.get('id')):
+        user.is_paymentstatus = False
+        user.stripe_customer_id = ''
+        user.stripe_subscription_id = ''
+        user.stripe_setup_intent = ''
+        user.stripe_card_brand = ''
+        user.stripe_card_name = ''
+        user.stripe_card_no = ''
+        user.save()
+
+
+# 価格・商品の変更時はキャッシュを破棄する
+@handles('price.updated')
+@handles('price.deleted')
+@handles('product.updated')
+@handles('product.deleted')
+def catalog_changed(obj):
+    stripe_catalog.invalidate()
@@ -0,0 +1,153 @@
+"""
+オフラインでStripeとの連携を確認するための疑似Stripe
+・FakeStripeEvents: webhook からワーカーまでを確認するため、Stripeと同じ形式（Stripe-Signature: t=...,v1=...）で署名したイベントを作成する
+・StubStripeServer: StripeのAPIの代わりに応答するローカルのHTTPサーバー（STRIPE_API_BASE に url を指定して使う）
+"""
+
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+
+
+def sign(payload, secret, timestamp=None):
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class FakeStripeEvents:
+
+    def __init__(self, secret=None):
+        self.secret = secret or settings.STRIPE_WEBHOOK_SECRET
+
+    def event(self, event_type, obj):
+        return {
+            'id': f'evt_fake_{secrets.token_hex(12)}',
+            'object': 'event',
+            'type': event_type,
+            'created': int(time.time()),
+            'livemode': False,
+            'data': {'object': obj},
+        }
+
+    # webhook に送る本文とヘッダー
+    def signed(self, event):
+        payload = json.dumps(event)
+        return payload, sign(payload, self.secret)
+
+    def checkout_completed(self, user, customer_id, subscription_id):
+        return self.event('checkout.session.completed', {
+            'id': f'cs_fake_{secrets.token_hex(8)}', 'object': 'checkout.session',
+            'client_reference_id': user.pk, 'customer': customer_id, 'subscription': subscription_id,
+            'mode': 'subscription',
+        })
+
+    def invoice_paid(self, customer_id, subscription_id, amount=None):
+        return self.event('invoice.paid', {
+            'id': f'in_fake_{secrets.token_hex(8)}', 'object': 'invoice',
+            'customer': customer_id, 'subscription': subscription_id,
+            'amount_paid': settings.MONTHLY_FEE if amount is None else amount, 'tax': None,
+        })
+
+    def payment_method_attached(self, customer_id, brand='visa', last4='4242', name='TARO NAGOYA'):
+        return self.event('payment_method.attached', {
+            'id': f'pm_fake_{secrets.token_hex(8)}', 'object': 'payment_method', 'customer': customer_id,
+            'card': {'brand': brand, 'last4': last4}, 'billing_details': {'name': name},
+        })
+
+    def subscription_deleted(self, subscription_id):
+        return self.event('customer.subscription.deleted', {
+            'id': subscription_id, 'object': 'subscription', 'status': 'canceled',
+        })
+
+    # 有料会員登録時にStripeから届く一連のイベント（到着順は前後することがある）
+    def subscribe(self, user):
+        customer_id = f'cus_fake_{secrets.token_hex(6)}'
+        subscription_id = f'sub_fake_{secrets.token_hex(6)}'
+        return [
+            self.checkout_completed(user, customer_id, subscription_id),
+            self.payment_method_attached(customer_id),
+            self.invoice_paid(customer_id, subscription_id),
+        ]
+
+
+class StubStripeServer:
+    """
+    routes には (メソッド, パス) ごとに応答 (ステータス, 本文) を登録し、登録した順に返す（最後の応答は繰り返す）
+    受け付けたリクエストは requests に、接続数は connections に記録する
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def add(self, method, path, *responses, delay=0):
+        self.routes[(method, path)] = {'responses': list(responses), 'delay': delay}
+
+    def count(self, method, path):
+        return sum(1 for request in self.requests if request[:2] == (method, path))
+
+    def _respond(self, method, path, body):
+        with self.lock:
+            self.requests.append((method, path, body))
+            route = self.routes.get((method, path))
+            if route is None:
+                return 0, 404, {'error': {'type': 'invalid_request_error', 'message': f'No such route: {method} {path}'}}
+            responses = route['responses']
+            status, payload = responses.pop(0) if len(responses) > 1 else responses[0]
+            return route['delay'], status, payload
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length).decode() if length else ''
+                delay, status, payload = stub._respond(self.command, self.path.split('?')[0], body)
+                if delay:
+                    time.sleep(delay)
+                content = json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(content)))
+                    self.send_header('Request-Id', f'req_stub_{secrets.token_hex(6)}')
+                    self.end_headers()
+                    self.wfile.write(content)
+                except (BrokenPipeError, ConnectionResetError):
+                    # タイムアウトでクライアントが切断した場合
+                    self.close_connection = True
+
+            do_GET = do_POST = do_DELETE = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
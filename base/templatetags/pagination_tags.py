@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+# 現在の検索条件（category_id / tag_id / keyword など）を残したままカーソルだけを差し替えたURLを返す
+@register.simple_tag(takes_context=True)
+def cursor_url(context, cursor, key='cursor'):
+    query = context['request'].GET.copy()
+    query[key] = cursor
+    return f'?{query.urlencode()}'
@@ -0,0 +1,47 @@
+from django import template
+from django.utils.html import format_html
+
+from base import fragments, images
+
+register = template.Library()
+
+
+# 店舗のカード（snippets/shop_box.html）を店舗ごとにキャッシュして表示する
+@register.simple_tag
+def shop_box(shop, template_name='snippets/shop_box.html'):
+    return fragments.render_shop_card(shop, template_name)
+
+
+# 一覧の店舗のカードをまとめて描画し、(店舗, カード) の一覧を返す
+# 例: {% shop_cards object_list as cards %}{% for object, card in cards %}{{ card }}{% endfor %}
+@register.simple_tag
+def shop_cards(shops, template_name='snippets/shop_box.html'):
+    shops = list(shops)
+    return list(zip(shops, fragments.render_shop_cards(shops, template_name)))
+
+
+# {% cache %} タグのキーに含める店舗のバージョン
+@register.simple_tag
+def shop_cache_version(shop):
+    return fragments.shop_version(shop.pk)
+
+
+# {% cache %} タグの有効期限（settings.FRAGMENT_CACHE_TIMEOUT）
+@register.simple_tag
+def fragment_timeout():
+    return fragments.timeout()
+
+
+# 店舗の画像（縮小版がある場合は WebP / JPEG の srcset を出力する）
+# 例: {% shop_image shop 'card' 'card-img-top vertical-card-image' %}
+@register.simple_tag
+def shop_image(shop, size='card', css_class=''):
+    webp = images.srcset(shop, size, 'webp')
+    jpeg = images.srcset(shop, size, 'jpeg')
+    if not (webp and jpeg):
+        return format_html('<img src="{}" class="{}" alt="{}" loading="lazy">', shop.image.url, css_class, shop.name)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}">'
+        '<img src="{}" srcset="{}" class="{}" alt="{}" loading="lazy"></picture>',
+        webp, jpeg.split(' ', 1)[0], jpeg, css_class, shop.name,
+    )
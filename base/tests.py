@@ -1,3 +1,1766 @@
-from django.test import TestCase
+import contextlib
+import csv
+import datetime
+import importlib
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+import pymysql
+import stripe
+from PIL import Image
+from pymysql.constants import SERVER_STATUS
+
+from django.contrib.admin import AdminSite
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core import signing
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections, router, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import timezone
+from base.models import (
+    CacheVersion, Category, Favorite, IrregularHoliday, MembershipChange, Order, Reserve, ReserveSlot, Review, SalesDaily,
+    SalesMonthly, Shop, ShopRating, StripeEvent, Tag, User, WorkerLease,
+    rebuild_sales, sales_totals,
+)
+from base import availability, backends, benchmark, booking, checks, exports, fragments, ids, images, membership, pagination, query_plans, replicas, seeding, shop_io, stripe_catalog, stripe_client, stripe_events, versions
+from base.admin import ShopAdmin
+from base.mysql import base as mysql_backend, pool as db_pool
+from base.search import search_shops
+from base.stripe_fake import FakeStripeEvents, StubStripeServer
+
+
+def create_user(username, is_paymentstatus=True):
+    user = User.objects.create_user(
+        f'{username}@example.com', username, 'password',
+        zipcode='', prefecture='', city='', address1='', address2='', tel='',
+    )
+    user.is_paymentstatus = is_paymentstatus
+    user.save()
+    return user
+
+
+def create_shops(count, category=None, tags=()):
+    shops = []
+    for i in range(count):
+        shop = Shop.objects.create(
+            name=f'店舗{i}', category=category, is_published=True,
+            reserve_start_time=datetime.time(11, 0), reserve_end_time=datetime.time(20, 0),
+        )
+        shop.tags.set(tags)
+        shops.append(shop)
+    return shops
+
+
+# お気に入り一覧のクエリ数
+class FavoritesViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='味噌カツ', slug='misokatsu')
+        cls.tags = [Tag.objects.create(name='栄', slug='sakae'), Tag.objects.create(name='大須', slug='osu')]
+        cls.reviewer = create_user('reviewer')
+
+    def setUp(self):
+        self.user = create_user('member')
+        self.client.force_login(self.user)
+
+    def add_favorites(self, count):
+        for shop in create_shops(count, self.category, self.tags):
+            Review.objects.create(user=self.reviewer, shop=shop, stars=4)
+            Favorite.objects.create(user=self.user, shop=shop)
+
+    def count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('favorites'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_depend_on_number_of_favorites(self):
+        self.add_favorites(3)
+        few = self.count_queries()
+        self.add_favorites(30)
+        many = self.count_queries()
+        self.assertEqual(few, many)
+
+    def test_query_count_is_pinned(self):
+        self.add_favorites(30)
+        # セッション / 会員のバージョン / お気に入り(店舗・カテゴリ・評価をJOIN) / タグ
+        # （有料会員かどうかはセッションのスナップショットで確認し、会員の行は読み込まない）
+        with self.assertNumQueries(4):
+            self.client.get(reverse('favorites'))
+
+    def test_cursor_pages_cover_all_favorites_once(self):
+        self.add_favorites(25)
+        seen = []
+        url = reverse('favorites')
+        response = self.client.get(url)
+        while True:
+            page = response.context['page_obj']
+            seen.extend(favorite.pk for favorite in page)
+            if not page.has_next():
+                break
+            response = self.client.get(url, {'cursor': page.next_cursor})
+
+        expected = list(
+            Favorite.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('pk', flat=True)
+        )
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(url, {'cursor': page.previous_cursor}).context['page_obj']
+        self.assertEqual([favorite.pk for favorite in previous], expected[10:20])
+
+
+# n-gramインデックスによるキーワード検索
+class ShopSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='味噌カツ', slug='misokatsu')
+        cls.sakae = Tag.objects.create(name='栄', slug='sakae')
+        cls.osu = Tag.objects.create(name='大須', slug='osu')
+        cls.miso_sakae, cls.miso_osu, cls.other = create_shops(3)
+        cls.miso_sakae.category = cls.miso_osu.category = cls.category
+        cls.miso_sakae.save()
+        cls.miso_osu.save()
+        cls.miso_sakae.tags.set([cls.sakae])
+        cls.miso_osu.tags.set([cls.osu])
+
+    def search(self, keyword):
+        return list(search_shops(Shop.objects.all(), keyword).order_by('-search_score', 'pk'))
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.search('味噌カツ 栄'), [self.miso_sakae])
+        self.assertEqual(self.search('みそ'), [])
+
+    def test_grams_must_be_contiguous(self):
+        self.other.address = '東京 京都'
+        self.other.save()
+        self.assertEqual(self.search('東京都'), [])
+        self.assertEqual(self.search('東京'), [self.other])
+
+    def test_normalizes_width_and_case(self):
+        self.other.name = 'COMEDA珈琲'
+        self.other.save()
+        self.assertEqual(self.search('ｃｏｍｅｄａ'), [self.other])
+
+    def test_index_follows_tag_and_category_changes(self):
+        self.osu.name = '栄'
+        self.osu.save()
+        self.assertEqual(set(self.search('味噌カツ 栄')), {self.miso_sakae, self.miso_osu})
+
+        self.category.name = 'とんかつ'
+        self.category.save()
+        self.assertEqual(self.search('味噌カツ'), [])
+
+    def test_index_follows_tag_clear_and_delete(self):
+        self.sakae.shop_set.clear()
+        self.assertEqual(self.search('味噌カツ 栄'), [])
+
+        self.osu.delete()
+        self.assertEqual(self.search('大須'), [])
+
+    def test_index_follows_admin_tag_inline(self):
+        # インラインは中間テーブルを直接保存する（シグナルは送られない）
+        Shop.tags.through.objects.create(shop=self.other, tag=self.osu)
+        self.assertEqual(self.search('大須'), [self.miso_osu])
+        ShopAdmin(Shop, AdminSite()).save_related(None, mock.Mock(instance=self.other), [], True)
+        self.assertEqual(self.search('大須'), [self.miso_osu, self.other])
+
+
+# 店舗一覧のカーソル方式ページング
+class ShopListPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='手羽先', slug='teba')
+        cls.shops = create_shops(23, cls.category)
+        create_shops(5)
+
+    def walk(self, params):
+        url = reverse('restaurants_list')
+        response = self.client.get(url, params)
+        seen = []
+        while True:
+            page = response.context['page_obj']
+            seen.extend(shop.pk for shop in page)
+            if not page.has_next():
+                return response, seen
+            self.assertIn(f'category_id={self.category.pk}', response.content.decode())
+            response = self.client.get(url, {**params, 'cursor': page.next_cursor})
+
+    def test_pages_keep_filters_and_cover_all_shops(self):
+        response, seen = self.walk({'category_id': self.category.pk})
+        self.assertEqual(seen, [shop.pk for shop in self.shops])
+        self.assertEqual(response.context['paginator'].count, 23)
+
+    def test_keyword_results_are_paged_by_relevance(self):
+        response, seen = self.walk({'category_id': self.category.pk, 'keyword': '手羽先'})
+        self.assertEqual(sorted(seen), [shop.pk for shop in self.shops])
+
+
+
+# 公開ページの断片キャッシュ
+class ShopFragmentCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='手羽先', slug='teba')
+        cls.shop = create_shops(1, cls.category)[0]
+
+    def setUp(self):
+        caches[fragments.CACHE_ALIAS].clear()
+
+    def get(self, name):
+        kwargs = {'pk': self.shop.pk} if name == 'restaurants_detail' else {}
+        return self.client.get(reverse(name, kwargs=kwargs))
+
+    def test_cards_are_served_from_cache_until_the_shop_changes(self):
+        for name in ('index', 'restaurants_list', 'restaurants_detail'):
+            self.assertContains(self.get(name), '店舗0')
+
+        # シグナルを通さない更新はキャッシュに反映されない
+        Shop.objects.filter(pk=self.shop.pk).update(name='更新後の店舗')
+        for name in ('index', 'restaurants_list', 'restaurants_detail'):
+            self.assertNotContains(self.get(name), '更新後の店舗')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.name = '更新後の店舗'
+            self.shop.save()
+        for name in ('index', 'restaurants_list', 'restaurants_detail'):
+            self.assertContains(self.get(name), '更新後の店舗')
+
+    def test_review_and_category_changes_bump_versions(self):
+        self.get('restaurants_list')
+        version = fragments.shop_version(self.shop.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(user=create_user('member'), shop=self.shop, stars=4, comment='おいしい')
+        self.assertNotEqual(fragments.shop_version(self.shop.pk), version)
+        self.assertContains(self.get('restaurants_list'), '4.0（1件）')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = '味噌カツ'
+            self.category.save()
+        self.assertContains(self.get('restaurants_list'), '#味噌カツ')
+
+    def test_versions_do_not_restart_when_the_cache_is_empty(self):
+        # バージョンはデータベースにあるため、別のプロセス（空のキャッシュ）でも同じ値になり、古いキーに戻らない
+        fragments.bump_shop(self.shop.pk)
+        version = fragments.shop_version(self.shop.pk)
+        caches[fragments.CACHE_ALIAS].clear()
+        caches['default'].clear()
+        self.assertEqual(fragments.shop_version(self.shop.pk), version)
+        self.assertNotEqual(version, '0.0')
+
+    def test_cards_are_rendered_in_one_batch(self):
+        create_shops(2, self.category)
+        shops = list(Shop.objects.with_rating().select_related('category').order_by('pk'))
+        expected = [render_to_string('snippets/shop_box.html', {'object': shop, 'shop': shop}) for shop in shops]
+        self.assertEqual(fragments.render_shop_cards(shops, 'snippets/shop_box.html'), expected)
+
+        # キャッシュがある場合は描画しない
+        with mock.patch.object(fragments, 'CardRenderer') as renderer:
+            self.assertEqual(fragments.render_shop_cards(shops, 'snippets/shop_box.html'), expected)
+        renderer.assert_not_called()
+
+    def test_warm_list_skips_tag_queries(self):
+        create_shops(5, self.category)
+        self.get('restaurants_list')
+        with CaptureQueriesContext(connection) as cold:
+            caches[fragments.CACHE_ALIAS].clear()
+            self.get('restaurants_list')
+        with CaptureQueriesContext(connection) as warm:
+            self.get('restaurants_list')
+        self.assertEqual(len(cold) - len(warm), 6)
+
+# SQL計測ミドルウェア
+class QueryInstrumentationMiddlewareTests(TestCase):
+
+    def test_server_timing_header_and_log(self):
+        with self.assertLogs('base.performance', level='INFO') as logs:
+            response = self.client.get(reverse('index'))
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$')
+        self.assertIn('"view": "index"', logs.output[0])
+        self.assertTrue(logs.output[0].startswith('INFO'))
+
+    @override_settings(QUERY_COUNT_WARNING_THRESHOLD=0)
+    def test_warns_above_threshold(self):
+        with self.assertLogs('base.performance', level='WARNING') as logs:
+            self.client.get(reverse('index'))
+        self.assertTrue(logs.output[0].startswith('WARNING'))
+
+
+# 予約枠の空き状況
+class ReserveAvailabilityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = create_shops(1)[0]
+        cls.shop.holidays_select = ['mon']
+        cls.shop.reserve_capacity = 4
+        cls.shop.save()
+        cls.user = create_user('member')
+
+    def month(self, date):
+        response = self.client.get(
+            reverse('reserve_availability', kwargs={'pk': self.shop.pk}), {'month': date.strftime('%Y-%m')}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['dates']
+
+    def test_holidays_and_capacity(self):
+        # 翌月の月曜日と火曜日
+        first = (datetime.date.today().replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+        monday = first + datetime.timedelta(days=(7 - first.weekday()) % 7)
+        tuesday = monday + datetime.timedelta(days=1)
+        IrregularHoliday.objects.create(shop=self.shop, date=tuesday)
+
+        dates = self.month(first)
+        self.assertTrue(dates[monday.isoformat()]['closed'])
+        self.assertTrue(dates[tuesday.isoformat()]['closed'])
+
+        wednesday = tuesday + datetime.timedelta(days=1)
+        self.assertEqual(dates[wednesday.isoformat()]['slots']['12:00'], 4)
+
+        # 予約の作成・削除でキャッシュが破棄される
+        reserve = Reserve.objects.create(
+            user=self.user, shop=self.shop, reserved_date=wednesday,
+            reserved_time=datetime.time(12, 0), number_of_people=3,
+        )
+        self.assertEqual(self.month(first)[wednesday.isoformat()]['slots']['12:00'], 1)
+        reserve.delete()
+        self.assertEqual(self.month(first)[wednesday.isoformat()]['slots']['12:00'], 4)
+
+    def test_version_survives_cache_eviction(self):
+        # 古いバージョンに戻ると、破棄した空き状況のキャッシュを再び参照してしまう
+        availability.invalidate(self.shop.pk)
+        version = versions.get(f'availability:{self.shop.pk}')
+        caches['default'].clear()
+        self.assertEqual(versions.get(f'availability:{self.shop.pk}'), version)
+        self.assertNotEqual(version, 0)
+
+    def test_full_slot_is_rejected(self):
+        day = datetime.date.today() + datetime.timedelta(days=30)
+        if day.weekday() == 0:
+            day += datetime.timedelta(days=1)
+        Reserve.objects.create(
+            user=self.user, shop=self.shop, reserved_date=day,
+            reserved_time=datetime.time(18, 0), number_of_people=3,
+        )
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('reserve', kwargs={'pk': self.shop.pk}), {
+            'reserved_date': day.isoformat(), 'reserved_time': '18:00', 'number_of_people': 2,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('満席', str(response.context['form'].non_field_errors()))
+        self.assertEqual(Reserve.objects.filter(shop=self.shop).count(), 1)
+
+
+
+class BookingTests(TestCase):
+
+    def setUp(self):
+        self.shop = create_shops(1)[0]
+        self.shop.reserve_capacity = 4
+        self.shop.save()
+        self.user = create_user('member')
+        self.day = datetime.date.today() + datetime.timedelta(days=7)
+        self.slot = datetime.time(12, 0)
+
+    def test_book_rejects_when_capacity_is_reached(self):
+        booking.book(self.user.pk, self.shop, self.day, self.slot, 3)
+        with self.assertRaises(booking.SlotFullError) as raised:
+            booking.book(self.user.pk, self.shop, self.day, self.slot, 2)
+        self.assertEqual(raised.exception.remaining, 1)
+        booking.book(self.user.pk, self.shop, self.day, self.slot, 1)
+        self.assertEqual(ReserveSlot.objects.get(shop=self.shop).reserved_people, 4)
+
+    def test_slot_counter_follows_reserve_changes(self):
+        reserve = booking.book(self.user.pk, self.shop, self.day, self.slot, 3)
+        reserve.number_of_people = 2
+        reserve.save()
+        self.assertEqual(ReserveSlot.objects.get(shop=self.shop).reserved_people, 2)
+        reserve.delete()
+        self.assertEqual(ReserveSlot.objects.get(shop=self.shop).reserved_people, 0)
+
+    def test_reserve_ids_are_unique(self):
+        self.shop.reserve_capacity = 50
+        self.shop.save()
+        ids = {booking.book(self.user.pk, self.shop, self.day, self.slot, 1).pk for _ in range(50)}
+        self.assertEqual(len(ids), 50)
+
+
+# 同時予約の負荷試験（複数スレッドから同じ予約枠に一斉に予約する）
+# SQLiteはデータベース全体をロックして同時に書き込めないため、MySQLでのみ実行する
+@skipIf(connection.vendor == 'sqlite', 'SQLite does not support concurrent writers')
+class ConcurrentBookingTests(TransactionTestCase):
+    threads = 200
+
+    def test_capacity_is_never_exceeded(self):
+        shop = create_shops(1)[0]
+        shop.reserve_capacity = 20
+        shop.save()
+        users = [create_user(f'member{i}') for i in range(10)]
+        day = datetime.date.today() + datetime.timedelta(days=7)
+        slot = datetime.time(12, 0)
+
+        barrier = threading.Barrier(self.threads)
+        results = []
+        lock = threading.Lock()
+
+        def attempt(index):
+            try:
+                barrier.wait()
+                try:
+                    booking.book(users[index % len(users)].pk, shop, day, slot, 1)
+                    result = 'booked'
+                except booking.SlotFullError:
+                    result = 'full'
+                except Exception as e:
+                    result = repr(e)
+                with lock:
+                    results.append(result)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=attempt, args=(i,)) for i in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(len(results), self.threads)
+        self.assertEqual(results.count('booked'), 20, [r for r in results if r not in ('booked', 'full')][:3])
+        self.assertEqual(results.count('full'), self.threads - 20)
+        self.assertEqual(Reserve.objects.filter(shop=shop).count(), 20)
+        self.assertEqual(ReserveSlot.objects.get(shop=shop).reserved_people, 20)
+
+
+class CompactIdTests(TestCase):
+
+    def test_ids_are_time_ordered_and_unique(self):
+        values = [ids.next_id() for _ in range(5000)]
+        self.assertEqual(values, sorted(values))
+        self.assertEqual(len(set(values)), len(values))
+        self.assertLess(values[-1], 1 << 63)
+
+        compact = [ids.compact_id() for _ in range(100)]
+        self.assertEqual(compact, sorted(compact))
+        self.assertTrue(all(len(value) == 13 for value in compact))
+
+    def test_worker_id_setting(self):
+        with override_settings(ID_WORKER_ID='5'):
+            self.assertEqual(ids.worker_id(), 5)
+        with override_settings(ID_WORKER_ID=''):
+            self.assertEqual(ids.worker_id(), 0)
+        for value in ('1024', 'web.1', 'random'):
+            with override_settings(ID_WORKER_ID=value), self.assertRaises(ImproperlyConfigured):
+                ids.worker_id()
+        # 本番環境では未指定を check --deploy でエラーにする
+        with override_settings(ID_WORKER_ID=''):
+            self.assertEqual([error.id for error in checks.check_id_worker_id(None)], ['base.E001'])
+        with override_settings(ID_WORKER_ID='lease'):
+            self.assertEqual(checks.check_id_worker_id(None), [])
+
+    @override_settings(ID_WORKER_ID='lease', ID_WORKER_LEASE_SECONDS=600)
+    def test_processes_lease_different_workers(self):
+        # テストのトランザクション内で確認するため、貸し出しにもテストの接続を使う
+        self.addCleanup(ids._reset_lease)
+        with mock.patch.object(ids, '_lease_connection', lambda: contextlib.nullcontext(connection)):
+            workers = []
+            for _ in range(3):
+                # 別のプロセスとして借りる
+                ids._reset_lease()
+                workers.append(ids.worker_id())
+                self.assertEqual(ids.worker_id(), workers[-1])
+            self.assertEqual(len(set(workers)), 3)
+            self.assertEqual(WorkerLease.objects.count(), 3)
+
+            # 期限の半分を過ぎると同じ番号のまま延長する
+            worker, owner, expires_ms = ids._lease
+            ids._lease = (worker, owner, ids._now_ms() + 1000)
+            self.assertEqual(ids.worker_id(), worker)
+            self.assertGreater(WorkerLease.objects.get(worker=worker).expires_ms, expires_ms)
+
+            # 期限切れの番号だけが空いている場合はその番号を借りる
+            WorkerLease.objects.bulk_create(
+                WorkerLease(worker=number, owner='other', expires_ms=ids._now_ms() + 600000)
+                for number in range(ids.MAX_WORKER + 1) if number not in workers
+            )
+            WorkerLease.objects.filter(worker=workers[0]).update(expires_ms=0)
+            ids._reset_lease()
+            self.assertEqual(ids.worker_id(), workers[0])
+            ids._reset_lease()
+            with self.assertRaises(ImproperlyConfigured):
+                ids.worker_id()
+
+    def test_reserve_can_be_found_by_legacy_id(self):
+        user = create_user('member')
+        shop = create_shops(1)[0]
+        day = datetime.date.today() + datetime.timedelta(days=7)
+        reserve = Reserve.objects.create(
+            user=user, shop=shop, reserved_date=day, reserved_time=datetime.time(12, 0),
+            number_of_people=2, legacy_id='20240501120000123456',
+        )
+        self.client.force_login(user)
+        for key in (reserve.pk, reserve.legacy_id):
+            response = self.client.get(reverse('reserve_delete', kwargs={'pk': key}))
+            self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('reserve_delete', kwargs={'pk': '20240501120000999999'}))
+        self.assertEqual(response.status_code, 404)
+
+
+# 負荷計測のシナリオが全てのページで正常に応答すること
+class BenchmarkTests(TestCase):
+
+    def test_all_scenarios_respond(self):
+        shop_ids, user_ids, counts = seeding.seed_dataset(shops=20, users=5, rng=random.Random(0))
+        self.assertEqual(counts['shops'], 20)
+        member = User.objects.filter(pk__in=user_ids, is_paymentstatus=True).first()
+        admin = User.objects.create(username='admin', email='admin@example.com', is_admin=True)
+        ctx = {
+            'shop_ids': shop_ids,
+            'category_ids': list(Category.objects.values_list('pk', flat=True)),
+            'tag_ids': list(Tag.objects.values_list('pk', flat=True)),
+        }
+
+        results = benchmark.run(ctx, benchmark.make_clients(member, admin), requests=3, warmup=1)
+
+        self.assertEqual(set(results), {scenario.name for scenario in benchmark.SCENARIOS})
+        for name, result in results.items():
+            self.assertTrue(set(result['statuses']) <= {'200', '302'}, (name, result['statuses']))
+            self.assertGreater(result['queries_max'], 0, name)
+
+    def test_shop_card_benchmark_renders_the_same_cards(self):
+        out = io.StringIO()
+        call_command('benchmark_shop_cards', cards=20, repeat=1, stdout=out)
+        self.assertIn('20枚のカードを描画しました。', out.getvalue())
+        self.assertEqual(caches[fragments.CACHE_ALIAS].get_many([
+            fragments.card_key('snippets/shop_box.html', -i, fragments.shop_version(-i)) for i in range(1, 21)
+        ]), {})
+
+
+# 売上・会員数の集計
+class SalesRollupTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', email='admin@example.com', is_admin=True)
+        self.member = create_user('member', is_paymentstatus=False)
+
+    def summary(self):
+        self.client.force_login(self.admin)
+        return self.client.get(reverse('admin_summary'))
+
+    def test_rollups_follow_orders_and_membership_changes(self):
+        self.member.is_paymentstatus = True
+        self.member.save()
+        Order.objects.create(user=self.member, is_confirmed=True, amount=300, tax_included=27)
+        Order.objects.create(user=self.member, is_confirmed=False, amount=300, tax_included=27)
+        create_user('other', is_paymentstatus=False)
+
+        totals = sales_totals()
+        self.assertEqual((totals['revenue'], totals['tax'], totals['orders']), (300, 27, 1))
+        self.assertEqual((totals['signups'], totals['paid_members']), (2, 1))
+
+        self.member.is_paymentstatus = False
+        self.member.save()
+        self.assertEqual(sales_totals()['paid_members'], 0)
+        today = SalesDaily.objects.get(date=timezone.localdate())
+        self.assertEqual((today.subscriptions, today.cancellations), (1, 1))
+
+        response = self.summary()
+        self.assertEqual(response.context['total_revenue'], 300)
+        self.assertEqual(response.context['total_users'], 2)
+        self.assertEqual(response.context['total_subscriptionusers'], 0)
+        self.assertEqual(list(response.context['monthly_sales']), list(SalesMonthly.objects.all()))
+
+    def test_rebuild_matches_incremental_totals(self):
+        for i in range(3):
+            user = create_user(f'paid{i}')
+            Order.objects.create(user=user, is_confirmed=True, amount=300, tax_included=27)
+        before = sales_totals()
+        rebuild_sales()
+        self.assertEqual(sales_totals(), before)
+
+    def test_rebuild_counts_membership_changes_not_renewals(self):
+        self.member.is_paymentstatus = True
+        self.member.save()
+        # 定期的な更新の決済は登録数に含めない
+        for _ in range(3):
+            Order.objects.create(user=self.member, is_confirmed=True, amount=300, tax_included=27)
+        before = sales_totals()
+        rebuild_sales()
+        self.assertEqual(sales_totals(), before)
+        self.assertEqual((before['subscriptions'], before['cancellations'], before['orders']), (1, 0, 3))
+
+    def test_rebuild_records_changes_made_without_signals(self):
+        other = create_user('other', is_paymentstatus=False)
+        Order.objects.create(user=other, is_confirmed=True, amount=300, tax_included=27)
+        User.objects.filter(pk=other.pk).update(is_paymentstatus=True)
+        rebuild_sales()
+        change = MembershipChange.objects.get(user_id=other.pk)
+        self.assertEqual(change.kind, MembershipChange.SUBSCRIBED)
+        self.assertEqual(change.created_at, Order.objects.get(user=other).created_at)
+        self.assertEqual(sales_totals()['paid_members'], 1)
+
+        User.objects.filter(pk=other.pk).update(is_paymentstatus=False)
+        rebuild_sales()
+        rebuild_sales()
+        totals = sales_totals()
+        self.assertEqual((totals['subscriptions'], totals['cancellations'], totals['paid_members']), (1, 1, 0))
+
+    def test_summary_queries_do_not_grow_with_orders(self):
+        self.summary()
+        with CaptureQueriesContext(connection) as few:
+            self.summary()
+        Order.objects.bulk_create(
+            Order(user=self.member, is_confirmed=True, amount=300, tax_included=27) for _ in range(200)
+        )
+        rebuild_sales()
+        with CaptureQueriesContext(connection) as many:
+            self.summary()
+        self.assertEqual(len(few), len(many))
+
+
+# Stripeのwebhookとイベントの反映
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('member', is_paymentstatus=False)
+        self.fake = FakeStripeEvents()
+
+    def send(self, event, signature=None):
+        payload, signed = self.fake.signed(event)
+        return self.client.post(
+            reverse('stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or signed,
+        )
+
+    def test_rejects_invalid_signature(self):
+        event = self.fake.subscribe(self.user)[0]
+        self.assertEqual(self.send(event, signature='t=1,v1=invalid').status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_rejects_events_without_a_webhook_secret(self):
+        # 空の鍵で署名したイベントも受け付けない
+        with override_settings(STRIPE_WEBHOOK_SECRET=''):
+            self.fake = FakeStripeEvents()
+            event = self.fake.subscribe(self.user)[0]
+            self.assertEqual(self.send(event).status_code, 503)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_events_are_applied_once_in_any_order(self):
+        events = self.fake.subscribe(self.user)
+        # 注文・カードのイベントが会員の登録より先に届き、さらに再送された場合
+        for event in [*reversed(events), *events]:
+            self.assertEqual(self.send(event).status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 3)
+
+        stripe_events.process_pending()
+        self.assertEqual(StripeEvent.objects.filter(status=StripeEvent.PROCESSED).count(), 1)
+        stripe_events.process_pending(now=timezone.now() + datetime.timedelta(minutes=1))
+        stripe_events.process_pending(now=timezone.now() + datetime.timedelta(minutes=1))
+        self.assertEqual(StripeEvent.objects.filter(status=StripeEvent.PROCESSED).count(), 3)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_paymentstatus)
+        self.assertEqual((self.user.stripe_card_brand, self.user.stripe_card_no), ('visa', '4242'))
+        self.assertEqual(Order.objects.filter(user=self.user, is_confirmed=True).count(), 1)
+
+        self.send(self.fake.subscription_deleted(self.user.stripe_subscription_id))
+        stripe_events.process_pending()
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_paymentstatus)
+        self.assertEqual(sales_totals()['paid_members'], 0)
+
+    def test_success_page_does_not_call_stripe(self):
+        self.client.force_login(self.user)
+        with mock.patch('stripe.checkout.Session.retrieve') as retrieve:
+            response = self.client.get(reverse('subscription_success'), {'session_id': 'cs_test'})
+        self.assertRedirects(response, reverse('index'))
+        retrieve.assert_not_called()
+
+
+class StubStripeMixin:
+    """StripeのAPIをローカルのスタブサーバーに向ける"""
+
+    def setUp(self):
+        super().setUp()
+        self.stub = StubStripeServer()
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        overrides = override_settings(
+            STRIPE_API_BASE=self.stub.url, STRIPE_SECRET_KEY='sk_test_stub',
+            STRIPE_READ_TIMEOUT=1.0, STRIPE_RETRY_DELAY=0.01, STRIPE_RETRY_MAX_DELAY=0.02,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        stripe_catalog.invalidate()
+        stripe_catalog.stats.reset()
+        stripe_client.stats.reset()
+        stripe_client.breaker.reset()
+        self.addCleanup(stripe_catalog.invalidate)
+        self.addCleanup(stripe_client.breaker.reset)
+
+
+@override_settings(STRIPE_PRICE_ID='price_test', STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeCatalogTests(StubStripeMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.price = {
+            'id': 'price_test', 'object': 'price', 'unit_amount': 500, 'currency': 'jpy',
+            'recurring': {'interval': 'month'},
+            'product': {'id': 'prod_test', 'object': 'product', 'name': '有料会員'},
+        }
+        self.stub.add('GET', '/v1/prices/price_test', (200, self.price))
+
+    def test_price_is_loaded_once_until_invalidated(self):
+        self.assertEqual(stripe_catalog.monthly_fee(), 500)
+        self.assertEqual(stripe_catalog.get_price()['product']['name'], '有料会員')
+        self.assertEqual(self.stub.count('GET', '/v1/prices/price_test'), 1)
+
+        # 価格の変更イベントを反映するとキャッシュが破棄される
+        event = FakeStripeEvents().event('price.updated', self.price)
+        stripe_events.record_event(event)
+        stripe_events.process_pending()
+        stripe_catalog.monthly_fee()
+        self.assertEqual(self.stub.count('GET', '/v1/prices/price_test'), 2)
+
+        metrics = stripe_catalog.metrics()
+        self.assertEqual((metrics['cache']['hits'], metrics['cache']['misses']), (1, 2))
+        self.assertEqual(metrics['calls']['prices.retrieve']['count'], 2)
+
+    @override_settings(MONTHLY_FEE=300, STRIPE_MAX_RETRIES=0)
+    def test_falls_back_to_setting_when_stripe_fails(self):
+        self.stub.add('GET', '/v1/prices/price_test', (500, {'error': {'type': 'api_error', 'message': 'down'}}))
+        self.assertEqual(stripe_catalog.monthly_fee(), 300)
+        self.assertEqual(stripe_catalog.metrics()['calls']['prices.retrieve']['errors'], 1)
+
+    def test_config_is_cacheable_and_pages_show_the_fee(self):
+        response = self.client.get(reverse('stripe_config'))
+        self.assertEqual(response.json()['monthlyFee'], 500)
+        self.assertIn('max-age=', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(reverse('stripe_config'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(create_user('member', is_paymentstatus=False))
+        self.assertContains(self.client.get(reverse('subscription')), '月額たったの500円')
+        self.assertEqual(self.stub.count('GET', '/v1/prices/price_test'), 1)
+
+    def test_metrics_require_staff(self):
+        self.client.force_login(create_user('member'))
+        self.assertEqual(self.client.get(reverse('stripe_metrics')).status_code, 403)
+
+        self.client.force_login(User.objects.create(username='admin', email='admin@example.com', is_admin=True))
+        response = self.client.get(reverse('stripe_metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('hit_ratio', response.json()['cache'])
+        self.assertEqual(response.json()['breaker']['state'], 'closed')
+
+
+class StripeClientTests(StubStripeMixin, TestCase):
+    error = (500, {'error': {'type': 'api_error', 'message': 'Stripe is down'}})
+    customer = (200, {'id': 'cus_test', 'object': 'customer'})
+
+    def retrieve(self):
+        return stripe_client.request('customers.retrieve', 'cus_test')
+
+    def test_connections_are_reused(self):
+        self.stub.add('GET', '/v1/customers/cus_test', self.customer)
+        for _ in range(3):
+            self.assertEqual(self.retrieve().id, 'cus_test')
+        self.assertEqual(self.stub.connections, 1)
+        self.assertEqual(self.stub.requests[0][2], '')
+
+    def test_server_errors_are_retried(self):
+        self.stub.add('GET', '/v1/customers/cus_test', self.error, self.customer)
+        self.assertEqual(self.retrieve().id, 'cus_test')
+        self.assertEqual(self.stub.count('GET', '/v1/customers/cus_test'), 2)
+        self.assertEqual(stripe_client.breaker.failures, 0)
+
+    @override_settings(STRIPE_READ_TIMEOUT=0.1, STRIPE_MAX_RETRIES=1)
+    def test_slow_responses_time_out(self):
+        self.stub.add('GET', '/v1/customers/cus_test', self.customer, delay=0.5)
+        with self.assertRaises(stripe.error.APIConnectionError):
+            self.retrieve()
+        self.assertEqual(self.stub.count('GET', '/v1/customers/cus_test'), 2)
+
+    @override_settings(STRIPE_MAX_RETRIES=0, STRIPE_BREAKER_THRESHOLD=2, STRIPE_BREAKER_RESET=0.1)
+    def test_circuit_opens_after_repeated_failures(self):
+        self.stub.add('GET', '/v1/customers/cus_test', self.error, self.error, self.customer)
+        for _ in range(2):
+            with self.assertRaises(stripe.error.APIError):
+                self.retrieve()
+        with self.assertRaises(stripe_client.CircuitOpenError):
+            self.retrieve()
+        self.assertEqual(self.stub.count('GET', '/v1/customers/cus_test'), 2)
+        self.assertEqual(stripe_client.metrics()['breaker']['state'], 'open')
+
+        # 一定時間後に1件だけ試し、成功したら再開する
+        time.sleep(0.15)
+        self.assertEqual(self.retrieve().id, 'cus_test')
+        self.assertEqual(stripe_client.breaker.state, 'closed')
+
+    @override_settings(STRIPE_BREAKER_THRESHOLD=1)
+    def test_card_errors_do_not_open_the_circuit(self):
+        self.stub.add('POST', '/v1/payment_methods/pm_test/attach', (402, {'error': {
+            'type': 'card_error', 'code': 'card_declined', 'message': 'Your card was declined.',
+        }}))
+        with self.assertRaises(stripe.error.CardError):
+            stripe_client.request('payment_methods.attach', 'pm_test', params={'customer': 'cus_test'})
+        self.assertEqual(stripe_client.breaker.state, 'closed')
+
+    def test_pay_views_use_the_client(self):
+        user = create_user('member')
+        user.stripe_customer_id = 'cus_test'
+        user.stripe_subscription_id = 'sub_test'
+        user.save()
+        self.stub.add('POST', '/v1/payment_methods/pm_test/attach', (200, {
+            'id': 'pm_test', 'object': 'payment_method', 'customer': 'cus_test',
+            'card': {'brand': 'visa', 'last4': '4242'},
+        }))
+        self.stub.add('POST', '/v1/subscriptions/sub_test', (200, {'id': 'sub_test', 'object': 'subscription'}))
+        self.stub.add('DELETE', '/v1/subscriptions/sub_test', (200, {'id': 'sub_test', 'object': 'subscription', 'status': 'canceled'}))
+        self.client.force_login(user)
+
+        self.client.post(reverse('subscription_update_save'), {'payment_method_id': 'pm_test', 'card_name': 'TARO'})
+        user.refresh_from_db()
+        self.assertEqual((user.stripe_card_brand, user.stripe_card_no), ('visa', '4242'))
+        self.assertIn('default_payment_method=pm_test', self.stub.requests[-1][2])
+
+        self.client.post(reverse('subscription_cancellation_save'))
+        user.refresh_from_db()
+        self.assertFalse(user.is_paymentstatus)
+        self.assertEqual(self.stub.count('DELETE', '/v1/subscriptions/sub_test'), 1)
+        self.assertEqual(set(stripe_client.metrics()['calls']), {
+            'payment_methods.attach', 'subscriptions.update', 'subscriptions.cancel',
+        })
+
+
+class ShopImageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        # 本番の設定（Cloudinary）にアップロードしないよう、一時ディレクトリに保存する
+        overrides = override_settings(
+            MEDIA_ROOT=media_root.name, DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+            IMAGE_DERIVATIVES_ASYNC=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.shop = create_shops(1)[0]
+
+    # commit=False の場合はコミット後の処理（縮小版の作成）を実行しない
+    def upload(self, shop, width=1200, height=800, commit=True):
+        # 横長の写真を縦向き(Orientation=6)で撮影した場合のEXIF（位置情報の代わりにメーカー名を含める）
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera Maker'
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG', exif=exif)
+        shop.image = SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+        with self.captureOnCommitCallbacks(execute=commit) as callbacks:
+            shop.save()
+        return callbacks
+
+    def test_upload_creates_derivatives_without_exif(self):
+        self.upload(self.shop)
+        self.shop.refresh_from_db()
+        derivatives = self.shop.image_derivatives
+        self.assertEqual(derivatives['source'], self.shop.image.name)
+        self.assertEqual(set(derivatives) - {'source'}, {'card', 'card_2x', 'detail', 'detail_2x'})
+
+        with default_storage.open(derivatives['card']['webp']) as f:
+            card = Image.open(f)
+            # 向きを反映して縦長になり、EXIFは残らない
+            self.assertEqual((card.format, card.size), ('WEBP', (480, 720)))
+            self.assertFalse(card.getexif())
+        with default_storage.open(derivatives['detail_2x']['jpeg']) as f:
+            # 元画像より大きくはしない
+            self.assertEqual(Image.open(f).size, (800, 1200))
+        self.assertTrue(derivatives['card']['jpeg'].startswith(self.shop.image.name.rsplit('.', 1)[0]))
+
+        html = self.client.get(reverse('index')).content.decode()
+        self.assertIn('<source type="image/webp" srcset="/media/' + derivatives['card']['webp'] + ' 1x', html)
+        self.assertIn(derivatives['card_2x']['jpeg'] + ' 2x', html)
+
+    @override_settings(IMAGE_DERIVATIVES_ASYNC=True)
+    def test_upload_defers_derivatives_to_background(self):
+        # 保存のリクエストでは作成せず、コミット後にバックグラウンドのスレッドへ渡す
+        with mock.patch.object(images, '_background') as background:
+            callbacks = self.upload(self.shop, commit=False)
+            self.shop.refresh_from_db()
+            self.assertEqual(self.shop.image_derivatives, {})
+            background.assert_not_called()
+            for callback in callbacks:
+                callback()
+        background.return_value.submit.assert_called_once_with(images._update_in_background, self.shop.pk)
+
+        # バックグラウンドのスレッドでは保存済みの店舗を読み込んで作成する
+        images._update_saved_shop(self.shop.pk)
+        self.shop.refresh_from_db()
+        self.assertEqual(self.shop.image_derivatives['source'], self.shop.image.name)
+
+    def test_shops_without_upload_use_the_original(self):
+        self.assertEqual(self.shop.image_derivatives, {})
+        html = self.client.get(reverse('restaurants_detail', args=[self.shop.pk])).content.decode()
+        self.assertIn(f'<img src="{self.shop.image.url}" class="w-100"', html)
+
+    def test_backfill_command_uses_worker_processes(self):
+        shops = create_shops(3)
+        for shop in shops:
+            self.upload(shop, width=300, height=200)
+        Shop.objects.update(image_derivatives={})
+
+        call_command('generate_image_derivatives', workers=2, stdout=io.StringIO(), stderr=io.StringIO())
+        for shop in shops:
+            shop.refresh_from_db()
+            self.assertEqual(shop.image_derivatives['source'], shop.image.name)
+            self.assertFalse(images.needs_derivatives(shop))
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        overrides = override_settings(
+            MEDIA_ROOT=media_root.name, SERVE_MEDIA=True,
+            DEFAULT_FILE_STORAGE='base.storage.ContentAddressedStorage', IMAGE_DERIVATIVES_ASYNC=False,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def photo(self, color='red'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 30), color).save(buffer, 'JPEG')
+        return SimpleUploadedFile('Photo.JPG', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_files_are_named_by_content(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            shop = Shop.objects.create(
+                name='新規店舗', is_published=True, image=self.photo(),
+                reserve_start_time=datetime.time(11, 0), reserve_end_time=datetime.time(20, 0),
+            )
+        shop.refresh_from_db()
+        self.assertRegex(shop.image.name, r'^shops/[0-9a-f]{32}\.jpg$')
+        # 同じ内容のファイルは同じ名前で、1つだけ保存される
+        files = default_storage.listdir('shops')[1]
+        self.assertEqual(default_storage.save('shops/other.jpg', self.photo()), shop.image.name)
+        self.assertEqual(default_storage.listdir('shops')[1], files)
+        self.assertRegex(shop.image_derivatives['card']['webp'], r'^shops/[0-9a-f]{32}\.webp$')
+        self.assertNotEqual(default_storage.save('shops/other.jpg', self.photo('blue')), shop.image.name)
+
+        # URLはファイル名だけから組み立てる
+        with mock.patch('os.stat', side_effect=AssertionError), mock.patch('os.path.exists', side_effect=AssertionError):
+            self.assertEqual(shop.image.url, f'/media/{shop.image.name}')
+
+    def create_shop(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            shop = Shop.objects.create(
+                name='新規店舗', is_published=True, image=image,
+                reserve_start_time=datetime.time(11, 0), reserve_end_time=datetime.time(20, 0),
+            )
+        shop.refresh_from_db()
+        return shop
+
+    def test_replaced_derivatives_are_deleted(self):
+        shop = self.create_shop(self.photo())
+        old = images._names(shop.image_derivatives)
+        # 同じ画像を使う店舗がある間は残す
+        other = self.create_shop(self.photo())
+        self.assertEqual(images._names(other.image_derivatives), old)
+
+        shop.image = self.photo('blue')
+        with self.captureOnCommitCallbacks(execute=True):
+            shop.save()
+        shop.refresh_from_db()
+        self.assertTrue(all(default_storage.exists(name) for name in old))
+
+        other.image = self.photo('green')
+        with self.captureOnCommitCallbacks(execute=True):
+            other.save()
+        other.refresh_from_db()
+        self.assertFalse(any(default_storage.exists(name) for name in old))
+        for current in (shop, other):
+            self.assertTrue(all(default_storage.exists(name) for name in images._names(current.image_derivatives)))
+
+        # 作成済みの縮小版はファイルが揃っていれば作り直さない
+        with mock.patch.object(images, '_open', side_effect=AssertionError):
+            self.assertEqual(
+                images.generate_derivatives(shop.image.name, overwrite=False, previous=shop.image_derivatives),
+                shop.image_derivatives,
+            )
+
+    def test_media_is_served_with_immutable_caching(self):
+        name = default_storage.save('shops/photo.jpg', self.photo())
+        response = self.client.get(default_storage.url(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], f'"{name[6:38]}"')
+        self.assertEqual(b''.join(response.streaming_content), default_storage.open(name).read())
+
+        response = self.client.get(default_storage.url(name), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # ハッシュ名でないファイルは短期間だけキャッシュさせる
+        legacy = default_storage.location + '/legacy.png'
+        Image.new('RGB', (4, 4)).save(legacy)
+        response = self.client.get('/media/legacy.png')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/shops/missing.jpg').status_code, 404)
+
+
+class ShopImportExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='味噌カツ', slug='misokatsu')
+        cls.sakae = Tag.objects.create(name='栄', slug='sakae')
+        cls.osu = Tag.objects.create(name='大須', slug='osu')
+
+    def record(self, code, **values):
+        return {
+            'code': code, 'name': f'店舗{code}', 'address': '名古屋市中区栄', 'category': 'misokatsu',
+            'tags': ['sakae'], 'holidays_select': ['mon'], 'irregular_holidays': ['2030-01-01'],
+            'reserve_start_time': '11:00', 'reserve_end_time': '20:30', 'reserve_capacity': 10,
+            'is_published': True, **values,
+        }
+
+    def jsonl(self, records):
+        return io.StringIO(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records))
+
+    def test_import_creates_and_updates_by_code(self):
+        shop = create_shops(1, category=self.category, tags=[self.osu])[0]
+        IrregularHoliday.objects.create(shop=shop, date=datetime.date(2030, 2, 1))
+        records = [
+            self.record('new-1'),
+            self.record(shop.code, name='味噌カツ矢場', tags=['sakae', 'osu'], irregular_holidays=[]),
+            self.record('bad-1', category='unknown'),
+            self.record('bad-2', holidays_select=['holiday']),
+            self.record('bad-3', irregular_holidays=['2030-13-01']),
+        ]
+        result = shop_io.import_shops(self.jsonl(records), chunk_size=2)
+        self.assertEqual((result.created, result.updated), (1, 1))
+        self.assertEqual([line_no for line_no, _ in result.errors], [3, 4, 5])
+
+        new = Shop.objects.get(code='new-1')
+        self.assertEqual((new.category, list(new.tags.all()), list(new.holidays_select)), (self.category, [self.sakae], ['mon']))
+        self.assertEqual(list(new.irregular_holidays.values_list('date', flat=True)), [datetime.date(2030, 1, 1)])
+        self.assertEqual(new.reserve_end_time, datetime.time(20, 30))
+        self.assertTrue(ShopRating.objects.filter(shop=new).exists())
+
+        shop.refresh_from_db()
+        self.assertEqual(shop.name, '味噌カツ矢場')
+        self.assertEqual(set(shop.tags.all()), {self.sakae, self.osu})
+        self.assertFalse(shop.irregular_holidays.exists())
+        self.assertEqual(list(search_shops(Shop.objects.all(), '矢場 大須')), [shop])
+
+    def test_reserve_capacity_is_checked(self):
+        records = [
+            self.record('zero', reserve_capacity=0),
+            self.record('default', reserve_capacity=''),
+            self.record('negative', reserve_capacity=-1),
+            self.record('large', reserve_capacity=32768),
+        ]
+        result = shop_io.import_shops(self.jsonl(records))
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line_no for line_no, _ in result.errors], [3, 4])
+        self.assertEqual(dict(Shop.objects.values_list('code', 'reserve_capacity')), {'zero': 0, 'default': 20})
+
+    def test_invalid_json_line_is_reported(self):
+        stream = io.StringIO(self.jsonl([self.record('new-1')]).getvalue() + '{"code": \n' + self.jsonl([self.record('new-2')]).getvalue())
+        result = shop_io.import_shops(stream)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([line_no for line_no, _ in result.errors], [2])
+        self.assertIn('JSON', result.errors[0][1])
+
+    def test_dry_run_does_not_write(self):
+        result = shop_io.import_shops(self.jsonl([self.record('new-1'), self.record('new-2')]), dry_run=True)
+        self.assertEqual((result.created, result.updated, result.errors), (2, 0, []))
+        self.assertFalse(Shop.objects.exists())
+
+    def test_queries_do_not_grow_with_the_number_of_shops(self):
+        def queries(count, prefix):
+            with CaptureQueriesContext(connection) as context:
+                shop_io.import_shops(self.jsonl(self.record(f'{prefix}-{i}') for i in range(count)), index=False)
+            return len(context)
+
+        # SQLiteは1文あたりの変数の数に上限があるため、INSERTが1文に収まる件数で比べる
+        self.assertEqual(queries(5, 'small'), queries(30, 'large'))
+        self.assertEqual(Shop.objects.count(), 35)
+
+    def test_update_bumps_only_updated_shop_fragments(self):
+        updated, untouched = create_shops(2, category=self.category)
+        before = fragments.shop_versions([updated.pk, untouched.pk])
+        shop_io.import_shops(self.jsonl([self.record(updated.code, name='味噌カツ矢場')]))
+        after = fragments.shop_versions([updated.pk, untouched.pk])
+        self.assertNotEqual(after[updated.pk], before[updated.pk])
+        self.assertEqual(after[untouched.pk], before[untouched.pk])
+
+    def test_export_round_trip(self):
+        shop_io.import_shops(self.jsonl([self.record('a', description='改行\nと "引用符"'), self.record('b', tags=[])]))
+        for format in ('jsonl', 'csv'):
+            with self.subTest(format=format):
+                exported = io.StringIO()
+                self.assertEqual(shop_io.export_shops(exported, format=format, chunk_size=1), 2)
+                records = [record for _, record in shop_io.read_records(io.StringIO(exported.getvalue()), format)]
+                self.assertEqual([record['code'] for record in records], ['a', 'b'])
+                self.assertEqual(records[0]['description'], '改行\nと "引用符"')
+                self.assertEqual(list(records[1]['tags']), [])
+
+                result = shop_io.import_shops(io.StringIO(exported.getvalue()), format=format)
+                self.assertEqual((result.created, result.updated, result.errors), (0, 2, []))
+
+    def test_commands(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f'{directory}/shops.csv'
+            shop_io.import_shops(self.jsonl([self.record('a')]))
+            call_command('export_shops', path, stdout=io.StringIO())
+            Shop.objects.all().delete()
+
+            out = io.StringIO()
+            call_command('import_shops', path, '--dry-run', stdout=out)
+            self.assertIn('（確認のみ）新規1件', out.getvalue())
+            call_command('import_shops', path, stdout=io.StringIO())
+        self.assertEqual(Shop.objects.get().code, 'a')
+
+
+class CsvExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', is_admin=True, is_active=True)
+        cls.shop, cls.other_shop = create_shops(2)
+        cls.users = [create_user(f'member{i}') for i in range(3)]
+        for i, user in enumerate(cls.users):
+            Order.objects.create(user=user, is_confirmed=True, amount=300, tax_included=27)
+            for shop in (cls.shop, cls.other_shop):
+                Reserve.objects.create(
+                    user=user, shop=shop, reserved_date=datetime.date(2030, 1, 10 + i),
+                    reserved_time=datetime.time(12, 0), number_of_people=2,
+                )
+
+    def export(self, kind, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin_export', args=[kind]), params)
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return response, list(csv.reader(io.StringIO(content)))
+
+    def test_reservations_are_filtered_by_period_and_shop(self):
+        response, rows = self.export('reservations', start='2030-01-11', end='2030-01-12', shop=self.shop.pk)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="reservations_20300111_20300112.csv"')
+        self.assertEqual(rows[0][:5], ['予約番号', '予約日', '予約時間', '人数', '店舗名'])
+        self.assertEqual([row[1] for row in rows[1:]], ['2030-01-11', '2030-01-12'])
+        self.assertEqual({row[4] for row in rows[1:]}, {self.shop.name})
+        self.assertEqual([row[6] for row in rows[1:]], ['member1@example.com', 'member2@example.com'])
+
+    def test_rows_are_read_in_chunks_without_per_row_queries(self):
+        export = exports.EXPORTS['orders']
+        with CaptureQueriesContext(connection) as context:
+            rows = list(export.rows(Order.objects.all(), chunk_size=2))
+        self.assertEqual([row[3] for row in rows], [f'member{i}@example.com' for i in range(3)])
+        # 2件・1件の2回だけ読み込む
+        self.assertEqual(len(context), 2)
+
+    def test_staff_only_and_invalid_filters(self):
+        self.client.force_login(self.users[0])
+        self.assertEqual(self.client.get(reverse('admin_export', args=['orders'])).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('admin_export', args=['users'])).status_code, 404)
+        response = self.client.get(reverse('admin_export', args=['orders']), {'start': '2030-02-01', 'end': '2030-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_action(self):
+        self.client.force_login(self.admin)
+        orders = Order.objects.filter(user__in=self.users[:2])
+        response = self.client.post(reverse('admin:base_order_changelist'), {
+            'action': 'export_csv', '_selected_action': [order.pk for order in orders],
+        })
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(sorted(row[0] for row in rows[1:]), sorted(str(order.pk) for order in orders))
+
+
+# 管理画面の一覧のクエリ数と件数の推定
+class AdminChangelistTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', is_admin=True, is_active=True)
+        cls.category = Category.objects.create(name='和食', slug='washoku')
+
+    def add_rows(self, count):
+        shops = create_shops(count, category=self.category)
+        users = [create_user(f'member{User.objects.count()}') for _ in range(count)]
+        for shop, user in zip(shops, users):
+            Order.objects.create(user=user, is_confirmed=True, amount=300, tax_included=27)
+            Reserve.objects.create(
+                user=user, shop=shop, reserved_date=datetime.date(2030, 1, 10),
+                reserved_time=datetime.time(12, 0), number_of_people=2,
+            )
+            Review.objects.create(user=user, shop=shop, stars=4, comment='おいしい')
+            Favorite.objects.create(user=user, shop=shop)
+            IrregularHoliday.objects.create(shop=shop, date=datetime.date(2030, 1, 1))
+
+    def changelist_queries(self, model):
+        self.client.force_login(self.admin)
+        url = reverse(f'admin:base_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        models = (Shop, User, Order, Reserve, Review, Favorite, IrregularHoliday, ShopRating, ReserveSlot)
+        self.add_rows(2)
+        few = {model: self.changelist_queries(model) for model in models}
+        self.add_rows(8)
+        many = {model: self.changelist_queries(model) for model in models}
+        self.assertEqual(few, many)
+
+    def test_search_and_date_hierarchy(self):
+        self.add_rows(3)
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('admin:base_reserve_changelist'), {'q': '店舗1'})
+        self.assertEqual([reserve.shop.name for reserve in response.context['cl'].result_list], ['店舗1'])
+        response = self.client.get(reverse('admin:base_user_changelist'), {'q': 'member1@example.com'})
+        self.assertEqual([user.username for user in response.context['cl'].result_list], ['member1'])
+        response = self.client.get(reverse('admin:base_order_changelist'), {'created_at__year': timezone.now().year})
+        self.assertEqual(response.context['cl'].result_count, 3)
+
+    def test_estimated_count(self):
+        create_shops(3)
+        paginator = pagination.EstimatedCountPaginator(Shop.objects.order_by('pk'), 100)
+        with mock.patch('base.pagination.estimate_rows', return_value=2_000_000) as estimate:
+            self.assertEqual(paginator.count, 2_000_000)
+        estimate.assert_called_once_with(Shop, 'default')
+        # 推定件数が少ない場合は正確に数える
+        with mock.patch('base.pagination.estimate_rows', return_value=5):
+            self.assertEqual(pagination.EstimatedCountPaginator(Shop.objects.all(), 100).count, 3)
+
+    def test_filtered_count_is_capped(self):
+        create_shops(5)
+        paginator = pagination.EstimatedCountPaginator(Shop.objects.filter(is_published=True), 2)
+        paginator.count_limit = 3
+        with mock.patch('base.pagination.estimate_rows') as estimate:
+            self.assertEqual(paginator.count, 3)
+        estimate.assert_not_called()
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_review_str(self):
+        shop = create_shops(1)[0]
+        review = Review.objects.create(user=None, shop=shop, stars=None)
+        self.assertEqual(str(review), f'退会済みユーザー (店舗名：{shop.name} / -点)')
+
+
+# 主要なクエリの実行計画（全件走査にならないこと）
+class QueryPlanTests(TestCase):
+
+    def test_check_command_passes_on_seeded_data(self):
+        out = io.StringIO()
+        call_command('check_query_plans', shops=60, users=20, stdout=out)
+        self.assertIn(f'{len(query_plans.CHECKS)}件のクエリはすべてインデックスを使用しています。', out.getvalue())
+        # ダミーデータは残さない
+        self.assertFalse(Shop.objects.exists())
+
+    def test_full_scan_is_reported(self):
+        create_shops(3)
+        _, scans = query_plans.explain(Shop.objects.filter(description='x'))
+        self.assertEqual(scans, [Shop._meta.db_table])
+        check = query_plans.Check('unindexed', 'test', lambda ctx: Shop.objects.filter(description='x'))
+        with mock.patch.object(query_plans, 'CHECKS', [check]):
+            with self.assertRaisesMessage(CommandError, 'unindexed'):
+                call_command('check_query_plans', no_seed=True, stdout=io.StringIO())
+
+    def test_published_compares_value(self):
+        # 「WHERE is_published」ではなく値と比較する（インデックスを使える）
+        sql = str(Shop.objects.published().query)
+        self.assertIn('"is_published" IN (', sql)
+        shop = create_shops(2)[0]
+        Shop.objects.filter(pk=shop.pk).update(is_published=False)
+        self.assertEqual(Shop.objects.published().count(), 1)
+
+
+# レビュー一覧のクエリ数と「もっと見る」
+class ShopReviewPageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = create_shops(1)[0]
+        cls.member = create_user('member')
+        cls.my_review = Review.objects.create(user=cls.member, shop=cls.shop, stars=5, comment='自分')
+
+    def add_reviews(self, count):
+        start = Review.objects.count()
+        for i in range(start, start + count):
+            Review.objects.create(user=create_user(f'reviewer{i}'), shop=self.shop, stars=i % 5 + 1, comment=f'レビュー{i}')
+
+    def get_page(self, user, **params):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('reviews', args=[self.shop.pk]), params)
+            response.content
+        self.assertEqual(response.status_code, 200)
+        return response, len(context)
+
+    def test_queries_do_not_grow_with_reviews(self):
+        self.add_reviews(2)
+        _, few = self.get_page(self.member)
+        self.add_reviews(10)
+        response, many = self.get_page(self.member)
+        self.assertEqual(few, many)
+        self.assertEqual(response.context['my_review'], self.my_review)
+        self.assertEqual(len(response.context['other_reviews']), 10)
+        self.assertNotIn(self.my_review, response.context['other_reviews'])
+        self.assertTrue(response.context['page_obj'].has_next())
+
+    def test_query_count_is_pinned(self):
+        self.add_reviews(12)
+        self.client.force_login(self.member)
+        # セッション / 会員のバージョン / 店舗(評価をJOIN) / お気に入り / 自分のレビュー / 他のユーザーのレビュー1ページ(投稿者をJOIN)
+        with self.assertNumQueries(6):
+            self.client.get(reverse('reviews', args=[self.shop.pk])).content
+
+    def test_free_member_sees_preview_only(self):
+        self.add_reviews(5)
+        response, _ = self.get_page(create_user('free', is_paymentstatus=False))
+        self.assertEqual(len(response.context['other_reviews']), 3)
+        self.assertIsNone(response.context['my_review'])
+
+    def test_deleted_user_review(self):
+        Review.objects.create(user=None, shop=self.shop, stars=3, comment='退会')
+        response, _ = self.get_page(self.member)
+        self.assertContains(response, '退会済みユーザー')
+
+    def test_load_more_returns_remaining_reviews(self):
+        self.add_reviews(25)
+        response, _ = self.get_page(self.member)
+        seen = [review.pk for review in response.context['other_reviews']]
+        cursor = response.context['page_obj'].next_cursor
+        url = reverse('reviews_more', args=[self.shop.pk])
+        while cursor:
+            with CaptureQueriesContext(connection) as context:
+                data = self.client.get(url, {'cursor': cursor}).json()
+            # セッション・会員・店舗・レビュー1ページ
+            self.assertLessEqual(len(context), 4)
+            seen += [review['id'] for review in data['reviews']]
+            cursor = data['next_cursor']
+        expected = list(Review.objects.exclude(pk=self.my_review.pk).order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(data['reviews'][-1]['username'], 'reviewer1')
+
+    def test_load_more_rejects_invalid_requests(self):
+        url = reverse('reviews_more', args=[self.shop.pk])
+        self.client.force_login(self.member)
+        self.assertEqual(self.client.get(url, {'cursor': 'broken'}).status_code, 400)
+        self.client.force_login(create_user('free', is_paymentstatus=False))
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+
+# 有料会員かどうかのセッションのスナップショット（会員の行を読み込まずに権限を確認する）
+class MembershipSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.user = create_user('member', is_paymentstatus=False)
+        self.client.force_login(self.user)
+
+    def user_queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        return response, [query['sql'] for query in context if 'FROM "base_user"' in query['sql']]
+
+    def set_paid(self, value):
+        self.user.is_paymentstatus = value
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+
+    def test_gated_pages_and_header_do_not_load_user(self):
+        self.set_paid(True)
+        self.client.get(reverse('favorites'))
+        response, queries = self.user_queries(reverse('favorites'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        response, queries = self.user_queries(reverse('index'))
+        self.assertContains(response, 'member</a>さん')
+        self.assertEqual(queries, [])
+
+    def test_status_change_is_picked_up_on_next_request(self):
+        self.assertRedirects(self.client.get(reverse('favorites')), reverse('subscription'), fetch_redirect_response=False)
+        self.set_paid(True)
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 200)
+        self.set_paid(False)
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 302)
+
+    def test_subscription_success_refreshes_snapshot(self):
+        # webhookの処理でシグナルを通さずに反映された場合も、登録完了画面で読み直す
+        User.objects.filter(pk=self.user.pk).update(is_paymentstatus=True)
+        self.client.get(reverse('subscription_success'))
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 200)
+
+    def test_password_change_ends_snapshot(self):
+        self.set_paid(True)
+        self.user.set_password('changed-password')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        response = self.client.get(reverse('favorites'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].startswith(reverse('login')))
+
+    def test_tampered_snapshot_is_reloaded(self):
+        session = self.client.session
+        session[membership.SESSION_KEY_NAME] = signing.dumps(
+            {'version': 0, 'user_id': self.user.pk, 'username': 'member', 'is_paymentstatus': True, 'is_admin': False},
+            salt='other',
+        )
+        session.save()
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 302)
+
+    def test_login_form_stores_snapshot(self):
+        self.client.logout()
+        self.set_paid(True)
+        response = self.client.post(reverse('login'), {'email': self.user.email, 'password': 'wrong'})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(membership.SESSION_KEY_NAME, self.client.session)
+        self.client.post(reverse('login'), {'email': self.user.email, 'password': 'password'})
+        self.assertIn(membership.SESSION_KEY_NAME, self.client.session)
+        response, queries = self.user_queries(reverse('favorites'))
+        self.assertEqual((response.status_code, queries), (200, []))
+
+    def test_version_is_kept_in_database(self):
+        # 別のプロセス（キャッシュが空）からも同じバージョンが見え、キャッシュが消えても戻らない
+        before = membership.version(self.user.pk)
+        self.set_paid(True)
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 200)
+        caches['default'].clear()
+        self.assertGreater(CacheVersion.objects.get(key=f'membership:{self.user.pk}').version, before)
+        User.objects.filter(pk=self.user.pk).update(is_paymentstatus=False)
+        membership.invalidate(self.user.pk)
+        self.assertEqual(self.client.get(reverse('favorites')).status_code, 302)
+
+    def test_writing_views_use_snapshot_member(self):
+        # request.user が読み込めない場合（未ログイン扱い）も、スナップショットの会員として保存する
+        self.set_paid(True)
+        shop = create_shops(1)[0]
+        self.client.get(reverse('favorites'))
+        with mock.patch.object(backends.UserBackend, 'get_user', return_value=None):
+            response = self.client.post(reverse('review_create', args=[shop.pk]), {'stars': 5, 'comment': 'おいしい'})
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(Review.objects.get(shop=shop).user_id, self.user.pk)
+
+            day = datetime.date.today() + datetime.timedelta(days=30)
+            response = self.client.post(reverse('reserve', kwargs={'pk': shop.pk}), {
+                'reserved_date': day.isoformat(), 'reserved_time': '18:00', 'number_of_people': 2,
+            })
+            self.assertEqual(Reserve.objects.get(shop=shop).user_id, self.user.pk)
+
+            response = self.client.get(reverse('subscription_update'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['user'].pk, self.user.pk)
+
+    def test_backend_defers_stripe_columns(self):
+        user = backends.UserBackend().get_user(self.user.pk)
+        self.assertIn('stripe_customer_id', user.get_deferred_fields())
+        self.assertNotIn('username', user.get_deferred_fields())
+        self.assertEqual(backends.UserBackend().authenticate(None, username=self.user.email, password='password'), self.user)
+        with self.assertRaises(PermissionDenied):
+            backends.UserBackend().authenticate(None, username=self.user.email, password='wrong')
+
+
+# キャッシュのバージョン（base/versions.py）
+class CacheVersionTests(TestCase):
+
+    def test_bump_creates_and_increments(self):
+        self.assertEqual(versions.get('test:1'), 0)
+        first = versions.bump('test:1')
+        second = versions.bump('test:1')
+        self.assertGreater(second, first)
+        self.assertEqual(versions.get_many(['test:1', 'test:2']), {'test:1': second, 'test:2': 0})
+
+    def test_rolled_back_version_is_not_reused(self):
+        # ロールバックされたバージョンで保存されたキャッシュを、後の更新で参照しない
+        committed = versions.bump('test:1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            rolled_back = versions.bump('test:1')
+            raise IntegrityError
+        self.assertEqual(versions.get('test:1'), committed)
+        self.assertNotIn(versions.bump('test:1'), (committed, rolled_back))
+
+    @override_settings(VERSION_CACHE_ALIAS='default')
+    def test_shared_cache_is_updated_after_commit(self):
+        caches['default'].clear()
+        self.assertEqual(versions.get('test:1'), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(versions.get('test:1'), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            version = versions.bump('test:1')
+            # コミット前は古いバージョンのまま
+            self.assertEqual(versions.get('test:1'), 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(versions.get('test:1'), version)
+
+
+class FakeMySQLConnection:
+    """PyMySQL の接続の代わり（ping・rollback・close だけ）"""
+
+    def __init__(self):
+        self.alive = True
+        self.closed = False
+        self.server_status = 0
+        self.pings = 0
+        self.rollbacks = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+        if reconnect or not self.alive:
+            raise pymysql.err.OperationalError(2013, 'Lost connection')
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.server_status = 0
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(TestCase):
+
+    def make_pool(self, **kwargs):
+        pool = db_pool.ConnectionPool(**{'max_size': 2, 'idle_timeout': 60, 'timeout': 0.05, **kwargs})
+        return pool, lambda: pool.acquire(FakeMySQLConnection, mysql_backend._ping)
+
+    def test_released_connection_is_reused(self):
+        pool, acquire = self.make_pool()
+        conn = acquire()
+        pool.release(conn)
+        self.assertIs(acquire(), conn)
+        self.assertEqual((pool.stats['created'], pool.stats['reused']), (1, 1))
+
+    def test_broken_connection_is_replaced(self):
+        pool, acquire = self.make_pool()
+        conn = acquire()
+        pool.release(conn)
+        conn.alive = False
+        replacement = acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertTrue(conn.closed)
+        self.assertEqual(pool.size, 1)
+
+    def test_discarded_and_idle_connections_are_closed(self):
+        pool, acquire = self.make_pool(idle_timeout=0)
+        broken, idle = acquire(), acquire()
+        pool.release(broken, discard=True)
+        pool.release(idle)
+        time.sleep(0.01)
+        acquire()
+        self.assertTrue(broken.closed and idle.closed)
+        self.assertEqual(pool.stats['discarded'], 2)
+
+    def test_max_size_waits_for_a_free_connection(self):
+        pool, acquire = self.make_pool(max_size=1)
+        conn = acquire()
+        with self.assertRaises(db_pool.PoolTimeout):
+            acquire()
+        threading.Timer(0.01, pool.release, args=[conn]).start()
+        pool.timeout = 1
+        self.assertIs(acquire(), conn)
+
+    def test_forked_process_does_not_share_connections(self):
+        pool, acquire = self.make_pool()
+        conn = acquire()
+        pool.release(conn)
+        pool.pid = -1
+        self.assertIsNot(acquire(), conn)
+        self.assertFalse(conn.closed)
+
+
+class MySQLBackendTests(TestCase):
+
+    def make_wrapper(self, **settings_dict):
+        wrapper = mysql_backend.DatabaseWrapper({
+            'ENGINE': 'base.mysql', 'NAME': 'test', 'AUTOCOMMIT': True, 'OPTIONS': {}, 'TIME_ZONE': None,
+            'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True, **settings_dict,
+        }, alias='mysql-test')
+        # connect() を通さずに接続を渡すため、接続後の状態にしておく
+        wrapper.autocommit = True
+        return wrapper
+
+    def test_health_check_once_per_request(self):
+        wrapper = self.make_wrapper()
+        wrapper.connection = conn = FakeMySQLConnection()
+        wrapper.close_if_unusable_or_obsolete()
+        wrapper.close_if_health_check_failed()
+        wrapper.close_if_health_check_failed()
+        self.assertEqual(conn.pings, 1)
+        self.assertIs(wrapper.connection, conn)
+
+        conn.alive = False
+        wrapper.close_if_unusable_or_obsolete()
+        wrapper.close_if_health_check_failed()
+        self.assertIsNone(wrapper.connection)
+        self.assertTrue(conn.closed)
+
+    def test_compact_ids_migration_swaps_primary_key_in_one_statement(self):
+        # 主キーの削除と追加を同じ ALTER TABLE で行う（MySQL は主キーを2つ持てないため 1068 になる）
+        migration = importlib.import_module('base.migrations.0013_compact_ids')
+        executor = MigrationExecutor(connection)
+        state = executor.loader.project_state(('base', '0012_reserveslot'))
+        migration.Migration('0013_compact_ids', 'base').operations[0].state_forwards('base', state)
+        operation = migration.SwapPrimaryKey('reserve')
+        to_state = state.clone()
+        operation.state_forwards('base', to_state)
+
+        wrapper = self.make_wrapper()
+        with wrapper.schema_editor(collect_sql=True, atomic=False) as editor:
+            operation.database_forwards('base', editor, state, to_state)
+            operation.database_backwards('base', editor, to_state, state)
+        self.assertEqual(editor.collected_sql, [
+            'ALTER TABLE `base_reserve` DROP PRIMARY KEY, MODIFY `id` varchar(50) NULL, MODIFY `new_id` bigint NOT NULL, ADD PRIMARY KEY (`new_id`);',
+            'ALTER TABLE `base_reserve` DROP PRIMARY KEY, MODIFY `new_id` bigint NULL, MODIFY `id` varchar(50) NOT NULL, ADD PRIMARY KEY (`id`);',
+        ])
+
+    def test_health_check_disabled(self):
+        wrapper = self.make_wrapper(CONN_HEALTH_CHECKS=False)
+        wrapper.connection = conn = FakeMySQLConnection()
+        wrapper.close_if_unusable_or_obsolete()
+        wrapper.close_if_health_check_failed()
+        self.assertEqual(conn.pings, 0)
+
+    def test_close_returns_connection_to_pool(self):
+        wrapper = self.make_wrapper(POOL={'MAX_SIZE': 2})
+        self.addCleanup(wrapper.pool.close_all)
+        with mock.patch.object(mysql_backend.mysql.DatabaseWrapper, 'get_new_connection', side_effect=lambda conn_params: FakeMySQLConnection()):
+            conn = wrapper.get_new_connection({})
+            wrapper.connection = conn
+            conn.server_status = SERVER_STATUS.SERVER_STATUS_IN_TRANS
+            wrapper.close()
+            self.assertEqual((conn.rollbacks, conn.closed), (1, False))
+            self.assertIs(wrapper.get_new_connection({}), conn)
+
+            wrapper.connection = conn
+            wrapper.errors_occurred = True
+            wrapper.close()
+            self.assertTrue(conn.closed)
+            self.assertEqual(wrapper.pool.stats, {'created': 1, 'reused': 1, 'discarded': 1})
+
+
+class ReplicaRoutingTests(TestCase):
+    """SQLite のメモリ上のデータベースをレプリカとして追加し、プライマリと異なる内容にして読み取り先を確かめる"""
+    replica = 'replica-test'
+
+    @classmethod
+    def setUpClass(cls):
+        # テストランナーが作るデータベースには含めず、ここで作成する
+        cls.databases = {'default', cls.replica}
+        connections.settings[cls.replica] = connections.configure_settings({
+            'default': connections.settings['default'],
+            cls.replica: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+        })[cls.replica]
+        call_command('migrate', database=cls.replica, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.replica].close()
+        del connections.settings[cls.replica]
+        delattr(connections._connections, cls.replica)
+
+    def setUp(self):
+        self.shop = create_shops(1)[0]
+        Shop.objects.using(self.replica).bulk_create([Shop(
+            pk=self.shop.pk, name='レプリカの店舗', is_published=True,
+            reserve_start_time=self.shop.reserve_start_time, reserve_end_time=self.shop.reserve_end_time,
+        )])
+        self.replicate_versions()
+        self.user = create_user('member')
+        self.client.force_login(self.user)
+        replicas = override_settings(DATABASE_REPLICAS=[self.replica])
+        replicas.enable()
+        self.addCleanup(replicas.disable)
+
+    # キャッシュのバージョンだけレプリカに届いた状態にする
+    def replicate_versions(self):
+        CacheVersion.objects.using(self.replica).all().delete()
+        CacheVersion.objects.using(self.replica).bulk_create(
+            CacheVersion(key=key, version=version) for key, version in CacheVersion.objects.values_list('key', 'version')
+        )
+
+    def detail(self):
+        response = self.client.get(reverse('restaurants_detail', kwargs={'pk': self.shop.pk}))
+        return response.context['shop'].name, response.context['favorites']
+
+    def test_router(self):
+        self.assertEqual(Shop.objects.all().db, 'default')
+        with replicas.use_replica():
+            self.assertEqual(Shop.objects.all().db, self.replica)
+            self.assertEqual(User.objects.all().db, 'default')
+            self.assertEqual(router.db_for_write(Shop), 'default')
+            with transaction.atomic():
+                self.assertEqual(Shop.objects.all().db, 'default')
+
+    def test_public_views_read_from_replica(self):
+        self.assertEqual(self.detail(), ('レプリカの店舗', 0))
+        # 対象外のページはプライマリから読み込む
+        self.client.post(reverse('favorites_toggle01', kwargs={'pk': self.shop.pk}))
+        response = self.client.get(reverse('favorites'))
+        self.assertEqual([favorite.shop.name for favorite in response.context['favorites']], [self.shop.name])
+
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(self.detail(), (self.shop.name, 1))
+
+    def test_reads_stick_to_primary_after_a_write(self):
+        self.client.post(reverse('favorites_toggle01', kwargs={'pk': self.shop.pk}))
+        self.assertEqual(self.detail(), (self.shop.name, 1))
+
+        # 一定時間が過ぎたらレプリカに戻す
+        session = self.client.session
+        session[replicas.STICKY_SESSION_KEY] = time.time() - 1
+        session.save()
+        self.assertEqual(self.detail(), ('レプリカの店舗', 0))
+
+    def test_lagging_replica_is_not_cached(self):
+        caches[fragments.CACHE_ALIAS].clear()
+        # プライマリだけを更新する（レプリカにはまだ届いていない）
+        self.shop.name = '更新後の店舗'
+        self.shop.save()
+        self.assertEqual(self.detail()[0], '更新後の店舗')
+
+        key = fragments.card_key('snippets/shop_list_box.html', self.shop.pk, fragments.shop_version(self.shop.pk))
+        self.assertContains(self.client.get(reverse('restaurants_list')), 'レプリカの店舗')
+        self.assertIsNone(caches[fragments.CACHE_ALIAS].get(key))
+
+        # レプリカに届いた後はキャッシュする
+        Shop.objects.using(self.replica).filter(pk=self.shop.pk).update(name='更新後の店舗')
+        self.replicate_versions()
+        self.assertContains(self.client.get(reverse('restaurants_list')), '更新後の店舗')
+        self.assertIn('更新後の店舗', caches[fragments.CACHE_ALIAS].get(key))
+
+    def test_anonymous_write_does_not_stick(self):
+        self.client.logout()
+        self.client.post(reverse('login'), {'email': 'nobody@example.com', 'password': 'wrong'})
+        self.assertNotIn(replicas.STICKY_SESSION_KEY, self.client.session)
+        self.assertEqual(self.detail()[0], 'レプリカの店舗')
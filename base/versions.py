@@ -0,0 +1,86 @@
+"""
+キャッシュのバージョン（会員のスナップショット・断片キャッシュ・空き状況のキャッシュの破棄に使う）
+・バージョンはデータベース(CacheVersion)に保存し、データの変更と同じトランザクションで更新する
+  （すべてのプロセス・サーバーで同じ値になり、キャッシュから削除されても1に戻らない）
+・新しいバージョンは時刻順のID(base/ids.py)にする（ロールバックされたトランザクションのバージョンが後で再び使われない）
+・VERSION_CACHE_ALIAS に共有のキャッシュ（Redis・Memcached など）を指定した場合は、読み込んだバージョンをキャッシュする
+  未指定の場合は毎回データベースから読み込む（プロセスごとのキャッシュでは他のプロセスの更新が届かないため）
+"""
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from base import ids
+
+
+def _cache():
+    alias = getattr(settings, 'VERSION_CACHE_ALIAS', '')
+    return caches[alias] if alias else None
+
+
+def _cache_key(scope):
+    return f'version:{scope}'
+
+
+def _timeout():
+    return getattr(settings, 'VERSION_CACHE_TIMEOUT', 60)
+
+
+def _read(scopes, using):
+    from base.models import CacheVersion
+
+    rows = dict(CacheVersion.objects.using(using).filter(key__in=scopes).values_list('key', 'version'))
+    return {scope: rows.get(scope, 0) for scope in scopes}
+
+
+def get_many(scopes, using=None):
+    """
+    バージョンをまとめて取得する {scope: version}（行がない場合は 0）
+    using を指定した場合はそのデータベース（レプリカなど）から直接読み込む
+    """
+    scopes = list(dict.fromkeys(scopes))
+    if not scopes:
+        return {}
+    if using is not None:
+        return _read(scopes, using)
+
+    cache = _cache()
+    if cache is None:
+        return _read(scopes, DEFAULT_DB_ALIAS)
+    cached = cache.get_many([_cache_key(scope) for scope in scopes])
+    versions = {scope: cached[_cache_key(scope)] for scope in scopes if _cache_key(scope) in cached}
+    missing = [scope for scope in scopes if scope not in versions]
+    if missing:
+        loaded = _read(missing, DEFAULT_DB_ALIAS)
+        # 読み込み中にコミットされた更新の値を上書きしないよう、キャッシュにない場合だけ保存する
+        for scope, version in loaded.items():
+            cache.add(_cache_key(scope), version, _timeout())
+        versions.update(loaded)
+    return versions
+
+
+def get(scope, using=None):
+    return get_many([scope], using)[scope]
+
+
+def bump(scope):
+    """
+    バージョンを新しい値にする（呼び出し元のトランザクションに含め、データの変更と一緒にコミットする）
+    コミット前の新しいバージョンは他のリクエストから見えないため、古いデータが新しいバージョンでキャッシュされることはない
+    """
+    from base.models import CacheVersion
+
+    versions = CacheVersion.objects.using(DEFAULT_DB_ALIAS)
+    version = ids.next_id()
+    if not versions.filter(key=scope).update(version=version):
+        try:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                versions.create(key=scope, version=version)
+        except IntegrityError:
+            # 同時に作成された場合は作成された行を更新する
+            versions.filter(key=scope).update(version=version)
+
+    cache = _cache()
+    if cache is not None:
+        transaction.on_commit(lambda: cache.set(_cache_key(scope), get(scope, using=DEFAULT_DB_ALIAS), _timeout()))
+    return version
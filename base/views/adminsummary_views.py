@@ -1,8 +1,14 @@
-from django.views.generic import TemplateView
+import datetime
+
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.views.generic import TemplateView, View
 from django.contrib.auth.mixins import UserPassesTestMixin
-from django.db.models import Sum, Count, Q
 from django.utils import timezone
-from base.models import *
+from base import stripe_catalog
+from base.exports import EXPORTS
+from base.forms import ExportFilterForm
+from base.models import SalesDaily, SalesMonthly, sales_totals
 
 
 # 管理者権限のアクセス処理
@@ -13,19 +19,54 @@ class StaffRequiredMixin(UserPassesTestMixin):
 
 class SalesSummaryView(StaffRequiredMixin, TemplateView):
     template_name = 'admin/admin_summary.html'
+    daily_days = 30      # 日次の表示日数
+    monthly_months = 12  # 月次の表示月数
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        MONTHLY_FEE = 300   # サービス設定金額
 
-        # 総売上と総会員数の集計
-        total_users = User.objects.filter(is_active=True,is_admin=False).count() # 総会員数
-        total_subscriptionusers = User.objects.filter(is_paymentstatus=True,is_admin=False).count() # 有料会員数
-        total_revenue = Order.objects.filter(is_confirmed=True).aggregate(Sum('amount'))['amount__sum'] or 0
+        # 総売上と総会員数の集計（注文・会員テーブルではなく集計テーブルから取得する）
+        totals = sales_totals()
+
+        context['total_users'] = totals['signups']                   # 総会員数
+        context['total_subscriptionusers'] = totals['paid_members']  # 有料会員数
+        context['total_revenue'] = totals['revenue']
+        context['total_tax'] = totals['tax']
+        context['fee'] = settings.MONTHLY_FEE
 
-        context['total_users'] = total_users
-        context['total_subscriptionusers'] = total_subscriptionusers
-        context['total_revenue'] = total_revenue
-        context['fee'] = MONTHLY_FEE
+        # 直近の日次・月次の推移
+        today = timezone.localdate()
+        context['daily_sales'] = SalesDaily.objects.filter(
+            date__gt=today - datetime.timedelta(days=self.daily_days),
+        ).order_by('-date')
+        first_month = today.replace(day=1)
+        for _ in range(self.monthly_months - 1):
+            first_month = (first_month - datetime.timedelta(days=1)).replace(day=1)
+        context['monthly_sales'] = SalesMonthly.objects.filter(date__gte=first_month).order_by('-date')
         
-        return context
\ No newline at end of file
+        return context
+
+
+# Stripeの価格キャッシュのヒット率とAPI呼び出しの所要時間（このプロセスの値）
+class StripeMetricsView(StaffRequiredMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse(stripe_catalog.metrics())
+
+
+# 注文・予約のCSV出力（?start=YYYY-MM-DD&end=YYYY-MM-DD&shop=店舗ID）
+class CsvExportView(StaffRequiredMixin, View):
+
+    def get(self, request, kind, *args, **kwargs):
+        export = EXPORTS.get(kind)
+        if export is None:
+            raise Http404
+        form = ExportFilterForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+
+        filters = form.cleaned_data
+        queryset = export.filter(export.model.objects.all(), **filters)
+        period = '_'.join(f'{filters[name]:%Y%m%d}' for name in ('start', 'end') if filters[name])
+        filename = f'{export.name}_{period or "all"}.csv'
+        return export.response(queryset, filename)
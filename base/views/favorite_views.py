@@ -1,55 +1,58 @@
-from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, TemplateView, DetailView, RedirectView
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
 from base.models import Shop, Favorite
-from django.db.models import Avg, Count # Avg
 from base.mixins import PaymentstatusRequiredMixin
+from base.pagination import CursorPaginationMixin
 
-class FavoritesView(LoginRequiredMixin, PaymentstatusRequiredMixin, ListView):
+# お気に入り一覧（登録日の新しい順にカーソル方式でページング）
+# お気に入りの件数に関わらずクエリ数が一定になるよう、関連データはまとめて取得する
+class FavoritesView(PaymentstatusRequiredMixin, CursorPaginationMixin, ListView):
     model = Favorite
     template_name = "pages/favorites.html"
     context_object_name = 'favorites'
-    # paginate_by = 10 # 必要に応じてページネーションを追加
+    paginate_by = 10
+    cursor_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user).select_related('shop')
+        return (
+            Favorite.objects.filter(user_id=self.membership.user_id)
+            .select_related('shop', 'shop__category', 'shop__rating')
+            .prefetch_related('shop__tags')
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        # 該当店舗の平均評価と件数をテンプレートに渡す処理
+        # 該当店舗の平均評価と件数をテンプレートに渡す処理（集計テーブルから取得）
         favorites_list = context['favorites']
         for favorite in favorites_list:
             shop = favorite.shop
-            review_stats = shop.reviews.all().aggregate(
-                average_rating=Avg('stars'), 
-                review_count=Count('id') 
-            )
-            shop.average_rating = review_stats['average_rating']
-            shop.review_count = review_stats['review_count']
+            rating = getattr(shop, 'rating', None)
+            shop.average_rating = rating.average_rating if rating else None
+            shop.review_count = rating.review_count if rating else 0
 
         return context
 
 
 # お気に入りの登録 or 解除を切り替える
-class FavoriteToggleView(LoginRequiredMixin, PaymentstatusRequiredMixin, RedirectView):
+class FavoriteToggleView(PaymentstatusRequiredMixin, RedirectView):
     http_method_names = ['post']
 
     def get_redirect_url(self, *args, **kwargs):
         shop_pk = self.kwargs.get('pk')
         shop = get_object_or_404(Shop, pk=shop_pk)
-        user = self.request.user
+        user_id = self.membership.user_id
 
         # 既存のお気に入りレコードを検索
-        favorite = Favorite.objects.filter(user=user, shop=shop).first()
+        favorite = Favorite.objects.filter(user_id=user_id, shop=shop).first()
 
         if favorite:
             # 存在すれば削除（解除）
             favorite.delete()
         else:
             # 存在しなければ作成（登録）
-            Favorite.objects.create(user=user, shop=shop)
+            Favorite.objects.create(user_id=user_id, shop=shop)
 
         # リダイレクト先の決定ロジック
         current_url_name = self.request.resolver_match.url_name
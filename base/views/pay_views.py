@@ -1,6 +1,8 @@
 from django.views.generic import TemplateView
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.contrib.auth import get_user_model
@@ -8,22 +10,36 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from base.models import User, Order
+from base.models import User
 from base.mixins import PaymentstatusRequiredMixin
+from base import membership, stripe_catalog, stripe_client, stripe_events
+import hashlib
+import logging
 import stripe
 
+logger = logging.getLogger('base.stripe')
+
 
 # 有料会員の登録ビュー
 class SubscriptionView(LoginRequiredMixin, TemplateView):
     template_name = "pages/payment_subscription.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fee'] = stripe_catalog.monthly_fee()
+        return context
+
 
-# Stripeの公開鍵をJSONで返すビュー
+# Stripeの公開鍵と価格をJSONで返すビュー
+# 内容はほとんど変わらないため、ブラウザにキャッシュさせ、ETagが一致する場合は304を返す
 @csrf_exempt
 def stripe_config(request):
     if request.method == 'GET':
-        stripe_config = {'publicKey': settings.STRIPE_PUBLIC_KEY}
-        return JsonResponse(stripe_config, safe=False)
+        stripe_config = {'publicKey': settings.STRIPE_PUBLIC_KEY, 'monthlyFee': stripe_catalog.monthly_fee()}
+        response = JsonResponse(stripe_config, safe=False)
+        response['ETag'] = quote_etag(hashlib.md5(response.content).hexdigest())
+        patch_cache_control(response, private=True, max_age=settings.STRIPE_CONFIG_MAX_AGE)
+        return get_conditional_response(request, etag=response['ETag'], response=response)
     
 
 
@@ -32,88 +48,55 @@ def stripe_config(request):
 def create_checkout_session(request):
     if request.method == 'GET':
         domain_url = request._current_scheme_host + '/subscription/'
-        stripe.api_key = settings.STRIPE_SECRET_KEY
         try:
-            checkout_session = stripe.checkout.Session.create(
-                client_reference_id=request.user.id if request.user.is_authenticated else None,
-                success_url=domain_url + 'success?session_id={CHECKOUT_SESSION_ID}',
-                cancel_url=domain_url + 'cancel/',
-                payment_method_types=['card'],
-                mode='subscription',
-                line_items=[
+            checkout_session = stripe_client.request('checkout.sessions.create', params={
+                'client_reference_id': request.user.id if request.user.is_authenticated else None,
+                'success_url': domain_url + 'success?session_id={CHECKOUT_SESSION_ID}',
+                'cancel_url': domain_url + 'cancel/',
+                'payment_method_types': ['card'],
+                'mode': 'subscription',
+                'line_items': [
                     {
                         'price': settings.STRIPE_PRICE_ID,
                         'quantity': 1,
                     }
                 ]
-            )
+            })
             return JsonResponse({'sessionId': checkout_session['id']})
         except Exception as e:
             return JsonResponse({'error': str(e)})
 
 # 支払いに成功した後の画面
+# 会員情報・注文の反映はwebhookで受信したイベントをワーカーが行うため、ここではStripeのAPIを呼び出さない
 def SubscriptionSuccess(request):
-    
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    session_id = request.GET.get('session_id')
 
-    if not request.user.is_authenticated:
+    # webhookで反映済みの場合に備えて、有料会員かどうかのスナップショットを読み直す
+    snapshot = membership.refresh(request)
+    if snapshot is None:
             messages.error(request, "セッションがタイムアウトしました。再度ログインしてください。")
             return redirect('login') # ログインページへリダイレクト
-        
-    try:
-        session = stripe.checkout.Session.retrieve(session_id)
-        user = get_object_or_404(User, id=request.user.id)
-
-        user.is_paymentstatus = True
-        user.stripe_customer_id = session['customer']
-        user.stripe_subscription_id = session['subscription']
-
-        setup_intent = stripe.SetupIntent.create(
-            customer=user.stripe_customer_id,
-            payment_method_types=["card"],
-        )
-        user.stripe_setup_intent = setup_intent.client_secret
-
-        stripe_customer = stripe.Customer.retrieve(user.stripe_customer_id)
-        user.stripe_card_name =  stripe_customer.name
-
-        stripe_PaymentMethod = stripe.PaymentMethod.list(
-            customer=user.stripe_customer_id,
-            type="card",
-        )
-
-        user.stripe_card_brand = stripe_PaymentMethod.data[0].card.brand
-        user.stripe_card_no = stripe_PaymentMethod.data[0].card.last4
-
-        user.save()
-
-        # Stripeのオブジェクトを取得
-        subscription = stripe.Subscription.retrieve(session['subscription'])
-        price_id = subscription['items']['data'][0]['price']['id']
-        price = stripe.Price.retrieve(price_id)
-        MONTHLY_FEE = price['unit_amount']
-
-        TAX_RATE = 10   # 消費税率10%
-        price_without_tax = int(MONTHLY_FEE / (1 + (TAX_RATE / 100)))
-
-        # (消費税額) = (税込み価格) - (税抜価格)
-        tax_amount = MONTHLY_FEE - price_without_tax
-
-        # Orderモデルに情報を保存
-        Order.objects.create(
-            user=user,
-            is_confirmed=True,  # 決済成功済み
-            amount=MONTHLY_FEE, # 支払額
-            tax_included=tax_amount, # 消費税額
-        )
 
+    if snapshot.is_paymentstatus:
         messages.info(request, '有料プランに登録しました')
-        return redirect('index')
+    else:
+        messages.info(request, '有料プランの登録を受け付けました。反映までしばらくお待ちください。')
+    return redirect('index')
 
-    except Exception as e:
-        messages.error(request, f"決済処理中にエラーが発生しました: {e}")
-        return redirect('subscription')
+
+# Stripeからのwebhook（署名を確認してイベントを保存し、すぐに応答する）
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    try:
+        event = stripe_events.parse_event(request.body.decode('utf-8'), request.META.get('HTTP_STRIPE_SIGNATURE', ''))
+    except stripe_events.WebhookNotConfigured:
+        logger.error('stripe webhook rejected: STRIPE_WEBHOOK_SECRET is not set')
+        return HttpResponse(status=503)
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+
+    stripe_events.record_event(event)
+    return HttpResponse(status=200)
     
 
 def SubscriptionCancel(request):
@@ -126,6 +109,11 @@ def SubscriptionCancel(request):
 class CancellationView(LoginRequiredMixin, TemplateView):
     template_name = "pages/payment_cancellation.html"
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['fee'] = stripe_catalog.monthly_fee()
+        return context
+
 # 退会処理
 @require_POST
 @login_required
@@ -138,8 +126,7 @@ def subscription_cancellation_save(request):
         return redirect('mypage')
     
     try:
-        stripe.api_key = settings.STRIPE_SECRET_KEY        
-        stripe.Subscription.delete(user.stripe_subscription_id)
+        stripe_client.request('subscriptions.cancel', user.stripe_subscription_id)
 
         user.is_paymentstatus = False
         user.stripe_customer_id = ''
@@ -148,7 +135,8 @@ def subscription_cancellation_save(request):
         user.stripe_card_brand= ''
         user.stripe_card_name = ''
         user.stripe_card_no = ''
-        user.save()
+        user.save()  # 解約数はシグナルで売上集計に加算される
+        membership.refresh(request)
 
         messages.info(request, '有料プランを解約しました')
 
@@ -161,18 +149,19 @@ def subscription_cancellation_save(request):
 
 
 # 支払方法変更ビュー
-class SubscriptionUpdateView(LoginRequiredMixin, PaymentstatusRequiredMixin, TemplateView):
+class SubscriptionUpdateView(PaymentstatusRequiredMixin, TemplateView):
     template_name = "pages/payment_edit.html"
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        # ログイン中の会員はStripeの列を除いて読み込まれるため、権限を確認したスナップショットの会員をカード情報の列ごと読み込む
+        context['user'] = get_object_or_404(User, pk=self.membership.user_id)
         return context
     
 @require_POST
 @login_required
 def subscription_update_save(request):
     user = get_object_or_404(get_user_model(), id=request.user.id)
-    stripe.api_key = settings.STRIPE_SECRET_KEY
     
     # 1. POSTデータから Payment Method ID を取得
     payment_method_id = request.POST.get('payment_method_id')
@@ -187,22 +176,19 @@ def subscription_update_save(request):
         return redirect('subscription_update')
 
     try:
-        # 2. Stripe処理：新しい支払い方法を顧客に関連付ける
-        stripe.PaymentMethod.attach(
-            payment_method_id,
-            customer=user.stripe_customer_id,
+        # 2. Stripe処理：新しい支払い方法を顧客に関連付ける（カードの詳細情報も返される）
+        pm = stripe_client.request(
+            'payment_methods.attach', payment_method_id,
+            params={'customer': user.stripe_customer_id},
         )
 
         # 3. Stripe処理：支払い方法を新しいものに更新する
-        stripe.Subscription.modify(
-            user.stripe_subscription_id,
-            default_payment_method=payment_method_id,
+        stripe_client.request(
+            'subscriptions.update', user.stripe_subscription_id,
+            params={'default_payment_method': payment_method_id},
         )
 
-        # 4. Stripe処理：新しい支払い方法の詳細情報を取得
-        pm = stripe.PaymentMethod.retrieve(payment_method_id)
-
-        # 5. DB更新：ユーザーモデルに最新のカード情報を保存
+        # 4. DB更新：ユーザーモデルに最新のカード情報を保存
         user.stripe_card_name = card_name # ユーザーが入力した名義人
         user.stripe_card_brand = pm.card.brand
         user.stripe_card_no = pm.card.last4
@@ -1,18 +1,19 @@
-from django.views.generic import ListView, DetailView, CreateView, DeleteView
+from django.views.generic import ListView, DetailView, CreateView, DeleteView, View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from base.models import Shop, Reserve
 from base.forms import ReserveForm
 from datetime import date
 from django.shortcuts import get_object_or_404, redirect
-from django.db.models import Avg, Count
 from django.contrib import messages
 from django.views.generic import DeleteView
 from base.mixins import PaymentstatusRequiredMixin
 from django.utils import timezone
+from django.http import JsonResponse
+from base import availability, booking, ids
 
 # 予約作成ビュー
-class ReserveCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, CreateView):
+class ReserveCreateView(PaymentstatusRequiredMixin, CreateView):
     model = Reserve
     form_class = ReserveForm
     template_name = 'pages/reserve_create.html'
@@ -28,29 +29,38 @@ class ReserveCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, CreateVi
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         # 店舗情報、レビュー情報などをテンプレートに渡す
-        shop = get_object_or_404(Shop, pk=self.kwargs['pk'])
+        shop = get_object_or_404(Shop.objects.with_rating(), pk=self.kwargs['pk'])
         context['shop'] = shop
         
-        # 評価情報の集計を渡す
-        review_stats = shop.reviews.all().aggregate(
-            average_rating=Avg('stars'), 
-            review_count=Count('id')
-        )
-        context['average_rating'] = review_stats['average_rating']
-        context['review_count'] = review_stats['review_count']
+        # 評価情報を渡す（集計テーブルから取得）
+        context['average_rating'] = shop.average_rating
+        context['review_count'] = shop.review_count
 
         return context
     
     # バリデーション成功後の保存処理
+    # 定員の確認と予約の作成は base.booking でまとめて行い、同時に予約されても定員を超えないようにする
+    # 予約する会員は権限を確認したスナップショットの会員（request.user は読み込まない）
     def form_valid(self, form):
-        form.instance.user = self.request.user
-        form.instance.shop = get_object_or_404(Shop, pk=self.kwargs['pk'])
+        shop = get_object_or_404(Shop, pk=self.kwargs['pk'])
+        try:
+            self.object = booking.book(
+                user_id=self.membership.user_id,
+                shop=shop,
+                reserved_date=form.cleaned_data['reserved_date'],
+                reserved_time=form.cleaned_data['reserved_time'],
+                number_of_people=form.cleaned_data['number_of_people'],
+            )
+        except booking.SlotFullError as e:
+            form.add_error(None, f'選択された時間は満席のため予約できません。（残り{e.remaining}名）')
+            response = self.form_invalid(form)
+            response.status_code = 409
+            return response
         
         # 予約が完了したメッセージを表示
-        messages.success(self.request, f'【{form.instance.shop.name}】の予約が完了しました。')
+        messages.success(self.request, f'【{shop.name}】の予約が完了しました。')
         
-        # CreateView の form_valid は、設定された instance を保存し、get_success_urlへリダイレクトします
-        return super().form_valid(form)
+        return redirect(self.get_success_url())
     
     # フォームにエラーがあった場合
     def form_invalid(self, form):
@@ -62,8 +72,29 @@ class ReserveCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, CreateVi
         return reverse_lazy('reserve_list') 
 
 
+# 予約カレンダー用の空き状況（1か月分をJSONで返す）
+# URLパラメータ month=YYYY-MM（未指定の場合は今月）
+class ReserveAvailabilityView(View):
+
+    def get(self, request, *args, **kwargs):
+        shop = get_object_or_404(Shop, pk=self.kwargs['pk'])
+        today = timezone.localdate()
+        try:
+            year, month = map(int, request.GET.get('month', today.strftime('%Y-%m')).split('-'))
+            date(year, month, 1)
+        except ValueError:
+            return JsonResponse({'error': 'month は YYYY-MM の形式で指定してください。'}, status=400)
+
+        return JsonResponse({
+            'shop': shop.pk,
+            'month': f'{year}-{month:02d}',
+            'capacity': shop.reserve_capacity,
+            'dates': availability.month_availability(shop, year, month),
+        })
+
+
 # 予約一覧のビュー
-class ReserveListView(LoginRequiredMixin, PaymentstatusRequiredMixin, ListView):
+class ReserveListView(PaymentstatusRequiredMixin, ListView):
     model = Reserve
     template_name = 'pages/reserve_list.html'
     context_object_name = 'reservations'
@@ -71,7 +102,7 @@ class ReserveListView(LoginRequiredMixin, PaymentstatusRequiredMixin, ListView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['reservations'] = Reserve.objects.filter(user=self.request.user).order_by('-reserved_date') 
+        context['reservations'] = Reserve.objects.filter(user_id=self.membership.user_id).order_by('-reserved_date') 
         context['today'] = date.today() 
         context['now'] = timezone.now()
 
@@ -83,6 +114,10 @@ class ReserveDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     model = Reserve
     template_name = 'pages/reserve_delete.html'
     success_url = reverse_lazy('reserve_list')
+
+    # 新しい予約番号（整数）と移行前の予約番号（文字列）のどちらのURLでも開けるようにする
+    def get_object(self, queryset=None):
+        return get_object_or_404(Reserve, ids.lookup(self.kwargs['pk']))
     
     # 予約の所有者であることをテスト
     def test_func(self):
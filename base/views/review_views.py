@@ -1,56 +1,94 @@
-from django.views.generic import DetailView, CreateView, DeleteView
+from django.views.generic import DetailView, CreateView, DeleteView, View
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404
-from base.models import Shop, Review
+from django.http import JsonResponse
+from django.utils import timezone
+from base.models import Favorite, Shop, Review
 from base.forms import ReviewForm # 追加：作成したフォームをインポート
-from django.db.models import Avg, Count
-from base.mixins import PaymentstatusRequiredMixin
+from django.db import transaction
+from base.mixins import MembershipLoginRequiredMixin, PaymentstatusRequiredMixin
+from base.pagination import CursorPaginator, InvalidCursor, paginate_by_cursor
+
+# 店舗の他のユーザーのレビューを作成日の新しい順に1ページ分取得する（投稿者は結合して取得）
+def other_reviews_page(shop, user_id, per_page, cursor=None, strict=False):
+    reviews = Review.objects.filter(shop=shop).exclude(user_id=user_id).select_related('user')
+    paginator = CursorPaginator(reviews, per_page, ordering=('-created_at', '-id'))
+    # strict の場合、不正なカーソルは InvalidCursor を送出する
+    return paginator.page(cursor) if strict else paginate_by_cursor(paginator, cursor)
+
+
+def review_json(review):
+    return {
+        'id': review.pk,
+        'username': review.user.username if review.user_id else '',
+        'stars': review.stars,
+        'comment': review.comment,
+        'created_at': timezone.localtime(review.created_at).strftime('%Y/%m/%d'),
+    }
+
 
 # レビュー一覧
-class ShopReviewView(LoginRequiredMixin, DetailView):
+# 店舗・お気に入りかどうか・自分のレビュー・他のユーザーのレビュー1ページ分（投稿者を含む）をそれぞれ1クエリで取得する（4クエリ。無料会員は自分のレビューを取得しないため3クエリ）
+class ShopReviewView(MembershipLoginRequiredMixin, DetailView):
     model = Shop
     template_name = "pages/reviews_list.html"
+    paginate_by = 10
+    # 無料会員に内容をぼかして表示する件数
+    preview_count = 3
+
+    def get_queryset(self):
+        return super().get_queryset().with_rating()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        # 平均値計算ロジック
-        review_stats = self.object.reviews.all().aggregate(
-            average_rating=Avg('stars'), 
-            review_count=Count('id') 
-        )
-        context['average_rating'] = review_stats['average_rating']
-        context['review_count'] = review_stats['review_count']
-
-        # 対象店舗の全レビューを作成日の新しい順に取得
-        all_reviews = self.object.reviews.all().order_by('-created_at')
+        shop = self.object
+        # 有料会員かどうかはセッションのスナップショットで判定する（base/membership.py）
+        snapshot = self.membership
+        # 平均評価とレビュー件数（集計テーブルから取得）
+        context['average_rating'] = shop.average_rating
+        context['review_count'] = shop.review_count
+        context['favorites'] = int(Favorite.objects.filter(user_id=snapshot.user_id, shop=shop).exists())
 
         my_review = None
-        other_reviews = []
-        is_reviewed = False
-
-        try:
-            my_review = all_reviews.get(user=self.request.user)
-            is_reviewed = True
-            
-            # 自分のレビューを除いた他のレビューを取得 (all_reviewsから除外)
-            other_reviews = all_reviews.exclude(user=self.request.user)
-
-        except Review.DoesNotExist:
-            # 自分のレビューがなければ、他のレビューを含む全てのレビューが other_reviews になる
-            # is_reviewed は False のまま
-            other_reviews = all_reviews
+        if snapshot.is_paymentstatus:
+            my_review = Review.objects.filter(shop=shop, user_id=snapshot.user_id).select_related('user').first()
+            page = other_reviews_page(shop, snapshot.user_id, self.paginate_by, self.request.GET.get('cursor'))
+        else:
+            page = other_reviews_page(shop, snapshot.user_id, self.preview_count)
 
         # テンプレートの処理
         context['my_review'] = my_review    # 自分のレビュー
-        context['other_reviews'] = other_reviews    # 他のユーザーのレビュー
-        context['is_reviewed'] = is_reviewed # レビュー投稿ボタンの表示制御に使用
+        context['other_reviews'] = page.object_list    # 他のユーザーのレビュー
+        context['page_obj'] = page
+        context['is_reviewed'] = my_review is not None # レビュー投稿ボタンの表示制御に使用
 
         return context
-            
+
+
+# レビュー一覧の「もっと見る」（次のページをJSONで返す）
+# URLパラメータ cursor=一覧ページ・前回の応答の next_cursor
+class ShopReviewMoreView(MembershipLoginRequiredMixin, View):
+    raise_exception = True
+
+    def get(self, request, *args, **kwargs):
+        snapshot = self.membership
+        if not snapshot.is_paymentstatus:
+            return JsonResponse({'error': 'レビューを表示するには有料プランへの登録が必要です。'}, status=403)
+        shop = get_object_or_404(Shop.objects.only('pk'), pk=self.kwargs['pk'])
+        try:
+            page = other_reviews_page(shop, snapshot.user_id, ShopReviewView.paginate_by, request.GET.get('cursor'), strict=True)
+        except InvalidCursor:
+            return JsonResponse({'error': 'cursor が正しくありません。'}, status=400)
+
+        return JsonResponse({
+            'reviews': [review_json(review) for review in page],
+            'next_cursor': page.next_cursor,
+        })
+
 
 # レビューの作成
-class ShopReviewCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, CreateView):
+class ShopReviewCreateView(PaymentstatusRequiredMixin, CreateView):
     model = Review
     form_class = ReviewForm
     template_name = "pages/reviews_create.html"
@@ -59,16 +97,12 @@ class ShopReviewCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, Creat
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         shop_pk = self.kwargs.get('pk') 
-        shop = get_object_or_404(Shop, pk=shop_pk)
+        shop = get_object_or_404(Shop.objects.with_rating(), pk=shop_pk)
         context['shop'] = shop
 
-        # 平均値計算ロジック
-        review_stats = shop.reviews.all().aggregate(
-            average_rating=Avg('stars'), 
-            review_count=Count('id') 
-        )
-        context['average_rating'] = review_stats['average_rating']
-        context['review_count'] = review_stats['review_count']
+        # 平均評価とレビュー件数（集計テーブルから取得）
+        context['average_rating'] = shop.average_rating
+        context['review_count'] = shop.review_count
         
         return context    
 
@@ -78,10 +112,12 @@ class ShopReviewCreateView(LoginRequiredMixin, PaymentstatusRequiredMixin, Creat
         shop = get_object_or_404(Shop, pk=self.kwargs.get('pk'))
         review.shop = shop    
     
-        review.user = self.request.user
+        # 投稿者は権限を確認したスナップショットの会員（request.user は読み込まない）
+        review.user_id = self.membership.user_id
         
-        # レビューを保存
-        review.save()       
+        # レビューを保存（評価集計の更新はシグナルで同じトランザクション内に反映）
+        with transaction.atomic():
+            review.save()       
         return super().form_valid(form)
     
     # 投稿成功時のリダイレクト先
@@ -99,6 +135,11 @@ class ShopReviewDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
         shop_pk = self.kwargs['shop_pk']
         return reverse_lazy('reviews', kwargs={'pk': shop_pk})
     
+    # レビューの削除と評価集計の更新をまとめて確定させる
+    @transaction.atomic
+    def form_valid(self, form):
+        return super().form_valid(form)
+
     # 削除できるのは自分のレビューのみ
     def test_func(self):
         # URLから削除対象のレビューを取得
@@ -1,21 +1,23 @@
 from django.shortcuts import render
 from django.views.generic import ListView, DetailView
 from base.models import Shop, Category, Tag, Favorite
-from django.db.models import Avg, Q, Count
+from base import fragments, membership, replicas
+from base.search import search_shops
+from base.pagination import CursorPaginationMixin
 from django.shortcuts import get_object_or_404, redirect
 
-class IndexListView(ListView):
+class IndexListView(CursorPaginationMixin, ListView):
     model = Shop
     template_name = 'pages/index.html'
+    paginate_by = 12
+    cursor_ordering = ('-id',)
 
     # レビューの評価値取得のために
     # object_list の代わりに shop_list を使う
     context_object_name = 'shop_list'
     def get_queryset(self):
-        queryset = super().get_queryset().annotate(
-            average_rating=Avg('reviews__stars'), 
-            review_count=Count('reviews') 
-        ).order_by('-id') 
+        # 評価は集計テーブルから取得する
+        queryset = super().get_queryset().with_rating().select_related('category').order_by('-id')
         
         return queryset
     
@@ -33,40 +35,49 @@ class ShopDetailView(DetailView):
     model = Shop
     template_name = 'pages/restaurants_detail.html'
 
+    # レプリカに店舗の変更がまだ届いていない場合は、断片キャッシュに古い内容を保存しないようプライマリから読み込む
+    def get(self, request, *args, **kwargs):
+        if fragments.lagging_shops([self.kwargs['pk']]):
+            replicas.deactivate()
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        return super().get_queryset().with_rating().select_related('category')
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_obj = self.request.user
-        shop = get_object_or_404(Shop, pk=self.kwargs['pk'])
-        if user_obj.is_authenticated:
-            context['favorites'] = Favorite.objects.filter(user=self.request.user, shop=shop).count()
+        snapshot = membership.get(self.request)
+        shop = self.object
+        if snapshot is not None:
+            context['favorites'] = Favorite.objects.filter(user_id=snapshot.user_id, shop=shop).count()
         else:
             context['favorites'] = 0
 
-        # レビュー評価の平均値をテンプレートに渡す
-        review_stats = shop.reviews.all().aggregate(
-            average_rating=Avg('stars'), 
-            review_count=Count('id') 
-        )
-        context['average_rating'] = review_stats['average_rating']
-        context['review_count'] = review_stats['review_count']
+        # レビュー評価の平均値をテンプレートに渡す（集計テーブルから取得）
+        context['average_rating'] = shop.average_rating
+        context['review_count'] = shop.review_count
 
         return context
 
 
 
 # 検索した際に表示する店舗一覧ページ
-class ShopListView(ListView):
+class ShopListView(CursorPaginationMixin, ListView):
     model = Shop
     template_name = 'pages/restaurants_list.html'
     context_object_name = 'shops'
     ordering = 'created_at' #新規掲載順
-    # paginate_by = 10   # 1ページにいくつ表示するか
+    paginate_by = 10   # 1ページにいくつ表示するか
+    cursor_ordering = ('created_at', 'id')
+
+    # キーワード検索の場合は関連度順
+    def get_cursor_ordering(self):
+        if self.request.GET.get('keyword'):
+            return ('-search_score', 'created_at', 'id')
+        return self.cursor_ordering
 
     def get_queryset(self):
-        queryset = super().get_queryset().filter(is_published=True).annotate(
-                    average_rating=Avg('reviews__stars'),
-                    review_count=Count('reviews')
-                )
+        queryset = super().get_queryset().published().with_rating().select_related('category')
         # 絞り込み処理を実行する
         queryset = self._filter_by_all_params(queryset)
         return queryset
@@ -86,21 +97,10 @@ class ShopListView(ListView):
     def _filter_by_all_params(self, queryset):
 
         # キーワードによる絞り込み (URLパラメータ:keyword )
+        # n-gramの検索インデックスから取得し、関連度の高い順に並べる
         keyword = self.request.GET.get('keyword')
         if keyword:
-            words = keyword.replace('　', ' ').split()
-
-            # 複数の単語による検索クエリ
-            for word in words:
-                if word:
-                    query = (
-                    Q(name__icontains=word) |
-                    Q(address__icontains=word) |
-                    Q(description__icontains=word) |
-                    Q(tags__name__icontains=word) | 
-                    Q(category__name__icontains=word) 
-                )
-                queryset = queryset.filter(query)
+            queryset = search_shops(queryset, keyword).order_by('-search_score', 'created_at')
 
 
         # カテゴリーIDによる絞り込み (URLパラメータ: category_id)
@@ -9,6 +9,8 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('summary/', views.SalesSummaryView.as_view(), name='admin_summary'),
+    path('summary/stripe-metrics/', views.StripeMetricsView.as_view(), name='stripe_metrics'),
+    path('summary/export/<str:kind>/', views.CsvExportView.as_view(), name='admin_export'),
 
     # トップページ
     path('', views.IndexListView.as_view(), name='index'),
@@ -35,11 +37,13 @@ urlpatterns = [
 
     # review
     path('restaurants/<int:pk>/reviews/', views.ShopReviewView.as_view(), name='reviews'),
+    path('restaurants/<int:pk>/reviews/more/', views.ShopReviewMoreView.as_view(), name='reviews_more'),
     path('restaurants/<int:pk>/reviews/create/', views.ShopReviewCreateView.as_view(), name='review_create'),
     path('restaurants/<int:shop_pk>/reviews/<int:review_pk>/delete/', views.ShopReviewDeleteView.as_view(), name='review_delete'),
 
     # reserve
     path('restaurants/<int:pk>/reserve/', views.ReserveCreateView.as_view(), name='reserve'),
+    path('restaurants/<int:pk>/reserve/availability/', views.ReserveAvailabilityView.as_view(), name='reserve_availability'),
     path('mypage/reservations/', views.ReserveListView.as_view(), name='reserve_list'),
     path('reserve/<str:pk>/delete/', views.ReserveDeleteView.as_view(), name='reserve_delete'),
 
@@ -55,6 +59,7 @@ urlpatterns = [
 
     path('subscription/config/', views.stripe_config, name='stripe_config'),
     path('subscription/create-checkout-session/', views.create_checkout_session, name='create_checkout_session'),
+    path('subscription/webhook/', views.stripe_webhook, name='stripe_webhook'),
 
     # カード情報の変更
     path('subscription/update/', views.SubscriptionUpdateView.as_view(), name="subscription_update"),